@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+"""
+Benchmark the stages of the cml_lab module on synthetic CDP output.
+
+For each number of devices, the neighbors generated by cdp_synth.py are run
+through the same stages as the module: parsing, link deduplication, creating
+the nodes, adding the links and creating the interface mappings.  Each stage
+is timed (the best of --repeat runs) and then run again under tracemalloc for
+the peak memory it allocates.  With --format text structured, the topology
+and mappings built from both forms of the neighbors are checked to be the
+same, and a difference is reported as MISMATCH.
+
+    python benchmarks/bench_cml_lab.py --devices 10 1000 10000
+"""
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+from cdp_synth import DEFAULT_MAPPINGS, DEVICE_TEMPLATE, add_arguments, synth_devices, synth_options
+from collection import add_collection_path
+
+add_collection_path()
+
+from ansible_collections.ciscops.mdd.plugins.modules import cml_lab  # noqa: E402
+
+STAGES = ("parse_cdp_output", "link dedup", "create_initial", "add_links", "interface_mapping")
+
+
+def parse(devices):
+    results = []
+    for device in devices:
+        results.append(cml_lab.parse_cdp_output(device["cdp"], device))
+    return results
+
+
+def deduplicate(parsed):
+    device_links = cml_lab.LinkGraph()
+    remote_device_info_full = {}
+    for links, remote_device_info in parsed:
+        remote_device_info_full.update(remote_device_info)
+        for link in links:
+            device_links.add(link)
+    devices_with_interface_dict = cml_lab.check_for_and_remove_error_links(device_links)
+    cml_lab.sort_device_interfaces(devices_with_interface_dict)
+    return device_links, remote_device_info_full, devices_with_interface_dict
+
+
+def run_stages(devices, start_from=2, measure=None):
+    """
+    Run the module's stages on devices, calling measure(stage, function) to
+    run each.  Returns the topology and mappings.
+    """
+    device_names = cml_lab.get_device_names(devices)
+    parsed = measure("parse_cdp_output", lambda: parse(devices))
+    device_links, remote_device_info_full, devices_with_interface_dict = measure(
+        "link dedup", lambda: deduplicate(parsed))
+    topology, mappings_cml = measure("create_initial", lambda: cml_lab.cml_topology_create_initial(
+        devices_with_interface_dict, remote_device_info_full, start_from, DEVICE_TEMPLATE, False, device_names))
+    measure("add_links", lambda: cml_lab.cml_topology_add_links(topology, mappings_cml, device_links, device_names))
+    mappings = measure("interface_mapping",
+                       lambda: cml_lab.create_interface_mapping_dict(mappings_cml, DEFAULT_MAPPINGS))
+    return topology, mappings
+
+
+def time_stages(devices, repeat):
+    """
+    The best time of each stage over repeat runs
+    """
+    seconds = dict((stage, None) for stage in STAGES)
+
+    def measure(stage, function):
+        gc.collect()
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        if seconds[stage] is None or elapsed < seconds[stage]:
+            seconds[stage] = elapsed
+        return result
+
+    for _ in range(repeat):
+        result = run_stages(devices, measure=measure)
+    return seconds, result
+
+
+def trace_stages(devices):
+    """
+    The peak memory allocated by each stage, over what was allocated before it
+    """
+    peaks = {}
+
+    def measure(stage, function):
+        gc.collect()
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        result = function()
+        peaks[stage] = tracemalloc.get_traced_memory()[1] - before
+        return result
+
+    tracemalloc.start()
+    try:
+        run_stages(devices, measure=measure)
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--devices", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=3, help="The number of timed runs of each stage")
+    parser.add_argument("--format", nargs="+", choices=["text", "structured"], default=["text"],
+                        help="Give the neighbors as the text of show cdp neighbors, as Genie parses them, or both")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the runs under tracemalloc")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    rows = []
+    print("{0:>7}  {1:<10} {2:<18} {3:>9} {4:>9}".format("devices", "format", "stage", "seconds", "peak MiB"),
+          file=sys.stderr)
+    for count in args.devices:
+        expected = None
+        for cdp_format in args.format:
+            options = dict(synth_options(args), structured=cdp_format == "structured")
+            devices = synth_devices(count, **options)
+            seconds, result = time_stages(devices, args.repeat)
+            peaks = {} if args.no_memory else trace_stages(devices)
+            result = json.loads(json.dumps(result))
+            if expected is None:
+                expected = result
+            topology, mappings = result
+            for stage in STAGES + ("total", ):
+                row = {
+                    "devices": count,
+                    "format": cdp_format,
+                    "stage": stage,
+                    "seconds": round(sum(seconds.values()) if stage == "total" else seconds[stage], 4),
+                    "peak_mib": round((max(peaks.values()) if stage == "total" else peaks[stage]) / 1048576.0, 2)
+                    if peaks else None,
+                    "nodes": len(topology["nodes"]),
+                    "links": len(topology["links"]),
+                    "matches": result == expected
+                }
+                rows.append(row)
+                print("{devices:>7}  {format:<10} {stage:<18} {seconds:>9.4f} {0:>9}{1}".format(
+                    "-" if row["peak_mib"] is None else "{0:.2f}".format(row["peak_mib"]),
+                    "" if row["matches"] else "  MISMATCH", **row), file=sys.stderr)
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    return 0 if all(row["matches"] for row in rows) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
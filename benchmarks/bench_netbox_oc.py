@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+Benchmark the netbox_oc lookup against the NetBox replay server.
+
+For each number of devices, every scenario produces the OC data for all the
+devices and reports the lookups (devices) per second and the requests and
+connections the replay server saw.  The results of every scenario are
+checked against the first so that a faster path that returns different data
+is caught.
+
+    python benchmarks/bench_netbox_oc.py --devices 1 100 1000 --latency 0.005
+"""
+import argparse
+import json
+import shutil
+import sys
+import tempfile
+import time
+
+from collection import add_collection_path
+from netbox_replay import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, serve
+
+add_collection_path()
+
+from ansible_collections.ciscops.mdd.plugins.lookup import netbox_oc  # noqa: E402
+from ansible_collections.ciscops.mdd.plugins.module_utils import netbox_oc as netbox_utils  # noqa: E402
+
+
+def per_host(url, names, options, cache_dir=None):
+    """
+    One lookup per device, as the data role does without bulk
+    """
+    new_session = options.pop("new_session", False)
+    results = {}
+    for name in names:
+        if new_session:
+            # As when each lookup runs in its own fork, with no session to reuse
+            netbox_utils._netbox_apis.clear()
+        results[name] = netbox_oc.LookupModule().run([name], api_endpoint=url, token="0123456789abcdef",
+                                                     **dict(options, cache_dir=cache_dir))
+    return results
+
+
+def bulk(url, names, options, cache_dir=None):
+    """
+    One lookup for all the devices
+    """
+    return netbox_oc.LookupModule().run(names, api_endpoint=url, token="0123456789abcdef", bulk=True,
+                                        **dict(options, cache_dir=cache_dir))[0]
+
+
+# name, function, lookup options, whether to run once to fill the cache first
+SCENARIOS = [
+    ("per-host, new session", per_host, {"new_session": True}, False),
+    ("per-host", per_host, {}, False),
+    ("bulk", bulk, {}, False),
+    ("bulk, raw json", bulk, {"raw_json": True}, False),
+    ("bulk, graphql", bulk, {"mode": "graphql"}, False),
+    ("bulk, cached", bulk, {"cache_ttl": 3600}, True),
+    ("bulk, cache refresh", bulk, {"cache_ttl": 0}, True),
+]
+
+
+def run_scenario(server, names, function, options, warm):
+    cache_dir = None
+    if "cache_ttl" in options:
+        cache_dir = tempfile.mkdtemp(prefix="mdd-bench-cache-")
+    try:
+        netbox_utils._netbox_apis.clear()
+        if warm:
+            function(server.url, names, dict(options), cache_dir)
+        server.stats.reset()
+        start = time.perf_counter()
+        result = function(server.url, names, dict(options), cache_dir)
+        elapsed = time.perf_counter() - start
+        stats = server.stats.reset()
+    finally:
+        if cache_dir:
+            shutil.rmtree(cache_dir, True)
+    return result, elapsed, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--devices", type=int, nargs="+", default=[1, 100, 1000])
+    parser.add_argument("--latency", type=float, default=0.005, help="Seconds the server waits before each response")
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE, help="The server's default page size")
+    parser.add_argument("--max-page-size", type=int, default=MAX_PAGE_SIZE, help="The server's maximum page size")
+    parser.add_argument("--max-workers", type=int, default=4)
+    parser.add_argument("--scenario", action="append", choices=[scenario[0] for scenario in SCENARIOS],
+                        help="Only run the given scenarios (all by default)")
+    parser.add_argument("--skip-per-host-above", type=int, default=1000,
+                        help="Skip the per-host scenarios for more devices than this")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    rows = []
+    print("{0:>7}  {1:<22} {2:>9} {3:>11} {4:>9} {5:>11}".format(
+        "devices", "scenario", "seconds", "lookups/s", "requests", "connections"), file=sys.stderr)
+    for devices in args.devices:
+        server = serve(devices, args.latency, args.page_size, args.max_page_size)
+        names = ["{0}-{1}".format("edge-rtr", index + 1) for index in range(devices)]
+        expected = None
+        try:
+            for name, function, options, warm in SCENARIOS:
+                if args.scenario and name not in args.scenario:
+                    continue
+                if function is per_host and devices > args.skip_per_host_above:
+                    continue
+                options = dict(options, max_workers=args.max_workers)
+                result, elapsed, stats = run_scenario(server, names, function, options, warm)
+                result = json.loads(json.dumps(result))
+                if expected is None:
+                    expected = result
+                row = {
+                    "devices": devices,
+                    "scenario": name,
+                    "seconds": round(elapsed, 4),
+                    "lookups_per_second": round(devices / elapsed, 1),
+                    "requests": stats.get("requests", 0),
+                    "connections": stats.get("connections", 0),
+                    "requests_by_resource": dict((key, value) for key, value in stats.items()
+                                                 if key not in ("requests", "connections")),
+                    "matches": result == expected
+                }
+                rows.append(row)
+                print("{devices:>7}  {scenario:<22} {seconds:>9.3f} {lookups_per_second:>11.1f} {requests:>9} "
+                      "{connections:>11}{0}".format("" if row["matches"] else "  MISMATCH", **row), file=sys.stderr)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    return 0 if all(row["matches"] for row in rows) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+"""
+Generate synthetic show cdp neighbors output for the cml_lab module.
+
+Each device gets neighbors picked at random until the average number of
+neighbors is about --degree.  Both ends of every link are listed, the
+neighbor's capabilities and platform follow its type, and a fraction of
+entries are generated the ways real devices vary:
+
+  malformed   the name wrapped onto a line of its own (as long and fully
+              qualified names are), stray whitespace, a platform with spaces
+              in it, or no "Total cdp entries" line at the end
+  duplicates  the same entry listed twice
+  conflicts   a local interface reused for a second neighbor, which cml_lab
+              drops as an error link
+  hosts       a Linux host entry, which cml_lab skips
+
+Write the module arguments for 100 devices, to run the module directly:
+
+    python benchmarks/cdp_synth.py --devices 100 > /tmp/args.json
+    python plugins/modules/cml_lab.py /tmp/args.json
+"""
+import argparse
+import json
+import random
+import sys
+
+HEADER = ("\r\nCapability Codes: R - Router, T - Trans Bridge, B - Source Route Bridge\r\n"
+          "                  S - Switch, H - Host, I - IGMP, r - Repeater, P - Phone,\r\n"
+          "                  D - Remote, C - CVTA, M - Two-port Mac Relay\r\n\r\n"
+          "Device ID        Local Intrfce     Holdtme    Capability  Platform  Port ID\r\n")
+
+# The capabilities and platform each type of device advertises
+PLATFORMS = {
+    "router": ("R I", "CSR1000V"),
+    "switch": ("S I", "WS-C3850"),
+    "l3switch": ("R S I", "C9300-24P"),
+}
+
+DEVICE_TEMPLATE = {
+    "switch": {"node_definition": "iosvl2", "ram": 768, "tags": ["switch"], "type": "switch"},
+    "router": {"node_definition": "csr1000v", "ram": 3072, "tags": ["router"], "type": "router"},
+    "l3switch": {"node_definition": "iosvl2", "ram": 768, "tags": ["l3switch"], "type": "l3switch"},
+    "ext_conn": {"node_definition": "external_connector", "ram": 0, "tags": []},
+}
+
+DEFAULT_MAPPINGS = {
+    "Loopback(\\d+)": "Loopback\\1",
+    "Port-channel(\\d+)": "Port-channel\\1",
+    "Vlan(\\d+)": "Vlan\\1",
+}
+
+
+def neighbor_graph(rnd, names, degree):
+    """
+    Pick the neighbors of each device, returning for each device a list of
+    (neighbor, local interface, remote interface)
+    """
+    used = dict((name, 0) for name in names)
+    neighbors = dict((name, []) for name in names)
+    if len(names) < 2:
+        return neighbors
+    for _ in range(int(len(names) * degree / 2)):
+        local, remote = rnd.sample(names, 2)
+        used[local] += 1
+        used[remote] += 1
+        local_interface = "Gig 0/{0}".format(used[local])
+        remote_interface = "Gig 0/{0}".format(used[remote])
+        neighbors[local].append((remote, local_interface, remote_interface))
+        neighbors[remote].append((local, remote_interface, local_interface))
+    return neighbors
+
+
+def entry_lines(rnd, remote, local_interface, remote_interface, remote_type, malformed):
+    capabilities, platform = PLATFORMS[remote_type]
+    if rnd.random() < malformed:
+        variant = rnd.randrange(3)
+        if variant == 0:
+            return ["{0}.mdd.cisco.com".format(remote),
+                    "                 {0:<17} 155              {1:<11} {2:<9} {3}".format(
+                        local_interface, capabilities, platform, remote_interface)]
+        if variant == 1:
+            return ["{0}  \t {1:<17}  155   {2}   {3}   {4}   ".format(
+                remote, local_interface, capabilities, platform, remote_interface)]
+        return ["{0:<16} {1:<17} 155              {2:<11} cisco {3} {4}".format(
+            remote, local_interface, capabilities, platform, remote_interface)]
+    return ["{0:<16} {1:<17} 155              {2:<11} {3:<9} {4}".format(
+        remote, local_interface, capabilities, platform, remote_interface)]
+
+
+def structured_entry(remote, local_interface, remote_interface, remote_type):
+    capabilities, platform = PLATFORMS[remote_type]
+    return {
+        "device_id": remote,
+        "local_interface": local_interface.replace("Gig ", "GigabitEthernet"),
+        "port_id": remote_interface.replace("Gig ", "GigabitEthernet"),
+        "capability": capabilities,
+        "platform": platform,
+        "hold_time": 155,
+    }
+
+
+def synth_devices(count, degree=3.0, platforms=None, malformed=0.05, duplicates=0.02, conflicts=0.02, hosts=0.1,
+                  structured=False, seed=1):
+    """
+    Return count devices for the devices option of cml_lab, each with the
+    text of show cdp neighbors, or with the neighbors as Genie parses them
+    when structured
+    """
+    rnd = random.Random(seed)
+    # How the text is malformed is picked separately, so that the text and
+    # structured neighbors of the same seed are the same
+    text_rnd = random.Random(seed + 1)
+    platforms = platforms or dict((device_type, 1) for device_type in PLATFORMS)
+    device_types = sorted(platforms)
+    weights = [platforms[device_type] for device_type in device_types]
+    names = ["dev{0}".format(index) for index in range(count)]
+    types = dict((name, rnd.choices(device_types, weights)[0]) for name in names)
+    neighbors = neighbor_graph(rnd, names, degree)
+
+    devices = []
+    for name in names:
+        entries = list(neighbors[name])
+        for entry in list(entries):
+            if rnd.random() < duplicates:
+                entries.append(entry)
+        if entries and len(names) > 1 and rnd.random() < conflicts:
+            other = rnd.choice([n for n in rnd.sample(names, 2) if n != name])
+            entries.append((other, entries[0][1], "Ten 1/1/{0}".format(rnd.randrange(1, 48))))
+        rnd.shuffle(entries)
+        host = rnd.random() < hosts
+
+        if structured:
+            index = dict((position + 1, structured_entry(remote, local, port, types[remote]))
+                         for position, (remote, local, port) in enumerate(entries))
+            if host:
+                index[len(index) + 1] = {"device_id": "linuxhost", "local_interface": "GigabitEthernet0/0",
+                                         "port_id": "eth0", "capability": "H", "platform": "Linux"}
+            devices.append({"hostname": name, "tags": ["network"], "cdp": {"cdp": {"index": index}}})
+            continue
+
+        lines = []
+        for remote, local, port in entries:
+            lines.extend(entry_lines(text_rnd, remote, local, port, types[remote], malformed))
+        if host:
+            lines.append("linuxhost        Gig 0/0           120              H           Linux     eth0")
+        cdp = HEADER + "\r\n".join(lines) + "\r\n"
+        if text_rnd.random() >= malformed:
+            cdp += "\r\nTotal cdp entries displayed : {0}\r\n".format(len(entries))
+        devices.append({"hostname": name, "tags": ["network"], "cdp": cdp})
+    return devices
+
+
+def parse_platforms(value):
+    """
+    Parse e.g. router=2,switch=1 into a dict of device type to weight
+    """
+    platforms = {}
+    for item in value.split(","):
+        device_type, _, weight = item.partition("=")
+        if device_type not in PLATFORMS:
+            raise argparse.ArgumentTypeError("unknown device type {0}".format(device_type))
+        platforms[device_type] = float(weight or 1)
+    return platforms
+
+
+def add_arguments(parser):
+    parser.add_argument("--degree", type=float, default=3.0, help="The average number of neighbors of a device")
+    parser.add_argument("--platforms", type=parse_platforms,
+                        help="The device types and their weights, e.g. router=2,switch=1,l3switch=1")
+    parser.add_argument("--malformed", type=float, default=0.05, help="The fraction of entries that are malformed")
+    parser.add_argument("--duplicates", type=float, default=0.02, help="The fraction of entries listed twice")
+    parser.add_argument("--conflicts", type=float, default=0.02,
+                        help="The fraction of devices with a local interface used for two neighbors")
+    parser.add_argument("--hosts", type=float, default=0.1, help="The fraction of devices with a host neighbor")
+    parser.add_argument("--structured", action="store_true", help="Give the neighbors as Genie parses them")
+    parser.add_argument("--seed", type=int, default=1)
+
+
+def synth_options(args):
+    return dict(degree=args.degree, platforms=args.platforms, malformed=args.malformed, duplicates=args.duplicates,
+                conflicts=args.conflicts, hosts=args.hosts, structured=args.structured, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--devices-only", action="store_true",
+                        help="Write only the list of devices rather than the module arguments")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    devices = synth_devices(args.devices, **synth_options(args))
+    if args.devices_only:
+        json.dump(devices, sys.stdout)
+    else:
+        json.dump({"ANSIBLE_MODULE_ARGS": {"devices": devices, "device_template": DEVICE_TEMPLATE,
+                                           "default_mappings": DEFAULT_MAPPINGS}}, sys.stdout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,27 @@
+"""
+Make the collection in this checkout importable as ansible_collections.ciscops.mdd
+"""
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def add_collection_path():
+    """
+    Put an ansible_collections tree linking to this checkout on sys.path,
+    unless the collection is already importable from there
+    """
+    for path in sys.path:
+        if os.path.realpath(os.path.join(path, "ansible_collections", "ciscops", "mdd")) == ROOT:
+            return path
+    path = tempfile.mkdtemp(prefix="mdd-bench-")
+    atexit.register(shutil.rmtree, path, True)
+    namespace = os.path.join(path, "ansible_collections", "ciscops")
+    os.makedirs(namespace)
+    os.symlink(ROOT, os.path.join(namespace, "mdd"))
+    sys.path.insert(0, path)
+    return path
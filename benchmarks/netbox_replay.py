@@ -0,0 +1,443 @@
+#!/usr/bin/env python
+"""
+A stand-in for the NetBox API that replays recorded responses, so that the
+netbox_oc lookup can be exercised and benchmarked without a live NetBox.
+
+The fixture is the set of records recorded from NetBox for one device (see
+the record command).  It is cloned as many times as devices are wanted, and
+the clones are served with NetBox's filtering and pagination, an optional
+latency per request, and a count of the requests and connections made.
+With a limit on the requests in flight, requests over the limit are answered
+with 429 and Retry-After, as NetBox behind a rate limiting proxy would.
+
+    python benchmarks/netbox_replay.py serve --devices 100 --latency 0.01 --port 8000
+    NETBOX_API=https://netbox NETBOX_TOKEN=... python benchmarks/netbox_replay.py record router1
+"""
+import argparse
+import copy
+import json
+import os
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "netbox_device.json")
+
+# The per-device resources, which are cloned for each device.  FHRP groups,
+# VLANs and VRFs are shared between devices, so they are served as recorded.
+DEVICE_RESOURCES = ("dcim/devices", "dcim/interfaces", "ipam/ip-addresses", "ipam/fhrp-group-assignments")
+SHARED_RESOURCES = ("ipam/fhrp-groups", "ipam/vlans", "ipam/vrfs")
+RESOURCES = DEVICE_RESOURCES + SHARED_RESOURCES
+
+# Ids of the clones of a device are offset by a multiple of this
+ID_STRIDE = 100000
+
+# NetBox's PAGINATE_COUNT and MAX_PAGE_SIZE defaults
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+
+API_VERSION = "3.7"
+
+# Filters applied to the device of a record rather than to the record itself
+DEVICE_FILTERS = {"device": "name", "device_id": "id"}
+PAGINATION_PARAMETERS = frozenset(("limit", "offset", "brief", "format"))
+
+
+def record(api_endpoint, token, device_name, verify=True):
+    """
+    Return the records of a device (and of the FHRP groups assigned to its
+    interfaces) from a live NetBox, in the form used as a fixture
+    """
+    import requests
+
+    session = requests.Session()
+    session.verify = verify
+    session.headers["Authorization"] = "Token {0}".format(token)
+    session.headers["Accept"] = "application/json"
+
+    def get_all(resource, params):
+        records = []
+        url = "{0}/api/{1}/".format(api_endpoint.rstrip("/"), resource)
+        params = dict(params, limit=MAX_PAGE_SIZE)
+        while url:
+            response = session.get(url, params=params)
+            response.raise_for_status()
+            result = response.json()
+            records.extend(result["results"])
+            url, params = result["next"], None
+        return records
+
+    fixture = {"dcim/devices": get_all("dcim/devices", {"name": device_name})}
+    if not fixture["dcim/devices"]:
+        raise ValueError("No device named {0} in NetBox".format(device_name))
+    device_id = fixture["dcim/devices"][0]["id"]
+    for resource in DEVICE_RESOURCES[1:]:
+        fixture[resource] = get_all(resource, {"device_id": device_id})
+    group_ids = sorted(set(assignment["group"]["id"] for assignment in fixture["ipam/fhrp-group-assignments"]))
+    fixture["ipam/fhrp-groups"] = get_all("ipam/fhrp-groups", {"id": group_ids}) if group_ids else []
+    vlan_ids = sorted(set(vlan["id"] for interface in fixture["dcim/interfaces"]
+                          for vlan in [interface.get("untagged_vlan")] + (interface.get("tagged_vlans") or []) if vlan))
+    fixture["ipam/vlans"] = get_all("ipam/vlans", {"id": vlan_ids}) if vlan_ids else []
+    vrf_ids = sorted(set(ipaddress["vrf"]["id"] for ipaddress in fixture["ipam/ip-addresses"] if ipaddress.get("vrf")))
+    fixture["ipam/vrfs"] = get_all("ipam/vrfs", {"id": vrf_ids}) if vrf_ids else []
+    return fixture
+
+
+def load_fixture(path=FIXTURE):
+    with open(path) as f:
+        return json.load(f)
+
+
+def device_of(resource, record):
+    if resource == "dcim/devices":
+        return record
+    if resource == "ipam/ip-addresses":
+        return (record.get("assigned_object") or {}).get("device")
+    if resource == "ipam/fhrp-group-assignments":
+        return (record.get("interface") or {}).get("device")
+    return record.get("device")
+
+
+def clone(fixture, index):
+    """
+    Return the per-device records of fixture as device number index, with the
+    ids offset and the device renamed so that each clone is distinct
+    """
+    device = fixture["dcim/devices"][0]
+    name = "{0}-{1}".format(device["name"], index + 1)
+    offset = index * ID_STRIDE
+    clones = {}
+    for resource in DEVICE_RESOURCES:
+        records = copy.deepcopy(fixture[resource])
+        for record in records:
+            record["id"] += offset
+            for key in ("assigned_object_id", "interface_id"):
+                if record.get(key) is not None:
+                    record[key] += offset
+            for key in ("assigned_object", "interface"):
+                if isinstance(record.get(key), dict):
+                    record[key]["id"] += offset
+            if resource == "dcim/devices":
+                record["name"] = record["display"] = name
+            record_device = device_of(resource, record)
+            if resource != "dcim/devices" and record_device is not None:
+                record_device["id"] += offset
+                record_device["name"] = record_device["display"] = name
+        clones[resource] = records
+    return clones
+
+
+def scale_fixture(fixture, devices):
+    """
+    Return the data served for the given number of devices, each a clone of
+    the device in fixture
+    """
+    data = dict((resource, []) for resource in DEVICE_RESOURCES)
+    for index in range(devices):
+        for resource, records in clone(fixture, index).items():
+            data[resource].extend(records)
+    for resource in SHARED_RESOURCES:
+        data[resource] = copy.deepcopy(fixture.get(resource, []))
+    return data
+
+
+def field_matches(value, wanted):
+    if isinstance(value, dict):
+        return any(str(value.get(key)) in wanted for key in ("id", "name", "slug", "value"))
+    if isinstance(value, list):
+        return any(field_matches(item, wanted) for item in value)
+    if isinstance(value, bool):
+        value = str(value).lower()
+    return str(value) in wanted
+
+
+def matches(resource, record, query):
+    for key, values in query.items():
+        if key in PAGINATION_PARAMETERS:
+            continue
+        if key in DEVICE_FILTERS:
+            device = device_of(resource, record)
+            if device is None or str(device[DEVICE_FILTERS[key]]) not in values:
+                return False
+        elif key == "last_updated__gte":
+            if record["last_updated"] < values[0]:
+                return False
+        elif key not in record or not field_matches(record[key], values):
+            return False
+    return True
+
+
+def brief(record):
+    return dict((key, record[key]) for key in ("id", "url", "display", "name", "device") if key in record)
+
+
+def graphql_enum(value):
+    """
+    Turn a REST API choice value into the enum name GraphQL returns
+    """
+    if value is None:
+        return None
+    name = value["value"].upper().replace("-", "_")
+    return "A_" + name if name[0].isdigit() else name
+
+
+def graphql_result(data, query):
+    """
+    Answer the interface_list and fhrp_group_assignment_list query made by
+    the netbox_oc lookup in GraphQL mode
+    """
+    match = re.search(r"interface_list\((\w+): (\[.*?\])\)", query)
+    if not match or match.group(1) not in ("device", "device_id"):
+        return {"errors": [{"message": "Unsupported query"}]}
+    key = DEVICE_FILTERS[match.group(1)]
+    wanted = set(json.loads(match.group(2)))
+
+    ipaddresses_by_interface = {}
+    for ipaddress in data["ipam/ip-addresses"]:
+        ipaddresses_by_interface.setdefault(ipaddress["assigned_object_id"], []).append(ipaddress)
+    interfaces = []
+    for interface in data["dcim/interfaces"]:
+        if interface["device"][key] not in wanted:
+            continue
+        interfaces.append({
+            "id": str(interface["id"]),
+            "name": interface["name"],
+            "description": interface["description"],
+            "enabled": interface["enabled"],
+            "mtu": interface["mtu"],
+            "type": graphql_enum(interface["type"]),
+            "mode": graphql_enum(interface["mode"]),
+            "device": {"id": str(interface["device"]["id"]), "name": interface["device"]["name"]},
+            "untagged_vlan": {"vid": interface["untagged_vlan"]["vid"]} if interface["untagged_vlan"] else None,
+            "tagged_vlans": [{"vid": vlan["vid"]} for vlan in interface["tagged_vlans"]],
+            "ip_addresses": [{
+                "id": str(ipaddress["id"]),
+                "address": ipaddress["address"],
+                "status": graphql_enum(ipaddress["status"]),
+                "vrf": {"name": ipaddress["vrf"]["name"]} if ipaddress["vrf"] else None
+            } for ipaddress in ipaddresses_by_interface.get(interface["id"], [])]
+        })
+    groups = dict((group["id"], group) for group in data["ipam/fhrp-groups"])
+    assignments = []
+    for assignment in data["ipam/fhrp-group-assignments"]:
+        if assignment["interface"]["device"][key] not in wanted:
+            continue
+        group = groups[assignment["group"]["id"]]
+        assignments.append({
+            "id": str(assignment["id"]),
+            "priority": assignment["priority"],
+            "interface_id": str(assignment["interface_id"]),
+            "group": {
+                "id": str(group["id"]),
+                "group_id": group["group_id"],
+                "ip_addresses": [{"address": ipaddress["address"]} for ipaddress in group["ip_addresses"]]
+            }
+        })
+    return {"data": {"interface_list": interfaces, "fhrp_group_assignment_list": assignments}}
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.stats.count("connections")
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, result, status=200):
+        body = json.dumps(result).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("API-Version", API_VERSION)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def overloaded(self):
+        """
+        Answer with 429 and return True when over the server's limit of requests in flight
+        """
+        if self.server.in_flight.acquire(blocking=False):
+            return False
+        self.server.stats.count("throttled")
+        body = json.dumps({"detail": "Request was throttled."}).encode()
+        self.send_response(429)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Retry-After", str(self.server.retry_after))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return True
+
+    def do_POST(self):
+        self.server.stats.count("requests")
+        if self.overloaded():
+            return
+        try:
+            self.post()
+        finally:
+            self.server.in_flight.release()
+
+    def do_GET(self):
+        self.server.stats.count("requests")
+        if self.overloaded():
+            return
+        try:
+            self.get()
+        finally:
+            self.server.in_flight.release()
+
+    def post(self):
+        self.server.stats.count("graphql")
+        time.sleep(self.server.latency)
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if urlparse(self.path).path.rstrip("/") != "/graphql":
+            self.send_json({"detail": "Not found."}, 404)
+            return
+        self.send_json(graphql_result(self.server.data, body.get("query", "")))
+
+    def get(self):
+        time.sleep(self.server.latency)
+        url = urlparse(self.path)
+        resource = url.path.strip("/")
+        if not resource.startswith("api"):
+            self.send_json({"detail": "Not found."}, 404)
+            return
+        resource = resource[len("api"):].strip("/")
+        if resource in ("", "status"):
+            self.send_json({"netbox-version": API_VERSION + ".0"})
+            return
+        if resource not in self.server.data:
+            self.send_json({"detail": "Not found."}, 404)
+            return
+        self.server.stats.count(resource)
+
+        query = parse_qs(url.query)
+        records = [record for record in self.server.data[resource] if matches(resource, record, query)]
+        limit = int(query.get("limit", [self.server.page_size])[0])
+        limit = min(limit or self.server.max_page_size, self.server.max_page_size)
+        offset = int(query.get("offset", [0])[0])
+        page = records[offset:offset + limit]
+        if query.get("brief", ["false"])[0].lower() in ("1", "true"):
+            page = [brief(record) for record in page]
+
+        next_url = None
+        if offset + limit < len(records):
+            next_query = dict(query, limit=[str(limit)], offset=[str(offset + limit)])
+            next_url = "http://{0}{1}?{2}".format(self.headers["Host"], url.path, urlencode(next_query, doseq=True))
+        self.send_json({"count": len(records), "next": next_url, "previous": None, "results": page})
+
+
+class ReplayStats(object):
+    """
+    Counts of the connections, requests and requests by resource
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def reset(self):
+        with self.lock:
+            counts, self.counts = self.counts, {}
+        return counts
+
+
+class NoLimit(object):
+
+    def acquire(self, blocking=True):
+        return True
+
+    def release(self):
+        pass
+
+
+class ReplayServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, data, latency=0.0, page_size=DEFAULT_PAGE_SIZE, max_page_size=MAX_PAGE_SIZE, port=0,
+                 max_in_flight=0, retry_after=1):
+        ThreadingHTTPServer.__init__(self, ("127.0.0.1", port), ReplayHandler)
+        self.data = data
+        self.latency = latency
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+        # An unlimited number of requests in flight is a semaphore that is never exhausted
+        self.in_flight = threading.BoundedSemaphore(max_in_flight) if max_in_flight > 0 else NoLimit()
+        self.retry_after = retry_after
+        self.stats = ReplayStats()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{0}".format(self.server_port)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+def serve(devices, latency=0.0, page_size=DEFAULT_PAGE_SIZE, max_page_size=MAX_PAGE_SIZE, port=0, fixture=FIXTURE,
+          max_in_flight=0, retry_after=1):
+    """
+    Start a replay server for the given number of devices in a background
+    thread and return it
+    """
+    data = scale_fixture(load_fixture(fixture), devices)
+    return ReplayServer(data, latency, page_size, max_page_size, port, max_in_flight, retry_after).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command")
+    serve_parser = commands.add_parser("serve", help="Replay the fixture for a number of devices")
+    serve_parser.add_argument("--devices", type=int, default=100)
+    serve_parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before each response")
+    serve_parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE)
+    serve_parser.add_argument("--max-page-size", type=int, default=MAX_PAGE_SIZE)
+    serve_parser.add_argument("--port", type=int, default=8000)
+    serve_parser.add_argument("--fixture", default=FIXTURE)
+    serve_parser.add_argument("--max-in-flight", type=int, default=0,
+                              help="Answer requests over this many at once with 429 (0 for no limit)")
+    serve_parser.add_argument("--retry-after", type=int, default=1, help="The Retry-After sent with a 429")
+    record_parser = commands.add_parser("record", help="Record the fixture from NETBOX_API for a device")
+    record_parser.add_argument("device")
+    record_parser.add_argument("--fixture", default=FIXTURE)
+    record_parser.add_argument("--no-verify", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        server = serve(args.devices, args.latency, args.page_size, args.max_page_size, args.port, args.fixture,
+                       args.max_in_flight, args.retry_after)
+        print("Replaying {0} devices at {1}/api/".format(args.devices, server.url))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            print(json.dumps(server.stats.reset(), indent=2, sort_keys=True))
+    elif args.command == "record":
+        fixture = record(os.environ["NETBOX_API"], os.environ["NETBOX_TOKEN"], args.device, not args.no_verify)
+        with open(args.fixture, "w") as f:
+            json.dump(fixture, f, indent=2, sort_keys=True)
+            f.write("\n")
+        counts = ", ".join("{0} {1}".format(len(records), resource) for resource, records in sorted(fixture.items()))
+        print("Recorded {0} to {1}".format(counts, args.fixture))
+    else:
+        parser.print_help()
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
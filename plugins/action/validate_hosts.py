@@ -0,0 +1,75 @@
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from ansible.errors import AnsibleError
+from ansible.module_utils.parsing.convert_bool import boolean
+from ansible.plugins.action import ActionBase
+
+from ansible_collections.ciscops.mdd.plugins.module_utils.datavalidation import (
+    HAS_JSONSCHEMA, HAS_REFERENCING, ResultCache, consolidate_report, get_schema_store, validate_hosts
+)
+
+
+class ActionModule(ActionBase):
+
+    TRANSFERS_FILES = False
+    _VALID_ARGS = frozenset(('hosts', 'data_var', 'schemas', 'schemas_var', 'max_errors', 'fail_fast', 'workers',
+                             'compile', 'compile_cache_dir', 'result_cache_dir', 'result_cache_size',
+                             'schema_root'))
+
+    def run(self, tmp=None, task_vars=None):
+        if task_vars is None:
+            task_vars = {}
+
+        result = super(ActionModule, self).run(tmp, task_vars)
+        del tmp
+
+        if not HAS_JSONSCHEMA:
+            raise AnsibleError('jsonschema must be installed to use this plugin')
+
+        hosts = self._task.args.get('hosts') or task_vars.get('ansible_play_hosts', [])
+        data_var = self._task.args.get('data_var', 'mdd_data')
+        schemas = self._task.args.get('schemas')
+        schemas_var = self._task.args.get('schemas_var', 'mdd_validate_schema_list')
+        max_errors = int(self._task.args.get('max_errors', 0))
+        fail_fast = boolean(self._task.args.get('fail_fast', False), strict=False)
+        if fail_fast:
+            max_errors = 1
+        compiled = boolean(self._task.args.get('compile', False), strict=False)
+        cache_dir = self._task.args.get('compile_cache_dir')
+        result_cache = None
+        if self._task.args.get('result_cache_dir'):
+            result_cache = ResultCache(self._task.args['result_cache_dir'],
+                                       int(self._task.args.get('result_cache_size', 10000)))
+        store = None
+        if self._task.args.get('schema_root'):
+            if not HAS_REFERENCING:
+                raise AnsibleError('referencing must be installed to use schema_root')
+            store = get_schema_store(self._task.args['schema_root'])
+        workers = self._task.args.get('workers')
+        if workers is not None:
+            workers = int(workers)
+
+        hostvars = task_vars['hostvars']
+        host_data = {}
+        host_schemas = {}
+        for host in hosts:
+            host_data[host] = self._templar.template(hostvars[host].get(data_var, {}))
+            if schemas is not None:
+                host_schemas[host] = schemas
+            else:
+                host_schemas[host] = self._templar.template(hostvars[host].get(schemas_var, []))
+
+        results = validate_hosts(host_data, host_schemas, max_errors, fail_fast, workers, compiled, cache_dir,
+                                 result_cache, store)
+        failures = {}
+        truncated = {}
+        for host, host_results in results.items():
+            failures[host] = [item['failed_schema'] for item in host_results if item['failed']]
+            truncated[host] = [item['failed_schema'] for item in host_results if item['truncated']]
+
+        result['changed'] = False
+        result['results'] = results
+        result['failures'] = failures
+        result['report'] = consolidate_report(failures, truncated)
+        return result
@@ -1,41 +1,30 @@
 from __future__ import absolute_import, division, print_function
 __metaclass__ = type
 
-from ansible.module_utils.six import raise_from
 from ansible.errors import AnsibleError
-try:
-    import networkx as nx
-except ImportError as imp_exc:
-    NETWORKX_IMPORT_ERROR = imp_exc
-else:
-    NETWORKX_IMPORT_ERROR = None
-
-
-def graph(topology_data, layout='kamada_kawai', scale=500):
-    if NETWORKX_IMPORT_ERROR:
-        raise_from(AnsibleError('networkx must be installed to use this plugin'), NETWORKX_IMPORT_ERROR)
-
-    pos = {}
-    g = nx.Graph()
-
-    for link in topology_data['links']:
-        g.add_edge(link['n1'], link['n2'])
-
-    if layout == 'spring':
-        pos = nx.layout.spring_layout(g, scale=int(scale))
-    elif layout == 'planar':
-        pos = nx.layout.planar_layout(g, scale=int(scale))
-    elif layout == 'spectral':
-        pos = nx.layout.spectral_layout(g, scale=int(scale))
-    elif layout == 'kamada_kawai':
-        pos = nx.layout.kamada_kawai_layout(g, scale=int(scale))
-
-    for key, value in pos.items():
-        for node in topology_data['nodes']:
-            if node['id'] == key:
-                node['x'] = int(value[0])
-                node['y'] = int(value[1])
-
+from ansible.utils.display import Display
+from ansible_collections.ciscops.mdd.plugins.module_utils.graph import (
+    LayoutCache, layout_topology, missing_layout_library, previous_positions
+)
+
+
+def graph(topology_data, layout='kamada_kawai', scale=500, group_by=None, previous=None, cache_dir=None):
+    """
+    Lay out a CML topology, with kamada_kawai unless another layout is given.  auto picks kamada_kawai, spring or
+    grouped by the number of nodes, and grouped needs no networkx.  group_by orders the bands of grouped by node tag
+    (router, l3switch, switch by default).
+
+    Nodes with the same label as a node of previous, an earlier topology (e.g. the lab file from the last run), keep
+    its position and only the new nodes are placed.  Layouts are kept in cache_dir and reused for the same topology.
+    """
+    library, import_error = missing_layout_library(layout)
+    if library:
+        raise AnsibleError('{0} must be installed to use the {1} layout'.format(library, layout))
+
+    cache = LayoutCache(cache_dir) if cache_dir else None
+    layout_topology(topology_data, layout, scale, group_by, previous_positions(topology_data, previous), cache)
+    if cache is not None and cache.error:
+        Display().warning(cache.error)
     return topology_data
 
 
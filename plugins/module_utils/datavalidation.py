@@ -1,10 +1,29 @@
 from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
+import copy
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import pickle
+import random
+import tempfile
 import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from urllib.parse import unquote, urljoin, urlparse
+
+JSONSCHEMA_IMPORT_ERROR = None
+IPADDRESS_IMPORT_ERROR = None
+REFERENCING_IMPORT_ERROR = None
+YAML_IMPORT_ERROR = None
 
 try:
-    from jsonschema import Draft7Validator, validators
-    from jsonschema.exceptions import ValidationError
+    from jsonschema import Draft7Validator, Draft202012Validator, validators
+    from jsonschema.exceptions import SchemaError, ValidationError
 except ImportError:
     HAS_JSONSCHEMA = False
     JSONSCHEMA_IMPORT_ERROR = traceback.format_exc()
@@ -19,10 +38,40 @@ except ImportError:
 else:
     HAS_IPADDRESS = True
 
+try:
+    from referencing import Registry, Resource
+    from referencing.jsonschema import DRAFT202012
+    from jsonschema_specifications import REGISTRY as SPECIFICATIONS
+except ImportError:
+    HAS_REFERENCING = False
+    REFERENCING_IMPORT_ERROR = traceback.format_exc()
+else:
+    HAS_REFERENCING = True
 
-def in_subnet(validator, value, instance, schema):
-    if not ipaddress.ip_address(instance) in ipaddress.ip_network(value):
-        yield ValidationError("{0} not in subnet {1}".format(instance, value))
+try:
+    import yaml
+except ImportError:
+    HAS_YAML = False
+    YAML_IMPORT_ERROR = traceback.format_exc()
+else:
+    HAS_YAML = True
+
+# The 2020-12 vocabulary whose $defs hold the simpleTypes allowed for 'type'
+VALIDATION_VOCABULARY = 'https://json-schema.org/draft/2020-12/meta/validation'
+
+# The number of validators kept by get_validator()
+VALIDATOR_CACHE_SIZE = 128
+
+SCHEMA_FILE_EXTENSIONS = ('.json', '.yml', '.yaml')
+# Errors that mean a file under the schema root is not a schema
+SCHEMA_FILE_ERRORS = (IOError, OSError, ValueError)
+if HAS_YAML:
+    SCHEMA_FILE_ERRORS += (yaml.YAMLError,)
+
+
+@lru_cache(maxsize=1024)
+def ip_network(value):
+    return ipaddress.ip_network(value)
 
 
 def is_ip_address(checker, instance):
@@ -33,26 +82,513 @@ def is_ip_address(checker, instance):
     return True
 
 
-def validate_schema(data, schema):
-    Draft7Validator.META_SCHEMA['definitions']['simpleTypes']['enum'].append('ipaddress')
-    all_validators = dict(Draft7Validator.VALIDATORS)
+def in_subnet(validator, value, instance, schema):
+    # Leave reporting of values that are not addresses to the 'ipaddress' type
+    if not is_ip_address(None, instance):
+        return
+    if not ipaddress.ip_address(instance) in ip_network(value):
+        yield ValidationError("{0} not in subnet {1}".format(instance, value))
+
+
+def add_ipaddress_type(definitions):
+    simple_types = definitions.get('simpleTypes')
+    if simple_types and 'ipaddress' not in simple_types['enum']:
+        simple_types['enum'].append('ipaddress')
+
+
+def extend_validator(base_validator):
+    """
+    Create a validator class from base_validator that knows about the
+    MDD 'ipaddress' type and 'in_subnet' keyword.  The meta schema is
+    copied so that the base validator's meta schema is left untouched.
+
+    Draft 7 keeps the allowed types in the meta schema's definitions, so
+    the copy is enough for check_schema().  2020-12 keeps them in the
+    validation vocabulary, which the meta schema only refers to, so
+    check_schema() resolves a copy of the vocabulary from a registry of its
+    own.  Without referencing, 2020-12 check_schema() rejects 'ipaddress'.
+    """
+    meta_schema = copy.deepcopy(base_validator.META_SCHEMA)
+    add_ipaddress_type(meta_schema.get('definitions', {}))
+    all_validators = dict(base_validator.VALIDATORS)
     all_validators['in_subnet'] = in_subnet
-    type_checker = Draft7Validator.TYPE_CHECKER.redefine_many({"ipaddress": is_ip_address})
-    # MDDValidator = validators.create(
-    #     meta_schema=Draft7Validator.META_SCHEMA,
-    #     validators=all_validators,
-    #     type_checker=type_checker,
-    # )
-    MDDValidator = validators.extend(Draft7Validator, type_checker=type_checker, validators=all_validators)
-    mdd_validator = MDDValidator(schema=schema)
+    type_checker = base_validator.TYPE_CHECKER.redefine_many({"ipaddress": is_ip_address})
+    mdd_validator = validators.extend(base_validator, type_checker=type_checker, validators=all_validators)
+    mdd_validator.META_SCHEMA = meta_schema
+
+    if HAS_REFERENCING and '$vocabulary' in meta_schema:
+        vocabulary = copy.deepcopy(SPECIFICATIONS.contents(VALIDATION_VOCABULARY))
+        add_ipaddress_type(vocabulary.get('$defs', {}))
+        registry = SPECIFICATIONS.with_resource(VALIDATION_VOCABULARY, DRAFT202012.create_resource(vocabulary))
+
+        def check_schema(cls, schema, format_checker=base_validator.FORMAT_CHECKER):
+            validator = base_validator(cls.META_SCHEMA, registry=registry, format_checker=format_checker)
+            for error in validator.iter_errors(schema):
+                raise SchemaError.create_from(error)
+
+        mdd_validator.check_schema = classmethod(check_schema)
+    return mdd_validator
+
+
+if HAS_JSONSCHEMA:
+    MDDValidator = extend_validator(Draft7Validator)
+    MDD202012Validator = extend_validator(Draft202012Validator)
+else:
+    MDDValidator = None
+    MDD202012Validator = None
+
+_validator_cache = OrderedDict()
+_schema_stores = {}
+
+
+def digest(data):
+    """
+    Return a stable digest of JSON-compatible data
+    """
+    canonical = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def dialect(cls):
+    """
+    Identify a validator class by its meta schema and keywords
+    """
+    return digest([cls.META_SCHEMA.get('$schema'), sorted(cls.VALIDATORS)])[:16]
+
+
+def read_schema_file(path):
+    with open(path) as f:
+        if path.endswith('.yaml') or path.endswith('.yml'):
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def file_uri(path):
+    return 'file://' + os.path.abspath(path)
+
+
+def with_file_id(schema, path):
+    """
+    Give a schema read from path a file:// $id, when it has none, so that
+    its relative $refs resolve against its own directory
+    """
+    if '$id' in schema or 'id' in schema:
+        return schema
+    schema = dict(schema)
+    schema['$id'] = file_uri(path)
+    return schema
+
+
+def schema_refs(schema):
+    """
+    Yield the value of each $ref in schema
+    """
+    if isinstance(schema, dict):
+        for key, value in schema.items():
+            if key == '$ref' and isinstance(value, str):
+                yield value
+            else:
+                for ref in schema_refs(value):
+                    yield ref
+    elif isinstance(schema, list):
+        for item in schema:
+            for ref in schema_refs(item):
+                yield ref
+
+
+def referenced_schema_files(schema, path):
+    """
+    Return a dict of path to schema of the files that schema, read from
+    path, refers to with $ref, directly or through the files it refers to.
+    path may also be the directory that the relative $refs of schema are
+    against, for a schema that was not read from a file.
+    """
+    found = {}
+    pending = [(schema, path)]
+    while pending:
+        schema, path = pending.pop()
+        base = file_uri(path) + '/' if os.path.isdir(path) else file_uri(path)
+        for ref in schema_refs(schema):
+            if ref.startswith('#'):
+                continue
+            uri = urljoin(base, ref.split('#')[0])
+            if not uri.startswith('file://'):
+                continue
+            ref_path = unquote(urlparse(uri).path)
+            if ref_path in found or not os.path.isfile(ref_path):
+                continue
+            try:
+                ref_schema = read_schema_file(ref_path)
+            except SCHEMA_FILE_ERRORS:
+                continue
+            if isinstance(ref_schema, dict):
+                found[ref_path] = ref_schema
+                pending.append((ref_schema, ref_path))
+    return found
+
+
+class SchemaStore(object):
+    """
+    The schemas under schema_root, loaded once so that $ref can be resolved
+    without changing directory or reading files during validation.  Each
+    schema is registered by its file:// URI, its path relative to
+    schema_root and its $id.  When schemas (a dict of path to schema) is
+    given, only those are used rather than every file under schema_root.
+    """
+
+    def __init__(self, schema_root, schemas=None):
+        self.schema_root = os.path.abspath(os.path.expanduser(schema_root))
+        self.schemas = dict(schemas) if schemas is not None else self.read_schemas()
+        self.digest = digest(sorted(self.schemas.items()))
+        self._registry = None
+
+    def read_schemas(self):
+        schemas = {}
+        for dirpath, dirnames, filenames in os.walk(self.schema_root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if not filename.endswith(SCHEMA_FILE_EXTENSIONS) or (not HAS_YAML and not filename.endswith('.json')):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    schema = read_schema_file(path)
+                except SCHEMA_FILE_ERRORS:
+                    # Not every file under the root has to be a schema (e.g. unrendered templates)
+                    continue
+                if isinstance(schema, dict):
+                    schemas[path] = schema
+        return schemas
+
+    def __getstate__(self):
+        # The registry is rebuilt rather than pickled when sent to worker processes
+        state = self.__dict__.copy()
+        state['_registry'] = None
+        return state
+
+    @property
+    def registry(self):
+        if self._registry is None:
+            resources = []
+            for path, schema in self.schemas.items():
+                resource = Resource.from_contents(schema, default_specification=DRAFT202012)
+                resources.append((file_uri(path), resource))
+                resources.append((os.path.relpath(path, self.schema_root).replace(os.sep, '/'), resource))
+            # crawl() adds the resources by $id as well
+            self._registry = Registry().with_resources(resources).crawl()
+        return self._registry
+
+
+def get_schema_store(schema_root):
+    """
+    Return the SchemaStore for schema_root, loading it the first time it is used
+    """
+    schema_root = os.path.abspath(os.path.expanduser(schema_root))
+    if schema_root not in _schema_stores:
+        _schema_stores[schema_root] = SchemaStore(schema_root)
+    return _schema_stores[schema_root]
+
+
+def get_referenced_schema_store(schema, path, schema_root=None):
+    """
+    Return a SchemaStore of just the files that schema, read from path,
+    refers to, so that a schema given on its own does not need the rest of
+    its directory read.  schema may also be a list of schemas.  The store's
+    root is schema_root when given, or else the directory of path.
+    """
+    schemas = {}
+    for item in (schema if isinstance(schema, list) else [schema]):
+        schemas.update(referenced_schema_files(item, path))
+    return SchemaStore(schema_root or os.path.dirname(os.path.abspath(path)), schemas)
+
+
+def get_validator(schema, cls=None, store=None):
+    """
+    Return a validator for schema, reusing a previously built one for the
+    same schema and validator class when available.  When store (a
+    SchemaStore) is given, $refs are resolved from its registry.
+    """
+    if cls is None:
+        cls = MDDValidator
+    key = (cls, digest(schema), store.digest if store is not None else None)
+    if key in _validator_cache:
+        _validator_cache.move_to_end(key)
+        return _validator_cache[key]
+    if store is not None:
+        mdd_validator = cls(schema=schema, registry=store.registry)
+    else:
+        mdd_validator = cls(schema=schema)
+    _validator_cache[key] = mdd_validator
+    if len(_validator_cache) > VALIDATOR_CACHE_SIZE:
+        _validator_cache.popitem(last=False)
+    return mdd_validator
+
+
+def validate_schema(data, schema, cls=None):
     # validate the input file against the supplied schema
-    # validate(instance=input, schema=schema, cls=MDDValidator, format_checker=draft7_format_checker)
-    errors = mdd_validator.iter_errors(data)
-    output = ""
+    errors = list(get_validator(schema, cls).iter_errors(data))
     if errors:
-        for error in errors:
-            output += "*****************\n"
-            output += str(error)
         return errors
     else:
         return None
+
+
+def error_to_dict(error):
+    return {
+        'json_path': error.json_path,
+        'validator': error.validator,
+        'message': error.message
+    }
+
+
+def iter_error_dicts(data, schema, cls=None, compiled=False, cache_dir=None, store=None):
+    if compiled:
+        # Imported here as the compiler builds on this module
+        from ansible_collections.ciscops.mdd.plugins.module_utils.schemacompiler import compile_schema
+        return compile_schema(schema, cls, cache_dir, store)(data)
+    return (error_to_dict(error) for error in get_validator(schema, cls, store).iter_errors(data))
+
+
+def collect_errors(data, schema, cls=None, max_errors=0, compiled=False, cache_dir=None, store=None):
+    """
+    Validate data against schema, stopping after max_errors errors (0 for no limit).
+    When compiled is set, the schema is turned into Python code first (see schemacompiler).
+    Returns a tuple of the list of errors as dicts and whether the list was truncated.
+    """
+    errors = iter_error_dicts(data, schema, cls, compiled, cache_dir, store)
+    if max_errors:
+        # Take one more than needed so we know whether there were more
+        errors = itertools.islice(errors, max_errors + 1)
+    error_list = list(errors)
+    truncated = bool(max_errors) and len(error_list) > max_errors
+    if truncated:
+        error_list.pop()
+    return error_list, truncated
+
+
+class ResultCache(object):
+    """
+    An on-disk cache of validation results keyed by the digests of the data
+    and the schema, and by the options that change the errors reported.
+    Once it holds more than max_entries results, the least recently used
+    are removed.  Listing the directory costs as much as the cache saves,
+    so its size is only checked on one put in every tenth of max_entries,
+    chosen at random as many processes share it; it can briefly hold
+    that many more.
+    """
+
+    def __init__(self, cache_dir, max_entries=10000):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_entries = max_entries
+        self.check_interval = max(1, max_entries // 10)
+
+    def key(self, data_digest, schema, cls, max_errors, store=None, compiled=False):
+        # The schemas that can be referenced are part of the key as they can change the result
+        store_digest = store.digest if store is not None else None
+        return digest([data_digest, digest(schema), dialect(cls), max_errors, store_digest, bool(compiled)])
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, "{0}.json".format(key))
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path) as f:
+                result = json.load(f)
+            # Keep track of use for eviction
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            return None
+        return result['errors'], result['truncated']
+
+    def list(self):
+        return [filename for filename in os.listdir(self.cache_dir) if filename.endswith('.json')]
+
+    def put(self, key, errors, truncated):
+        # The cache is only an optimization, so failing to write to it is not an error
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            fd, temp_file = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'errors': errors, 'truncated': truncated}, f)
+            os.replace(temp_file, self.path(key))
+        except (IOError, OSError):
+            return
+        if random.randrange(self.check_interval) == 0:
+            self.evict()
+
+    def evict(self):
+        # Remove down to 90% of max_entries, leaving room for the puts until the next check
+        try:
+            filenames = self.list()
+        except OSError:
+            return
+        if len(filenames) <= self.max_entries:
+            return
+        entries = []
+        for filename in filenames:
+            path = os.path.join(self.cache_dir, filename)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+        entries.sort()
+        remove = max(0, len(entries) - int(self.max_entries * 0.9))
+        for mtime, path in entries[:remove]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def collect_cached_errors(data, schema, cls=None, max_errors=0, compiled=False, cache_dir=None, result_cache=None,
+                          data_digest=None, store=None):
+    """
+    Like collect_errors(), but look up and store the result in result_cache when given.
+    Returns a tuple of the list of errors, whether it was truncated and whether it came from the cache.
+    """
+    if result_cache is None:
+        return collect_errors(data, schema, cls, max_errors, compiled, cache_dir, store) + (False,)
+    if cls is None:
+        cls = MDDValidator
+    cache_key = result_cache.key(data_digest or digest(data), schema, cls, max_errors, store, compiled)
+    cached_result = result_cache.get(cache_key)
+    if cached_result is not None:
+        return cached_result + (True,)
+    errors, truncated = collect_errors(data, schema, cls, max_errors, compiled, cache_dir, store)
+    result_cache.put(cache_key, errors, truncated)
+    return errors, truncated, False
+
+
+def get_schema_title(schema, default='<input>'):
+    if 'title' in schema:
+        return schema['title']
+    return default
+
+
+def validate_schema_list(data, schema_list, max_errors=0, fail_fast=False, cls=None, compiled=False, cache_dir=None,
+                         result_cache=None, store=None):
+    """
+    Validate the subtree of data named by each entry's key against the entry's schema.
+    When result_cache (a ResultCache) is given, unchanged data and schemas reuse earlier results.
+    When store (a SchemaStore) is given, $refs are resolved from the schemas it holds.
+    Returns a list of per-schema results.
+    """
+    if cls is None:
+        cls = MDDValidator
+    results = []
+    data_digests = {}
+    skip = False
+    for item in schema_list:
+        key = item.get('key') or 'mdd:openconfig'
+        schema_title = get_schema_title(item['schema'], default=item['name'])
+        errors = []
+        truncated = False
+        cached = False
+        if skip:
+            pass
+        elif key in data:
+            # Most schemas share a key, so only digest each subtree once
+            if result_cache is not None and key not in data_digests:
+                data_digests[key] = digest(data[key])
+            errors, truncated, cached = collect_cached_errors(data[key], item['schema'], cls, max_errors, compiled,
+                                                              cache_dir, result_cache, data_digests.get(key), store)
+        else:
+            errors = [{
+                'json_path': '$',
+                'validator': 'key',
+                'message': "Key {0} not found in data".format(key)
+            }]
+        results.append({
+            'name': item['name'],
+            'failed': bool(errors),
+            'skipped': skip,
+            'failed_schema': schema_title,
+            'truncated': truncated,
+            'cached': cached,
+            'errors': errors
+        })
+        if errors and fail_fast:
+            skip = True
+
+    return results
+
+
+# The schemas shared by all hosts, keyed by digest, in each validate_hosts() worker
+_worker_schemas = {}
+
+
+def _init_worker(schemas):
+    _worker_schemas.clear()
+    _worker_schemas.update(schemas)
+
+
+def _validate_host(work):
+    host, data, schema_refs, options = work
+    schema_list = [{'name': name, 'key': key, 'schema': _worker_schemas[schema_digest]}
+                   for name, key, schema_digest in schema_refs]
+    return host, validate_schema_list(data, schema_list, cls=MDD202012Validator, **options)
+
+
+def validate_hosts(host_data, host_schemas, max_errors=0, fail_fast=False, workers=None, compiled=False, cache_dir=None,
+                   result_cache=None, store=None):
+    """
+    Validate the data of many hosts across a pool of processes.
+      host_data: dict of host to the data for that host
+      host_schemas: dict of host to the list of {name, key, schema} for that host
+    Each distinct schema is sent to the workers once rather than once per host.
+    Workers are forked so that they inherit Ansible's collection loader; where
+    fork is not available, or the pool cannot be used, the hosts are validated
+    in this process instead.
+    Returns a dict of host to the list of per-schema results.
+    """
+    options = dict(max_errors=max_errors, fail_fast=fail_fast, compiled=compiled, cache_dir=cache_dir,
+                   result_cache=result_cache, store=store)
+    schemas = {}
+    work = []
+    for host, data in host_data.items():
+        schema_refs = []
+        for item in host_schemas.get(host, []):
+            schema_digest = digest(item['schema'])
+            schemas[schema_digest] = item['schema']
+            schema_refs.append((item['name'], item.get('key') or 'mdd:openconfig', schema_digest))
+        work.append((host, data, schema_refs, options))
+
+    workers = min(workers or os.cpu_count() or 1, len(work))
+    # Spawned or forkserver workers import this module afresh, without the collection loader, and cannot find it
+    if workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        chunksize = max(1, len(work) // (workers * 4))
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'),
+                                     initializer=_init_worker, initargs=(schemas,)) as executor:
+                return dict(executor.map(_validate_host, work, chunksize=chunksize))
+        except (BrokenProcessPool, ImportError, OSError, pickle.PicklingError):
+            pass
+
+    _init_worker(schemas)
+    return dict(_validate_host(item) for item in work)
+
+
+def consolidate_report(failures_by_host, truncated_by_host=None):
+    """
+    Group hosts with the same failed schemas into the validation report structure.
+    truncated_by_host, a dict of host to the schemas whose errors were cut
+    short by max_errors or fail_fast, is listed alongside so that a capped
+    report is not taken for a complete one.
+    """
+    failures = []
+    passed = []
+    for host in sorted(failures_by_host):
+        failed_schemas = failures_by_host[host]
+        if not failed_schemas:
+            passed.append(host)
+            continue
+        for entry in failures:
+            if entry['schemas'] == failed_schemas:
+                entry['hosts'].append(host)
+                break
+        else:
+            failures.append({'hosts': [host], 'schemas': failed_schemas})
+
+    truncated = dict((host, schemas) for host, schemas in sorted((truncated_by_host or {}).items()) if schemas)
+    return {'consolidated_report': {'failures': failures, 'passed': passed, 'truncated': truncated}}
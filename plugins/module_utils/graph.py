@@ -0,0 +1,318 @@
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+import hashlib
+import json
+import math
+import os
+import tempfile
+import traceback
+from collections import deque
+
+try:
+    import networkx as nx
+except ImportError:
+    HAS_NETWORKX = False
+    NETWORKX_IMPORT_ERROR = traceback.format_exc()
+else:
+    HAS_NETWORKX = True
+    NETWORKX_IMPORT_ERROR = None
+
+# networkx needs numpy for all its layouts, and scipy too for kamada_kawai and spectral
+try:
+    import numpy  # noqa: F401
+except ImportError:
+    HAS_NUMPY = False
+    NUMPY_IMPORT_ERROR = traceback.format_exc()
+else:
+    HAS_NUMPY = True
+    NUMPY_IMPORT_ERROR = None
+try:
+    import scipy  # noqa: F401
+except ImportError:
+    HAS_SCIPY = False
+    SCIPY_IMPORT_ERROR = traceback.format_exc()
+else:
+    HAS_SCIPY = True
+    SCIPY_IMPORT_ERROR = None
+
+LAYOUTS = ('auto', 'grouped', 'spring', 'planar', 'spectral', 'kamada_kawai')
+NETWORKX_LAYOUTS = ('spring', 'planar', 'spectral', 'kamada_kawai')
+
+# The libraries each layout needs (networkx uses scipy for spectral layouts of 500 nodes or more)
+LAYOUT_LIBRARIES = {
+    'spring': ('networkx', 'numpy'),
+    'planar': ('networkx', 'numpy'),
+    'spectral': ('networkx', 'numpy', 'scipy'),
+    'kamada_kawai': ('networkx', 'numpy', 'scipy'),
+}
+
+# auto uses kamada_kawai, whose time and memory grow with the square of the
+# nodes, for graphs up to this size, spring up to the next, and grouped above
+AUTO_KAMADA_KAWAI_MAX_NODES = 200
+AUTO_SPRING_MAX_NODES = 500
+SPRING_ITERATIONS = 50
+SPRING_SEED = 1
+
+# The tags of the nodes made from device_template, from the core down
+GROUP_ORDER = ('router', 'l3switch', 'switch')
+
+
+def missing_layout_library(layout):
+    """
+    The first library that layout needs and is not installed, and the error from importing it, or (None, None)
+    """
+    import_errors = {'networkx': NETWORKX_IMPORT_ERROR, 'numpy': NUMPY_IMPORT_ERROR, 'scipy': SCIPY_IMPORT_ERROR}
+    for library in LAYOUT_LIBRARIES.get(layout, ()):
+        if import_errors[library]:
+            return library, import_errors[library]
+    return None, None
+
+
+def auto_layout(node_count):
+    """
+    The layout auto uses for a graph of node_count nodes, given the libraries installed
+    """
+    if HAS_NETWORKX and HAS_SCIPY and node_count <= AUTO_KAMADA_KAWAI_MAX_NODES:
+        return 'kamada_kawai'
+    if HAS_NETWORKX and HAS_NUMPY and node_count <= AUTO_SPRING_MAX_NODES:
+        return 'spring'
+    return 'grouped'
+
+
+def topology_neighbours(topology_data):
+    neighbours = dict((node['id'], []) for node in topology_data['nodes'])
+    for link in topology_data['links']:
+        if link['n1'] in neighbours and link['n2'] in neighbours:
+            neighbours[link['n1']].append(link['n2'])
+            neighbours[link['n2']].append(link['n1'])
+    return neighbours
+
+
+def breadth_first_order(nodes, neighbours):
+    """
+    The ids of nodes, breadth first over the links from each node not yet reached
+    """
+    order = []
+    seen = set()
+    for node in nodes:
+        if node['id'] in seen:
+            continue
+        seen.add(node['id'])
+        queue = deque([node['id']])
+        while queue:
+            node_id = queue.popleft()
+            order.append(node_id)
+            for neighbour in neighbours[node_id]:
+                if neighbour not in seen:
+                    seen.add(neighbour)
+                    queue.append(neighbour)
+    return order
+
+
+def grouped_layout(topology_data, group_by=None):
+    """
+    Place every node in one of a stack of bands, one for each group in the order of group_by, a node's group being
+    the first of its tags in group_by or else its first tag.  The nodes of a band are in rows, breadth first over
+    the links so that neighbours are near each other.  Takes time in proportion to the nodes and links.
+    :return: dict of node id to (x, y), each from -1 to 1
+    """
+    group_by = list(GROUP_ORDER if group_by is None else group_by)
+    nodes = dict((node['id'], node) for node in topology_data['nodes'])
+    if not nodes:
+        return {}
+    groups = {}
+    for node_id in breadth_first_order(topology_data['nodes'], topology_neighbours(topology_data)):
+        tags = nodes[node_id].get('tags') or []
+        group = next((tag for tag in group_by if tag in tags), tags[0] if tags else None)
+        groups.setdefault(group, []).append(node_id)
+
+    def group_order(group):
+        if group in group_by:
+            return (0, group_by.index(group), '')
+        return (1 if group is not None else 2, 0, str(group))
+
+    columns = int(math.ceil(math.sqrt(len(nodes))))
+    pos = {}
+    row = 0
+    for group in sorted(groups, key=group_order):
+        for index, node_id in enumerate(groups[group]):
+            pos[node_id] = (index % columns, row + index // columns)
+        # A blank row between bands
+        row += (len(groups[group]) - 1) // columns + 2
+    width = max(columns - 1, 1)
+    height = max(row - 2, 1)
+    return dict((node_id, (2.0 * x / width - 1, 2.0 * y / height - 1)) for node_id, (x, y) in pos.items())
+
+
+def place_new_nodes(topology_data, positions, spacing):
+    """
+    Place the nodes that are not in positions (node id to (x, y)) each at the free spot on a grid of spacing nearest
+    the middle of its placed neighbours, working out from the placed nodes.  Nodes with no placed neighbours go in
+    rows below the rest.  Takes time in proportion to the nodes and links.
+    :return: dict of node id to (x, y) of the nodes placed
+    """
+    neighbours = topology_neighbours(topology_data)
+    pos = dict((node_id, position) for node_id, position in positions.items() if node_id in neighbours)
+    taken = set((int(round(x / spacing)), int(round(y / spacing))) for x, y in pos.values())
+
+    def free_cell(cx, cy):
+        ring = 0
+        while True:
+            for dx in range(-ring, ring + 1):
+                for dy in (range(-ring, ring + 1) if abs(dx) == ring else (-ring, ring)):
+                    if (cx + dx, cy + dy) not in taken:
+                        taken.add((cx + dx, cy + dy))
+                        return (cx + dx) * spacing, (cy + dy) * spacing
+            ring += 1
+
+    placed = {}
+    queue = deque(node_id for node_id in pos if any(neighbour not in pos for neighbour in neighbours[node_id]))
+    while queue:
+        for neighbour in neighbours[queue.popleft()]:
+            if neighbour in pos:
+                continue
+            around = [pos[n] for n in neighbours[neighbour] if n in pos]
+            x = sum(p[0] for p in around) / len(around)
+            y = sum(p[1] for p in around) / len(around)
+            pos[neighbour] = placed[neighbour] = free_cell(int(round(x / spacing)), int(round(y / spacing)))
+            queue.append(neighbour)
+
+    unplaced = [node['id'] for node in topology_data['nodes'] if node['id'] not in pos]
+    if unplaced:
+        left = min(x for x, y in pos.values()) if pos else 0
+        top = max(y for x, y in pos.values()) + 2 * spacing if pos else 0
+        columns = int(math.ceil(math.sqrt(len(neighbours))))
+        for index, node_id in enumerate(breadth_first_order([{'id': node_id} for node_id in unplaced], neighbours)):
+            cx = int(round(left / spacing)) + index % columns
+            cy = int(round(top / spacing)) + index // columns
+            pos[node_id] = placed[node_id] = free_cell(cx, cy)
+    return placed
+
+
+def previous_positions(topology_data, previous):
+    """
+    The positions of the nodes of topology_data that have a node with the same label, and a position, in previous,
+    an earlier topology
+    :return: dict of node id to (x, y)
+    """
+    by_label = dict((node.get('label'), (node['x'], node['y'])) for node in (previous or {}).get('nodes') or []
+                    if node.get('x') is not None and node.get('y') is not None)
+    return dict((node['id'], by_label[node.get('label')]) for node in topology_data['nodes']
+                if node.get('label') in by_label)
+
+
+class LayoutCache(object):
+    """
+    Layouts of topologies, kept on disk as a JSON file per topology, layout and pinned positions
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        # Why the last layout could not be kept, to be shown as a warning
+        self.error = None
+
+    def path(self, topology_data, layout, scale, group_by, positions):
+        key = json.dumps([
+            [(node['id'], node.get('label'), node.get('tags')) for node in topology_data['nodes']],
+            [(link['n1'], link['n2']) for link in topology_data['links']],
+            layout, scale, group_by, sorted(positions.items()), nx.__version__ if HAS_NETWORKX else None
+        ], default=str)
+        return os.path.join(self.cache_dir, "{0}.json".format(hashlib.sha256(key.encode("utf-8")).hexdigest()))
+
+    def get(self, *key):
+        try:
+            with open(self.path(*key)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def put(self, pos, *key):
+        self.error = None
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            fd, temp_file = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(pos, f)
+            os.replace(temp_file, self.path(*key))
+        except (IOError, OSError) as e:
+            self.error = "Unable to write layout cache: {0}".format(e)
+
+
+def layout_topology(topology_data, layout='auto', scale=500, group_by=None, positions=None, cache=None):
+    """
+    Set the x and y of the nodes of a CML topology from a layout of its links.  The networkx layouts place the
+    nodes with links, grouped places them all.
+
+    The nodes in positions (node id to (x, y)) are kept where they are and only the others are placed: by spring
+    where auto would use a networkx layout and spring can be used, and otherwise next to their neighbours.  With a
+    cache (LayoutCache), a topology laid out before is given the same positions without laying it out again.
+    """
+    positions = dict((node_id, (int(x), int(y))) for node_id, (x, y) in (positions or {}).items())
+    nodes = dict((node['id'], node) for node in topology_data['nodes'])
+    if positions and all(node_id in positions for node_id in nodes):
+        for node_id, node in nodes.items():
+            node['x'], node['y'] = positions[node_id]
+        return topology_data
+    if cache is not None:
+        cache_key = (topology_data, layout, scale, group_by, positions)
+        cached = cache.get(*cache_key)
+        if cached is not None:
+            for node_id, (x, y) in cached.items():
+                if node_id in nodes:
+                    nodes[node_id]['x'], nodes[node_id]['y'] = x, y
+            return topology_data
+
+    pos = {}
+    if layout == 'auto':
+        linked = set()
+        for link in topology_data['links']:
+            linked.update((link['n1'], link['n2']))
+        layout = auto_layout(len(linked))
+    if positions:
+        pinned = layout in NETWORKX_LAYOUTS and HAS_NETWORKX and HAS_NUMPY and \
+            len(nodes) <= AUTO_SPRING_MAX_NODES
+        layout = 'pinned_spring' if pinned else 'pinned'
+    if layout in NETWORKX_LAYOUTS or layout == 'pinned_spring':
+        g = nx.Graph()
+        for link in topology_data['links']:
+            g.add_edge(link['n1'], link['n2'])
+
+    if layout == 'pinned':
+        pos = dict(positions)
+        pos.update(place_new_nodes(topology_data, positions, 2.0 * int(scale) / max(math.sqrt(len(nodes)) - 1, 1)))
+    elif layout == 'pinned_spring':
+        # Laid out in the units of the other layouts, as networkx does not scale a layout with fixed nodes
+        scale = float(int(scale))
+        unit = dict((node_id, (x / scale, y / scale)) for node_id, (x, y) in positions.items())
+        unit.update(place_new_nodes(topology_data, unit, 2.0 / max(math.sqrt(len(nodes)) - 1, 1)))
+        # Only the new nodes and the nodes they link to take part, so the time taken follows the change
+        new = set(node_id for node_id in g if node_id not in positions)
+        g = g.subgraph(new.union(*(g[node_id] for node_id in new)))
+        fixed = [node_id for node_id in g if node_id in positions]
+        pos = nx.layout.spring_layout(g, pos=dict((node_id, unit[node_id]) for node_id in g), fixed=fixed or None,
+                                      iterations=SPRING_ITERATIONS, seed=SPRING_SEED) if new else {}
+        pos = dict((node_id, (x * scale, y * scale)) for node_id, (x, y) in pos.items())
+        for node_id in nodes:
+            if node_id not in pos:
+                pos[node_id] = (unit[node_id][0] * scale, unit[node_id][1] * scale)
+    elif layout == 'spring':
+        pos = nx.layout.spring_layout(g, scale=int(scale), iterations=SPRING_ITERATIONS, seed=SPRING_SEED)
+    elif layout == 'planar':
+        pos = nx.layout.planar_layout(g, scale=int(scale))
+    elif layout == 'spectral':
+        pos = nx.layout.spectral_layout(g, scale=int(scale))
+    elif layout == 'kamada_kawai':
+        pos = nx.layout.kamada_kawai_layout(g, scale=int(scale))
+    elif layout == 'grouped':
+        pos = dict((node_id, (x * int(scale), y * int(scale)))
+                   for node_id, (x, y) in grouped_layout(topology_data, group_by).items())
+
+    for key, value in pos.items():
+        if key in nodes:
+            nodes[key]['x'] = int(value[0])
+            nodes[key]['y'] = int(value[1])
+
+    if cache is not None:
+        cache.put(dict((node['id'], (node.get('x'), node.get('y'))) for node in nodes.values()), *cache_key)
+    return topology_data
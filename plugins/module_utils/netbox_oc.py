@@ -0,0 +1,1215 @@
+# -*- coding: utf-8 -*-
+
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+The NetBox client shared by the netbox_oc lookup and vars plugins: fetching
+records from NetBox (with retries, concurrency limits and an on-disk cache)
+and turning the interfaces, IP addresses and FHRP groups of devices into OC
+data.
+"""
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import fcntl
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from pprint import pformat
+from re import search, findall, IGNORECASE
+
+try:
+    from ansible.errors import AnsibleError
+    from ansible.utils.display import Display
+except ImportError:
+    # Only the controller plugins use this, but keep it importable without the controller (e.g. for sanity tests)
+    AnsibleError = Exception
+
+    class Display(object):
+        def __getattr__(self, name):
+            return lambda *args, **kwargs: None
+
+try:
+    import pynetbox
+except ImportError as imp_exc:
+    PYNETBOX_LIBRARY_IMPORT_ERROR = imp_exc
+else:
+    PYNETBOX_LIBRARY_IMPORT_ERROR = None
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except ImportError as imp_exc:
+    HTTPAdapter = object
+    REQUESTS_LIBRARY_IMPORT_ERROR = imp_exc
+else:
+    REQUESTS_LIBRARY_IMPORT_ERROR = None
+
+
+def get_endpoint(netbox, resource):
+    """
+    get_endpoint(netbox, resource)
+        netbox: a predefined pynetbox.api() pointing to a valid instance
+                of NetBox
+        resource: the resource passed to the lookup function upon which the api
+              call will be identified
+    """
+
+    netbox_endpoint_map = {
+        "aggregates": {"endpoint": netbox.ipam.aggregates},
+        "asns": {"endpoint": netbox.ipam.asns},
+        "circuit-terminations": {"endpoint": netbox.circuits.circuit_terminations},
+        "circuit-types": {"endpoint": netbox.circuits.circuit_types},
+        "circuits": {"endpoint": netbox.circuits.circuits},
+        "circuit-providers": {"endpoint": netbox.circuits.providers},
+        "cables": {"endpoint": netbox.dcim.cables},
+        "cluster-groups": {"endpoint": netbox.virtualization.cluster_groups},
+        "cluster-types": {"endpoint": netbox.virtualization.cluster_types},
+        "clusters": {"endpoint": netbox.virtualization.clusters},
+        "config": {"endpoint": netbox.users.config},
+        "config-contexts": {"endpoint": netbox.extras.config_contexts},
+        "connected-device": {"endpoint": netbox.dcim.connected_device},
+        "contact-assignments": {"endpoint": netbox.tenancy.contact_assignments},
+        "contact-groups": {"endpoint": netbox.tenancy.contact_groups},
+        "contact-roles": {"endpoint": netbox.tenancy.contact_roles},
+        "contacts": {"endpoint": netbox.tenancy.contacts},
+        "console-connections": {"endpoint": netbox.dcim.console_connections},
+        "console-port-templates": {"endpoint": netbox.dcim.console_port_templates},
+        "console-ports": {"endpoint": netbox.dcim.console_ports},
+        "console-server-port-templates": {
+            "endpoint": netbox.dcim.console_server_port_templates
+        },
+        "console-server-ports": {"endpoint": netbox.dcim.console_server_ports},
+        "content-types": {"endpoint": netbox.extras.content_types},
+        "custom-fields": {"endpoint": netbox.extras.custom_fields},
+        "custom-links": {"endpoint": netbox.extras.custom_links},
+        "device-bay-templates": {"endpoint": netbox.dcim.device_bay_templates},
+        "device-bays": {"endpoint": netbox.dcim.device_bays},
+        "device-roles": {"endpoint": netbox.dcim.device_roles},
+        "device-types": {"endpoint": netbox.dcim.device_types},
+        "devices": {"endpoint": netbox.dcim.devices},
+        "export-templates": {"endpoint": netbox.dcim.export_templates},
+        "fhrp-group-assignments": {"endpoint": netbox.ipam.fhrp_group_assignments},
+        "fhrp-groups": {"endpoint": netbox.ipam.fhrp_groups},
+        "front-port-templates": {"endpoint": netbox.dcim.front_port_templates},
+        "front-ports": {"endpoint": netbox.dcim.front_ports},
+        "graphs": {"endpoint": netbox.extras.graphs},
+        "groups": {"endpoint": netbox.users.groups},
+        "image-attachments": {"endpoint": netbox.extras.image_attachments},
+        "interface-connections": {"endpoint": netbox.dcim.interface_connections},
+        "interface-templates": {"endpoint": netbox.dcim.interface_templates},
+        "interfaces": {"endpoint": netbox.dcim.interfaces},
+        "inventory-items": {"endpoint": netbox.dcim.inventory_items},
+        "ip-addresses": {"endpoint": netbox.ipam.ip_addresses},
+        "ip-ranges": {"endpoint": netbox.ipam.ip_ranges},
+        "job-results": {"endpoint": netbox.extras.job_results},
+        "journal-entries": {"endpoint": netbox.extras.journal_entries},
+        "locations": {"endpoint": netbox.dcim.locations},
+        "manufacturers": {"endpoint": netbox.dcim.manufacturers},
+        "object-changes": {"endpoint": netbox.extras.object_changes},
+        "permissions": {"endpoint": netbox.users.permissions},
+        "platforms": {"endpoint": netbox.dcim.platforms},
+        "power-panels": {"endpoint": netbox.dcim.power_panels},
+        "power-connections": {"endpoint": netbox.dcim.power_connections},
+        "power-feeds": {"endpoint": netbox.dcim.power_feeds},
+        "power-outlet-templates": {"endpoint": netbox.dcim.power_outlet_templates},
+        "power-outlets": {"endpoint": netbox.dcim.power_outlets},
+        "power-port-templates": {"endpoint": netbox.dcim.power_port_templates},
+        "power-ports": {"endpoint": netbox.dcim.power_ports},
+        "prefixes": {"endpoint": netbox.ipam.prefixes},
+        "provider-networks": {"endpoint": netbox.circuits.provider_networks},
+        "providers": {"endpoint": netbox.circuits.providers},
+        "rack-groups": {"endpoint": netbox.dcim.rack_groups},
+        "rack-reservations": {"endpoint": netbox.dcim.rack_reservations},
+        "rack-roles": {"endpoint": netbox.dcim.rack_roles},
+        "racks": {"endpoint": netbox.dcim.racks},
+        "rear-port-templates": {"endpoint": netbox.dcim.rear_port_templates},
+        "rear-ports": {"endpoint": netbox.dcim.rear_ports},
+        "regions": {"endpoint": netbox.dcim.regions},
+        "reports": {"endpoint": netbox.extras.reports},
+        "rirs": {"endpoint": netbox.ipam.rirs},
+        "roles": {"endpoint": netbox.ipam.roles},
+        "route-targets": {"endpoint": netbox.ipam.route_targets},
+        # "secret-roles": {"endpoint": netbox.secrets.secret_roles},
+        # "secrets": {"endpoint": netbox.secrets.secrets},
+        "services": {"endpoint": netbox.ipam.services},
+        "site-groups": {"endpoint": netbox.dcim.site_groups},
+        "sites": {"endpoint": netbox.dcim.sites},
+        "tags": {"endpoint": netbox.extras.tags},
+        "tenant-groups": {"endpoint": netbox.tenancy.tenant_groups},
+        "tenants": {"endpoint": netbox.tenancy.tenants},
+        "tokens": {"endpoint": netbox.users.tokens},
+        "topology-maps": {"endpoint": netbox.extras.topology_maps},
+        "users": {"endpoint": netbox.users.users},
+        "virtual-chassis": {"endpoint": netbox.dcim.virtual_chassis},
+        "virtual-machines": {"endpoint": netbox.virtualization.virtual_machines},
+        "virtualization-interfaces": {"endpoint": netbox.virtualization.interfaces},
+        "vlan-groups": {"endpoint": netbox.ipam.vlan_groups},
+        "vlans": {"endpoint": netbox.ipam.vlans},
+        "vrfs": {"endpoint": netbox.ipam.vrfs},
+        "webhooks": {"endpoint": netbox.extras.webhooks},
+    }
+
+    major, minor, patch = map(int, pynetbox.__version__.split("."))
+
+    if major >= 6 and minor >= 4 and patch >= 0:
+        netbox_endpoint_map["wireless-lan-groups"] = {
+            "endpoint": netbox.wireless.wireless_lan_groups
+        }
+        netbox_endpoint_map["wireless-lan-groups"] = {
+            "endpoint": netbox.wireless.wireless_lan_groups
+        }
+        netbox_endpoint_map["wireless-lan"] = {"endpoint": netbox.wireless.wireless_lan}
+        netbox_endpoint_map["wireless-links"] = {
+            "endpoint": netbox.wireless.wireless_links
+        }
+
+    else:
+        if "wireless" in resource:
+            Display().v(
+                "pynetbox version %d.%d.%d does not support wireless app; please update to v6.4.0 or newer."
+                % (major, minor, patch)
+            )
+
+    return netbox_endpoint_map[resource]["endpoint"]
+
+
+# pynetbox APIs, and their sessions, by endpoint, token and verify so that
+# lookups in the same process reuse connections rather than opening new ones
+_netbox_apis = {}
+_netbox_apis_lock = threading.Lock()
+
+# Statuses meaning that NetBox, or a proxy in front of it, is overloaded or briefly unavailable
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+# Requests that can be sent again without changing the outcome.  Others, such as
+# the POST of a GraphQL query, may have been acted on by the time a 5xx comes
+# back, so they are only retried when NetBox turned them away (429) or they
+# never got through (a connect timeout)
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE", "TRACE"))
+# The longest wait before a retry, whatever Retry-After asks for
+RETRY_MAX_WAIT = 60
+
+
+class ConcurrencyLimiter(object):
+    """
+    Limit the requests to NetBox in flight at once from all the processes
+    (e.g. forks) on this host to slots, with a lock file per slot in
+    lock_dir.  Each process halves the slots it tries when NetBox says it is
+    overloaded and adds them back one at a time as requests succeed.
+    """
+
+    def __init__(self, lock_dir, slots):
+        self.lock_dir = lock_dir
+        self.slots = slots
+        self.limit = float(slots)
+        self.lock = threading.Lock()
+        if not os.path.isdir(lock_dir):
+            os.makedirs(lock_dir, exist_ok=True)
+
+    def acquire(self):
+        """
+        Wait for a free slot and return the locked file holding it
+        """
+        delay = 0.005
+        while True:
+            for slot in range(max(1, int(self.limit))):
+                slot_file = open(os.path.join(self.lock_dir, "slot-{0}.lock".format(slot)), "a")
+                try:
+                    fcntl.flock(slot_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return slot_file
+                except (IOError, OSError):
+                    slot_file.close()
+            time.sleep(delay)
+            delay = min(delay * 2, 0.2)
+
+    def release(self, slot_file):
+        fcntl.flock(slot_file, fcntl.LOCK_UN)
+        slot_file.close()
+
+    def overloaded(self):
+        with self.lock:
+            self.limit = max(1.0, self.limit / 2)
+
+    def succeeded(self):
+        with self.lock:
+            self.limit = min(float(self.slots), self.limit + 1.0 / self.limit)
+
+
+def default_lock_dir(api_endpoint):
+    return os.path.join(tempfile.gettempdir(), "ansible-netbox-{0}-{1}".format(
+        os.getuid(), hashlib.sha256(api_endpoint.encode("utf-8")).hexdigest()[:12]))
+
+
+class NetboxAdapter(HTTPAdapter):
+    """
+    A connection pool for NetBox that retries requests answered with one of
+    RETRY_STATUSES, or that fail to connect, up to retries times (requests
+    other than IDEMPOTENT_METHODS only on 429 or a connect timeout).  Retries
+    wait for Retry-After when NetBox sends it, and otherwise back off
+    exponentially from backoff seconds.  Each attempt holds a slot of
+    limiter, when given, but the waits between attempts do not.
+    """
+
+    def __init__(self, pool_maxsize=10, retries=5, backoff=0.5, limiter=None):
+        self.retries = retries
+        self.backoff = backoff
+        self.limiter = limiter
+        self.metrics_lock = threading.Lock()
+        self.metrics = self.new_metrics()
+        super(NetboxAdapter, self).__init__(pool_connections=1, pool_maxsize=pool_maxsize)
+
+    @staticmethod
+    def new_metrics():
+        return {"requests": 0, "retries": 0, "retries_by_reason": {}, "retry_wait": 0.0, "limit_wait": 0.0}
+
+    def pop_metrics(self):
+        """
+        Return the metrics since the last call
+        """
+        with self.metrics_lock:
+            metrics, self.metrics = self.metrics, self.new_metrics()
+        return metrics
+
+    def count(self, limit_wait, reason=None, retry_wait=0.0):
+        with self.metrics_lock:
+            self.metrics["requests"] += 1
+            self.metrics["limit_wait"] += limit_wait
+            if reason is not None:
+                self.metrics["retries"] += 1
+                self.metrics["retries_by_reason"][reason] = self.metrics["retries_by_reason"].get(reason, 0) + 1
+                self.metrics["retry_wait"] += retry_wait
+
+    def retry_wait(self, response, attempt):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        wait = None
+        if retry_after:
+            try:
+                wait = float(retry_after)
+            except ValueError:
+                try:
+                    wait = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+                except (TypeError, ValueError):
+                    pass
+        if wait is None:
+            # Jitter spreads out the retries of the requests that failed together
+            wait = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+        return min(max(wait, 0.0), RETRY_MAX_WAIT)
+
+    @staticmethod
+    def retryable(request, response, error):
+        if request.method in IDEMPOTENT_METHODS:
+            return error is not None or response.status_code in RETRY_STATUSES
+        return isinstance(error, requests.ConnectTimeout) or (response is not None and response.status_code == 429)
+
+    def send(self, request, **kwargs):
+        attempt = 0
+        while True:
+            slot_file = None
+            start = time.time()
+            if self.limiter is not None:
+                slot_file = self.limiter.acquire()
+            limit_wait = time.time() - start
+            response = error = None
+            try:
+                response = super(NetboxAdapter, self).send(request, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            finally:
+                if slot_file is not None:
+                    self.limiter.release(slot_file)
+
+            reason = type(error).__name__ if error is not None else response.status_code
+            if error is None and response.status_code not in RETRY_STATUSES:
+                if self.limiter is not None:
+                    self.limiter.succeeded()
+                self.count(limit_wait)
+                return response
+            if self.limiter is not None and reason in (429, 503):
+                self.limiter.overloaded()
+            if attempt >= self.retries or not self.retryable(request, response, error):
+                self.count(limit_wait)
+                if error is not None:
+                    raise error
+                return response
+
+            wait = self.retry_wait(response, attempt)
+            self.count(limit_wait, reason, wait)
+            Display().vvv("NetBox request to %s got %s, retrying in %.1fs" % (request.url, reason, wait))
+            if response is not None:
+                response.close()
+            time.sleep(wait)
+            attempt += 1
+
+
+def get_netbox(api_endpoint, token=None, verify=True, pool_size=10, retries=5, retry_backoff=0.5,
+               max_concurrency=0, lock_dir=None):
+    """
+    Return a pynetbox API for api_endpoint with a keep-alive session that
+    holds at least pool_size connections, reusing one from an earlier
+    lookup in this process when available.  Requests are retried and, when
+    max_concurrency is set, limited across processes (see NetboxAdapter).
+    """
+    # Connections must not be shared with a forked parent, so the process is part of the key
+    key = (os.getpid(), api_endpoint, token, verify)
+    lock_dir = lock_dir or default_lock_dir(api_endpoint)
+    with _netbox_apis_lock:
+        netbox, session_pool_size, adapter_options = _netbox_apis.get(key, (None, 0, None))
+        if netbox is None:
+            session = requests.Session()
+            session.verify = verify
+            netbox = pynetbox.api(
+                api_endpoint,
+                token=token if token else None,
+                # private_key=netbox_private_key,
+                # private_key_file=netbox_private_key_file,
+            )
+            netbox.http_session = session
+        options = (retries, retry_backoff, max_concurrency, lock_dir)
+        if pool_size > session_pool_size or options != adapter_options:
+            session_pool_size = max(pool_size, session_pool_size)
+            limiter = ConcurrencyLimiter(lock_dir, max_concurrency) if max_concurrency > 0 else None
+            adapter = NetboxAdapter(session_pool_size, retries, retry_backoff, limiter)
+            # The replaced adapters' connections would otherwise stay open until the process exits
+            old_adapters = set(netbox.http_session.adapters.values())
+            netbox.http_session.mount("http://", adapter)
+            netbox.http_session.mount("https://", adapter)
+            for old_adapter in old_adapters:
+                old_adapter.close()
+        _netbox_apis[key] = (netbox, session_pool_size, options)
+    return netbox
+
+
+def report_metrics(netbox):
+    """
+    Show how many requests were made to NetBox and retried since the last report
+    """
+    adapter = netbox.http_session.get_adapter(netbox.base_url)
+    if not isinstance(adapter, NetboxAdapter):
+        return
+    metrics = adapter.pop_metrics()
+    message = "NetBox: %d requests, %d retries%s, %.1fs waiting to retry, %.1fs waiting for a free slot" % (
+        metrics["requests"], metrics["retries"],
+        " (%s)" % ", ".join("%s: %d" % item for item in sorted(metrics["retries_by_reason"].items(), key=str))
+        if metrics["retries"] else "", metrics["retry_wait"], metrics["limit_wait"])
+    if metrics["retries"]:
+        Display().v(message)
+    else:
+        Display().vvv(message)
+
+
+def get_interface_type(interface):
+    # interface_type_map = {
+    #     "virtual":"softwareLoopback",
+    #     "lag":"ieee8023adLag"
+    # }
+    # if interface_type in interface_type_map:
+    #     return interface_type_map[interface_type]
+    # else:
+    #     return "ethernetCsmacd"
+
+    interface_type = interface["type"]["value"]
+
+    if interface_type == "virtual":
+        if search("vlan", interface["name"], IGNORECASE):
+            return "l3ipvlan"
+        elif search("loopback", interface["name"], IGNORECASE):
+            return "softwareLoopback"
+    # If this is a 'dot' subinterface
+    elif search(r"\.", interface["name"]):
+        return "ethernetCsmacd"
+    elif interface_type == "lag":
+        return "l2vlan"
+    elif interface["mode"] is not None:
+        if interface["mode"]["value"] == "tagged":
+            return "l2vlan"
+        if interface["mode"]["value"] == "access":
+            return "l2vlan"
+    else:
+        return "ethernetCsmacd"
+
+
+def make_netbox_call(nb_endpoint, filters=None):
+    """
+    Wrapper for calls to NetBox and handle any possible errors.
+
+    Args:
+        nb_endpoint (object): The NetBox endpoint object to make calls.
+
+    Returns:
+        results (object): Pynetbox result.
+
+    Raises:
+        AnsibleError: Ansible Error containing an error message.
+    """
+    try:
+        if filters:
+            results = nb_endpoint.filter(**filters)
+        else:
+            results = nb_endpoint.all()
+    except pynetbox.RequestError as e:
+        raise netbox_error(e)
+
+    return results
+
+
+def netbox_error(e):
+    if e.req.status_code == 404 and "plugins" in e:
+        return AnsibleError(
+            "{0} - Not a valid plugin endpoint, please make sure to provide valid plugin endpoint.".format(
+                e.error
+            )
+        )
+    return AnsibleError(e.error)
+
+
+# The fields used by interfaces_to_oc(), for all the devices matching FILTER
+GRAPHQL_QUERY = """
+query {
+  interface_list(FILTER) {
+    id name description enabled mtu type mode
+    device { id name }
+    untagged_vlan { vid }
+    tagged_vlans { vid }
+    ip_addresses { id address status vrf { name } }
+  }
+  fhrp_group_assignment_list(FILTER) {
+    id priority interface_id
+    group { id group_id ip_addresses { address } }
+  }
+}
+"""
+
+
+def graphql_choice(value):
+    """
+    Turn a choice from GraphQL, which may be an enum name (e.g. A_1000BASE_T),
+    into the {"value": ...} form the REST API returns (e.g. 1000base-t)
+    """
+    if value is None:
+        return None
+    value = value.lower()
+    if value.startswith("a_"):
+        value = value[2:]
+    return {"value": value.replace("_", "-")}
+
+
+def graphql_to_resources(data):
+    """
+    Turn the result of GRAPHQL_QUERY into the same records as fetched from the REST API
+    """
+    resources = {"interfaces": [], "ip-addresses": [], "fhrp-group-assignments": [], "fhrp-groups": {}}
+    for interface in data["interface_list"]:
+        interface = dict(interface)
+        ipaddresses = interface.pop("ip_addresses") or []
+        interface["id"] = int(interface["id"])
+        interface["device"] = {"id": int(interface["device"]["id"]), "name": interface["device"]["name"]}
+        interface["type"] = graphql_choice(interface["type"])
+        interface["mode"] = graphql_choice(interface["mode"])
+        interface["count_ipaddresses"] = len(ipaddresses)
+        resources["interfaces"].append(interface)
+        for ipaddress in ipaddresses:
+            resources["ip-addresses"].append({
+                "id": int(ipaddress["id"]),
+                "address": ipaddress["address"],
+                "family": {"value": 6 if ":" in ipaddress["address"] else 4},
+                "status": graphql_choice(ipaddress["status"]),
+                "vrf": ipaddress["vrf"],
+                "assigned_object_type": "dcim.interface",
+                "assigned_object_id": interface["id"]
+            })
+    for group_assignment in data["fhrp_group_assignment_list"]:
+        group = group_assignment["group"]
+        group_pk = int(group["id"])
+        resources["fhrp-group-assignments"].append({
+            "id": int(group_assignment["id"]),
+            "priority": group_assignment["priority"],
+            "interface_id": int(group_assignment["interface_id"]),
+            "group": {"id": group_pk, "group_id": group["group_id"]}
+        })
+        resources["fhrp-groups"][group_pk] = {"id": group_pk, "group_id": group["group_id"],
+                                              "ip_addresses": group["ip_addresses"]}
+    return resources
+
+
+def chunks(items, size):
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
+
+
+# Allowance for the clocks of the controller and NetBox not agreeing when asking for changed records
+CACHE_CLOCK_SKEW = 300
+
+# The resources nested in the records of each resource (e.g. the VRF name in an ip-address), whose changes do
+# not update those records.  A cached resource is fetched in full when any of these has changed since.
+NESTED_RESOURCES = {
+    "interfaces": ("vlans",),
+    "ip-addresses": ("vrfs",),
+    "fhrp-group-assignments": ("fhrp-groups",),
+    "fhrp-groups": ("ip-addresses",),
+}
+
+
+class NetboxCache(object):
+    """
+    Records fetched from NetBox, kept on disk as a JSON file per endpoint and filter
+    """
+
+    def __init__(self, cache_dir, api_endpoint, token=None, ttl=3600, incremental=True):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.ttl = ttl
+        self.incremental = incremental
+        # Different tokens may be allowed to see different records
+        self.scope = [api_endpoint, hashlib.sha256((token or "").encode("utf-8")).hexdigest()]
+
+    def path(self, resource, filters):
+        key = json.dumps(self.scope + [resource, filters], sort_keys=True, default=str)
+        return os.path.join(self.cache_dir, "{0}.json".format(hashlib.sha256(key.encode("utf-8")).hexdigest()))
+
+    def get(self, resource, filters):
+        try:
+            with open(self.path(resource, filters)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def put(self, resource, filters, fetched, records):
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            fd, temp_file = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump({"fetched": fetched, "records": records}, f)
+            os.replace(temp_file, self.path(resource, filters))
+        except (IOError, OSError) as e:
+            Display().warning("Unable to write NetBox cache: {0}".format(e))
+
+
+class NetboxFetcher(object):
+    """
+    Fetch records from NetBox as plain dicts.  With max_workers above 1,
+    independent calls, and the pages of each call, are made concurrently
+    over the same session.
+    """
+
+    def __init__(self, netbox, page_size=None, chunk_size=200, max_workers=1, cache=None, raw_json=False):
+        self.netbox = netbox
+        self.page_size = page_size
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.raw_json = raw_json
+        self.executor = None
+        self.page_executor = None
+        self.local = threading.local()
+        if max_workers > 1:
+            # Pages get a pool of their own so that calls waiting on their pages cannot starve them
+            self.executor = ThreadPoolExecutor(max_workers=max_workers)
+            self.page_executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        for executor in (self.executor, self.page_executor):
+            if executor is not None:
+                executor.shutdown()
+        report_metrics(self.netbox)
+
+    def map(self, function, items):
+        # Calls made from a worker run in that worker, as waiting on the
+        # same pool from inside it can deadlock once the pool is full
+        if self.executor is None or getattr(self.local, "in_worker", False):
+            return [function(item) for item in items]
+
+        def call(item):
+            self.local.in_worker = True
+            try:
+                return function(item)
+            finally:
+                self.local.in_worker = False
+
+        return list(self.executor.map(call, items))
+
+    def headers(self):
+        headers = {"Accept": "application/json"}
+        if self.netbox.token:
+            headers["Authorization"] = "Token {0}".format(self.netbox.token)
+        return headers
+
+    def get(self, url, params=None):
+        response = self.netbox.http_session.get(url, params=params, headers=self.headers())
+        if not response.ok:
+            raise AnsibleError("NetBox request to {0} failed: {1} {2}".format(url, response.status_code, response.text))
+        return response.json()
+
+    def page(self, endpoint, filters):
+        """
+        Return the total count of records and the records of the page given by
+        the limit and offset in filters.  Without an offset, all the pages are
+        returned.
+        """
+        if self.raw_json:
+            # Use the JSON as is rather than building pynetbox Records and turning them back into dicts
+            result = self.get(endpoint.url + "/", filters)
+            records = result["results"]
+            if "offset" not in filters:
+                while result.get("next"):
+                    result = self.get(result["next"])
+                    records.extend(result["results"])
+            return result["count"], records
+        records = make_netbox_call(endpoint, filters=filters)
+        try:
+            page_records = [dict(record) for record in records]
+            return len(records), page_records
+        except pynetbox.RequestError as e:
+            raise netbox_error(e)
+
+    def records(self, resource, filters=None):
+        """
+        Return all of the records of resource matching filters, from the cache when it is fresh enough
+        """
+        if self.cache is None:
+            return self.fetch(resource, filters)
+        filters = dict(filters or {})
+        fetched = time.time()
+        entry = self.cache.get(resource, filters)
+        if entry is not None and fetched - entry["fetched"] < self.cache.ttl:
+            return entry["records"]
+        records = None
+        if entry is not None and self.cache.incremental:
+            records = self.refresh(resource, filters, entry)
+        if records is None:
+            records = self.fetch(resource, filters)
+        self.cache.put(resource, filters, fetched, records)
+        return records
+
+    def refresh(self, resource, filters, entry):
+        """
+        Bring the cached records of resource up to date by fetching those changed since they
+        were cached and the ids of all current records.  Returns None when the cache cannot
+        be brought up to date this way, including when a resource nested in the records has
+        changed.
+        """
+        since = datetime.fromtimestamp(entry["fetched"] - CACHE_CLOCK_SKEW, timezone.utc)
+        since = since.strftime("%Y-%m-%dT%H:%M:%SZ")
+        for nested in NESTED_RESOURCES.get(resource, ()):
+            if self.changed_since(nested, since):
+                Display().vvvv("NetBox cache refresh of %s skipped as %s changed" % (resource, nested))
+                return None
+        changed_filters = dict(filters, last_updated__gte=since)
+        current, changed = self.map(lambda call_filters: self.fetch(resource, call_filters),
+                                    [dict(filters, brief=1), changed_filters])
+        Display().vvvv("NetBox cache refresh of %s found %d changed records" % (resource, len(changed)))
+        changed_by_id = dict((record["id"], record) for record in changed)
+        cached_by_id = dict((record["id"], record) for record in entry["records"])
+        # Follow the order of the current ids so the result matches a full fetch
+        records = []
+        for record in current:
+            if record["id"] in changed_by_id:
+                records.append(changed_by_id[record["id"]])
+            elif record["id"] in cached_by_id:
+                records.append(cached_by_id[record["id"]])
+            else:
+                return None
+        return records
+
+    def changed_since(self, resource, since):
+        """
+        Whether any record of resource has changed since the given time
+        """
+        count, records = self.page(get_endpoint(self.netbox, resource),
+                                   {"last_updated__gte": since, "brief": 1, "limit": 1, "offset": 0})
+        return count > 0
+
+    def fetch(self, resource, filters=None):
+        """
+        Fetch all of the records of resource matching filters
+        """
+        endpoint = get_endpoint(self.netbox, resource)
+        filters = dict(filters or {})
+        if self.page_size:
+            filters["limit"] = self.page_size
+        if self.page_executor is None or not self.page_size:
+            return self.page(endpoint, filters)[1]
+
+        # Fetch the first page to find the count, then the rest of the pages at once.
+        # The page size NetBox returns is used as it may be capped below page_size.
+        filters["offset"] = 0
+        count, records = self.page(endpoint, filters)
+        page_size = len(records)
+        if page_size and count > page_size:
+            page_filters = [dict(filters, limit=page_size, offset=offset)
+                            for offset in range(page_size, count, page_size)]
+            for page in self.page_executor.map(lambda page_filter: self.page(endpoint, page_filter)[1], page_filters):
+                records.extend(page)
+        return records
+
+    def chunked_records(self, resource, key, values, filters=None):
+        """
+        Fetch the records of resource where key is one of values, in chunks of chunk_size values
+        """
+        def fetch_chunk(values_chunk):
+            chunk_filters = dict(filters or {})
+            chunk_filters[key] = values_chunk
+            return self.records(resource, chunk_filters)
+
+        records = []
+        for chunk_records in self.map(fetch_chunk, list(chunks(values, self.chunk_size))):
+            records.extend(chunk_records)
+        return records
+
+    def fhrp_groups(self, group_assignments):
+        """
+        Fetch the FHRP groups used by group_assignments, returning a dict of group primary key to group
+        """
+        group_ids = sorted(set(group_assignment["group"]["id"] for group_assignment in group_assignments))
+        fhrp_groups_by_id = {}
+        for fhrp_group in self.chunked_records("fhrp-groups", "id", group_ids):
+            fhrp_groups_by_id[fhrp_group["id"]] = fhrp_group
+        return fhrp_groups_by_id
+
+    def device(self, device_name):
+        """
+        Fetch the interfaces, ip-addresses and FHRP groups of a single device
+        """
+        filters = {"device": [device_name]}
+        Display().vvvv("filter is %s" % filters)
+        interfaces, ipaddresses, group_assignments = self.map(
+            lambda resource: self.records(resource, filters), ["interfaces", "ip-addresses", "fhrp-group-assignments"])
+        return interfaces, ipaddresses, group_assignments, self.fhrp_groups(group_assignments)
+
+    def devices(self, names=None, filters=None):
+        """
+        Return the devices with the given names, or matching filters
+        """
+        if not names:
+            return self.records("devices", filters)
+        return self.chunked_records("devices", "name", names, filters)
+
+    def graphql(self, filter_name, values):
+        """
+        Fetch the interfaces, ip-addresses and FHRP groups for the devices
+        where filter_name is one of values, in a GraphQL query per chunk of
+        values.  Returns the resources in the same form as bulk().
+        """
+        def query_chunk(values_chunk):
+            query = GRAPHQL_QUERY.replace("FILTER", "{0}: {1}".format(filter_name, json.dumps(values_chunk)))
+            return graphql_to_resources(self.graphql_query(query))
+
+        resources = {"interfaces": [], "ip-addresses": [], "fhrp-group-assignments": [], "fhrp-groups": {}}
+        for chunk_resources in self.map(query_chunk, list(chunks(values, self.chunk_size))):
+            for resource, records in chunk_resources.items():
+                if resource == "fhrp-groups":
+                    resources[resource].update(records)
+                else:
+                    resources[resource].extend(records)
+        return resources
+
+    def graphql_query(self, query):
+        # The GraphQL API is beside, rather than under, the REST API
+        url = self.netbox.base_url.rstrip("/")
+        if url.endswith("/api"):
+            url = url[:-len("/api")]
+        headers = self.headers()
+        headers["Content-Type"] = "application/json"
+        response = self.netbox.http_session.post(url + "/graphql/", json={"query": query}, headers=headers)
+        if not response.ok:
+            raise AnsibleError("NetBox GraphQL query failed: {0} {1}".format(response.status_code, response.text))
+        result = response.json()
+        if result.get("errors"):
+            raise AnsibleError("NetBox GraphQL query failed: {0}".format(
+                "; ".join(error.get("message", str(error)) for error in result["errors"])))
+        return result["data"]
+
+    def bulk(self, devices):
+        """
+        Fetch the interfaces, ip-addresses and FHRP groups for all of devices
+        in a few paginated calls per chunk of devices.  The FHRP groups are
+        returned as a dict of primary key to group.
+        """
+        resources = {"interfaces": [], "ip-addresses": [], "fhrp-group-assignments": []}
+        device_ids = [device["id"] for device in devices]
+        calls = [(resource, device_ids_chunk) for resource in resources
+                 for device_ids_chunk in chunks(device_ids, self.chunk_size)]
+        results = self.map(lambda call: self.records(call[0], {"device_id": call[1]}), calls)
+        for (resource, device_ids_chunk), records in zip(calls, results):
+            resources[resource].extend(records)
+        # FHRP groups are not tied to a device, so only the ones assigned are fetched
+        resources["fhrp-groups"] = self.fhrp_groups(resources["fhrp-group-assignments"])
+        return resources
+
+
+def ip_addresses_by_interface(ipaddresses):
+    """
+    Split the ip-addresses assigned to interfaces into IPv4 and IPv6,
+    each a dict of interface id to a dict of ip-address id to ip-address.
+    """
+    ipv4_by_intf = {}
+    ipv6_by_intf = {}
+    for ipaddress in ipaddresses:
+        interface_id = None
+        Display().vvvvv(pformat(ipaddress))
+        if ipaddress.get("assigned_object_id"):
+            interface_id = ipaddress["assigned_object_id"]
+        elif ipaddress.get("interface"):
+            interface_id = ipaddress["interface"]["id"]
+        if interface_id is not None:
+            ip_id = ipaddress["id"]
+            # The records are plain dicts that are only read, so they are used without copying
+            if ipaddress["family"] == 6:
+                if interface_id not in ipv6_by_intf:
+                    ipv6_by_intf[interface_id] = {}
+                ipv6_by_intf[interface_id][ip_id] = ipaddress
+            else:
+                if interface_id not in ipv4_by_intf:
+                    ipv4_by_intf[interface_id] = {}
+                ipv4_by_intf[interface_id][ip_id] = ipaddress
+    return ipv4_by_intf, ipv6_by_intf
+
+
+def fhrp_groups_by_interface(group_assignments, fhrp_groups_by_id):
+    """
+    Return a dict of interface id to a dict of FHRP group id to the
+    group, with the priority of the interface's assignment.  Groups are
+    matched to assignments by their primary key, as the same group id
+    (e.g. VRRP VRID) is commonly reused by unrelated groups.
+    """
+    fhrp_by_intf = {}
+    for group_assignment in group_assignments:
+        interface_id = group_assignment.get("interface_id")
+        if interface_id is None:
+            continue
+        group = {"priority": group_assignment["priority"]}
+        fhrp_group = fhrp_groups_by_id.get(group_assignment["group"]["id"])
+        if fhrp_group is not None:
+            group.update(fhrp_group)
+        if interface_id not in fhrp_by_intf:
+            fhrp_by_intf[interface_id] = {}
+        fhrp_by_intf[interface_id][group_assignment["group"]["group_id"]] = group
+    return fhrp_by_intf
+
+
+def with_ip_counts(interfaces, ipv4_by_intf, ipv6_by_intf):
+    """
+    Set the count_ipaddresses of each interface from the ip-addresses fetched
+    with it.  Assigning an address does not update the interface, so the
+    count in a cached interface can be out of date.
+    """
+    counted = []
+    for interface in interfaces:
+        count = len(ipv4_by_intf.get(interface["id"], {})) + len(ipv6_by_intf.get(interface["id"], {}))
+        if interface.get("count_ipaddresses") != count:
+            interface = dict(interface, count_ipaddresses=count)
+        counted.append(interface)
+    return counted
+
+
+def device_to_oc(interfaces, ipaddresses, group_assignments, fhrp_groups_by_id):
+    ipv4_by_intf, ipv6_by_intf = ip_addresses_by_interface(ipaddresses)
+    fhrp_by_intf = fhrp_groups_by_interface(group_assignments, fhrp_groups_by_id)
+    return interfaces_to_oc(with_ip_counts(interfaces, ipv4_by_intf, ipv6_by_intf), ipv4_by_intf, fhrp_by_intf)
+
+
+def index_by_device(devices, resources):
+    """
+    Split the bulk fetched resources into a dict of device name to the
+    resources for that device.  The ip-addresses and FHRP group assignments
+    are matched to devices through the interfaces they are assigned to.
+    """
+    index = {}
+    device_names = {}
+    for device in devices:
+        device_names[device["id"]] = device["name"]
+        index[device["name"]] = {"interfaces": [], "ip-addresses": [], "fhrp-group-assignments": []}
+    device_by_interface = {}
+    for interface in resources["interfaces"]:
+        device_name = device_names.get(interface["device"]["id"])
+        if device_name is not None:
+            device_by_interface[interface["id"]] = device_name
+            index[device_name]["interfaces"].append(interface)
+    for ipaddress in resources["ip-addresses"]:
+        if ipaddress.get("assigned_object_type", "dcim.interface") != "dcim.interface":
+            continue
+        interface_id = ipaddress.get("assigned_object_id")
+        if interface_id is None and ipaddress.get("interface"):
+            interface_id = ipaddress["interface"]["id"]
+        if interface_id in device_by_interface:
+            index[device_by_interface[interface_id]]["ip-addresses"].append(ipaddress)
+    for group_assignment in resources["fhrp-group-assignments"]:
+        if group_assignment.get("interface_type", "dcim.interface") != "dcim.interface":
+            continue
+        if group_assignment.get("interface_id") in device_by_interface:
+            device_name = device_by_interface[group_assignment["interface_id"]]
+            index[device_name]["fhrp-group-assignments"].append(group_assignment)
+    return index
+
+
+def bulk_to_oc(fetcher, names=None, filters=None, mode="rest"):
+    """
+    Return a dict of device name to the OC data for the devices with the
+    given names, or matching filters, fetched in bulk
+    """
+    devices = fetcher.devices(names, filters)
+    Display().vvvv("NetBox bulk lookup for %d devices" % len(devices))
+    if mode == "graphql":
+        resources = fetcher.graphql("device_id", [device["id"] for device in devices])
+    else:
+        resources = fetcher.bulk(devices)
+    oc_by_device = {}
+    for device_name, device_resources in index_by_device(devices, resources).items():
+        oc_by_device[device_name] = {
+            "mdd:openconfig": device_to_oc(device_resources["interfaces"], device_resources["ip-addresses"],
+                                           device_resources["fhrp-group-assignments"], resources["fhrp-groups"])
+        }
+    return oc_by_device
+
+
+def interfaces_to_oc(interface_data, ipv4_by_intf, fhrp_by_intf):
+    interface_dict = {}
+    vrf_interfaces = {}
+
+    oc_interfaces_data = {
+        "openconfig-interfaces:interfaces": {
+            "openconfig-interfaces:interface": []
+        }
+    }
+    for interface in interface_data:
+        # Derive the parent interface and index if exists
+        interface_name = interface["name"]
+        interface_name_parts = interface_name.split(".")
+        interface_parent = interface_name_parts.pop(0)
+        if interface_name_parts:
+            interface_index = int(interface_name_parts.pop(0))
+        else:
+            interface_index = 0
+        interface_type = get_interface_type(interface)
+
+        # Use the description if it exists, otherwise, try to
+        # create one
+        if interface["description"]:
+            interface_description = interface["description"]
+        # elif interface["connected_endpoint"] is not None:
+        #     if interface["connected_endpoint"].get("device"):
+        #         connected_device = interface["connected_endpoint"]["device"]["display"]
+        #         connected_port = interface["connected_endpoint"]["display"]
+        #         interface_description = "{0}:{1}".format(connected_device, connected_port)
+        else:
+            interface_description = ''
+
+        # Create the interface list if it is not there
+        if interface_parent not in interface_dict:
+            interface_dict[interface_parent] = {
+                "openconfig-interfaces:name": interface_parent,
+                "openconfig-interfaces:config": {}
+            }
+        # If this is the parent, fill in the parent config
+        if interface_index == 0:
+            interface_dict[interface_name]["openconfig-interfaces:config"] = {
+                "openconfig-interfaces:description": interface_description,
+                "openconfig-interfaces:enabled": interface["enabled"],
+                "openconfig-interfaces:name": interface_name,
+                "openconfig-interfaces:type": interface_type
+            }
+        if interface["mtu"]:
+            interface_dict[interface_name]["openconfig-interfaces:config"]["openconfig-interfaces:mtu"] = interface["mtu"]
+
+        if interface_type in ["ethernetCsmacd", "softwareLoopback"] and (interface["count_ipaddresses"] > 0 or interface_index > 0):
+            # This is a Layer 3 interface
+            # Create the subinterface structure if it does not exist
+            if not interface_dict[interface_parent].get("openconfig-interfaces:subinterfaces"):
+                interface_dict[interface_parent]["openconfig-interfaces:subinterfaces"] = {
+                    "openconfig-interfaces:subinterface": []
+                }
+            subinterface = {
+                "openconfig-interfaces:index": interface_index,
+                "openconfig-interfaces:config": {
+                    "openconfig-interfaces:description": interface_description,
+                    "openconfig-interfaces:enabled": interface["enabled"],
+                    "openconfig-interfaces:index": interface_index,
+                }
+            }
+        # Check to see if an IP address(s) exists for this interface
+            if interface["id"] in ipv4_by_intf:
+                subinterface["openconfig-if-ip:ipv4"] = {
+                    "openconfig-if-ip:config": {
+                        "openconfig-if-ip:dhcp-client": False,
+                        "openconfig-if-ip:enabled": True
+                    }
+                }
+                for id, value in ipv4_by_intf[interface["id"]].items():
+                    # If this interface is configured for DHCP, set dhcp-client to True and skip IP address section
+                    if value["status"]["value"] == "dhcp":
+                        subinterface["openconfig-if-ip:ipv4"]["openconfig-if-ip:config"]["openconfig-if-ip:dhcp-client"] = True
+                    else:
+                        subinterface["openconfig-if-ip:ipv4"]["openconfig-if-ip:addresses"] = {
+                            "openconfig-if-ip:address": []
+                        }
+                        ip_address, ip_prefix = value["address"].split("/")
+                        address = {
+                            "openconfig-if-ip:ip": ip_address,
+                            "openconfig-if-ip:config": {
+                                "openconfig-if-ip:ip": ip_address,
+                                "openconfig-if-ip:prefix-length": ip_prefix
+                            }
+
+                        }
+                        if interface["id"] in fhrp_by_intf:
+                            vrrp = {
+                                "openconfig-if-ip:vrrp": {
+                                    "openconfig-if-ip:vrrp-group": []
+                                }
+                            }
+                            for group_id, group in fhrp_by_intf[interface["id"]].items():
+                                vip, vip_mask = group["ip_addresses"][0]["address"].split("/")
+                                vrrp_group = {
+                                    "openconfig-if-ip:virtual-router-id": group["group_id"],
+                                    "openconfig-if-ip:config": {
+                                        "openconfig-if-ip:priority": group["priority"],
+                                        "openconfig-if-ip:virtual-address": [
+                                            vip
+                                        ],
+                                        "openconfig-if-ip:virtual-router-id": group["group_id"]
+                                    }
+                                }
+                                vrrp["openconfig-if-ip:vrrp"]["openconfig-if-ip:vrrp-group"].append(vrrp_group)
+                            address.update(vrrp)
+                            Display().vvvvv(pformat(address))
+                        subinterface["openconfig-if-ip:ipv4"]["openconfig-if-ip:addresses"]["openconfig-if-ip:address"].append(address)
+                    # If this IP address is in a VRF, then we need to contruct a list for later
+                    if value["vrf"] is not None:
+                        if value["vrf"]["name"] not in vrf_interfaces:
+                            vrf_interfaces[value["vrf"]["name"]] = []
+                        vrf_interface = {
+                            "openconfig-network-instance:id": interface_name,
+                            "openconfig-network-instance:interface": interface_parent,
+                            "openconfig-network-instance:subinterface": interface_index
+                        }
+                        vrf_interfaces[value["vrf"]["name"]].append(vrf_interface)
+
+                    if value["status"]["value"] == "dhcp":
+                        subinterface["openconfig-if-ip:ipv4"]["openconfig-if-ip:config"]["openconfig-if-ip:dhcp-client"] = True
+
+            if interface["untagged_vlan"] is not None:
+                subinterface["openconfig-vlan:vlan"] = {
+                    "openconfig-vlan:config": {
+                        "openconfig-vlan:vlan-id": interface["untagged_vlan"]["vid"]
+                    }
+                }
+            interface_dict[interface_parent]["openconfig-interfaces:subinterfaces"]["openconfig-interfaces:subinterface"].append(subinterface)
+        elif interface_type == "l2vlan":
+            interface_dict[interface_parent]["openconfig-interfaces:config"]["openconfig-interfaces:type"] = "l2vlan"
+            interface_dict[interface_parent]["openconfig-if-ethernet:ethernet"] = {
+                # "openconfig-vlan:config": {},
+                "openconfig-vlan:switched-vlan": {}
+            }
+            switched_vlan = {
+                "openconfig-vlan:config": {}
+            }
+            # This is a Layer 2 interface
+            if interface["mode"]["value"] == "access":
+                switched_vlan["openconfig-vlan:config"]["openconfig-vlan:interface-mode"] = "ACCESS"
+                if interface["untagged_vlan"] is not None:
+                    switched_vlan["openconfig-vlan:config"]["openconfig-vlan:access-vlan"] = interface["untagged_vlan"]["vid"]
+            if interface["mode"]["value"] == "tagged":
+                switched_vlan["openconfig-vlan:config"]["openconfig-vlan:interface-mode"] = "TRUNK"
+                if interface["untagged_vlan"] is not None:
+                    switched_vlan["openconfig-vlan:config"]["openconfig-vlan:native-vlan"] = interface["untagged_vlan"]["vid"]
+                if interface["tagged_vlans"] is not None:
+                    allowed_vlans = []
+                    for vlan in interface["tagged_vlans"]:
+                        allowed_vlans.append(str(vlan["vid"]))
+                    switched_vlan["openconfig-vlan:config"]["openconfig-vlan:trunk-vlans"] = allowed_vlans
+            interface_dict[interface_parent]["openconfig-if-ethernet:ethernet"]["openconfig-vlan:switched-vlan"] = switched_vlan
+        elif interface_type == "l3ipvlan":
+            interface_dict[interface_parent]["openconfig-interfaces:config"]["openconfig-interfaces:type"] = "l3ipvlan"
+            # interface_dict[interface_parent]["openconfig-if-ethernet:ethernet"] = {
+            #     # "openconfig-vlan:config": {},
+            #     "openconfig-vlan:routed-vlan": {}
+            # }
+            routed_vlan = {
+                "openconfig-vlan:config": {},
+                "openconfig-if-ip:ipv4": {}
+            }
+            if interface["untagged_vlan"] is not None:
+                routed_vlan["openconfig-vlan:config"] = {
+                    "vlan": interface["untagged_vlan"]["vid"]
+                }
+            else:
+                vid = findall(r'\d+', interface["name"])
+                if vid != "":
+                    routed_vlan["openconfig-vlan:config"] = {
+                        "vlan": vid[0]
+                    }
+            if interface["id"] in ipv4_by_intf:
+                routed_vlan["openconfig-if-ip:ipv4"] = {
+                    "openconfig-if-ip:config": {
+                        "openconfig-if-ip:dhcp-client": False,
+                        "openconfig-if-ip:enabled": True
+                    },
+                    "openconfig-if-ip:addresses": {
+                        "openconfig-if-ip:address": []
+                    }
+                }
+                for id, value in ipv4_by_intf[interface["id"]].items():
+                    ip_address, ip_prefix = value["address"].split("/")
+                    address = {
+                        "openconfig-if-ip:ip": ip_address,
+                        "openconfig-if-ip:config": {
+                            "openconfig-if-ip:ip": ip_address,
+                            "openconfig-if-ip:prefix-length": ip_prefix
+                        }
+                    }
+                    routed_vlan["openconfig-if-ip:ipv4"]["openconfig-if-ip:addresses"]["openconfig-if-ip:address"].append(address)
+                    # If this IP address is in a VRF, then we need to contruct a list for later
+                    if value["vrf"] is not None:
+                        if value["vrf"]["name"] not in vrf_interfaces:
+                            vrf_interfaces[value["vrf"]["name"]] = []
+                        vrf_interface = {
+                            "openconfig-network-instance:id": interface_name,
+                            "openconfig-network-instance:interface": interface_parent,
+                            "openconfig-network-instance:subinterface": interface_index
+                        }
+                        vrf_interfaces[value["vrf"]["name"]].append(vrf_interface)
+            interface_dict[interface_parent]["openconfig-vlan:routed-vlan"] = routed_vlan
+    # Need to take the dict and make it into a list
+    for key, value in interface_dict.items():
+        oc_interfaces_data["openconfig-interfaces:interfaces"]["openconfig-interfaces:interface"].append(value)
+    # Process the VRF interface structure that was created earlier
+    if vrf_interfaces:
+        oc_interfaces_data["openconfig-network-instance:network-instances"] = {
+            "openconfig-network-instance:network-instance": []
+        }
+        for vrf, interfaces in vrf_interfaces.items():
+            vrf_instance = {
+                "openconfig-network-instance:name": vrf,
+                "openconfig-network-instance:config": {
+                    "openconfig-network-instance:name": vrf,
+                    "openconfig-network-instance:type": 'L3VRF',
+                    "openconfig-network-instance:enabled": True,
+                    "openconfig-network-instance:enabled-address-families": [
+                        "IPV4",
+                        "IPV6"
+                    ]
+                },
+                "openconfig-network-instance:interfaces": {
+                    "openconfig-network-instance:interface": []
+                }
+            }
+            for interface in interfaces:
+                vrf_instance_interfaces = {
+                    "openconfig-network-instance:id": interface["openconfig-network-instance:id"],
+                    "openconfig-network-instance:config": interface
+                }
+                vrf_instance["openconfig-network-instance:interfaces"]["openconfig-network-instance:interface"].append(vrf_instance_interfaces)
+            oc_interfaces_data["openconfig-network-instance:network-instances"]["openconfig-network-instance:network-instance"].append(vrf_instance)
+    return oc_interfaces_data
@@ -0,0 +1,344 @@
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+import os
+import re
+import stat
+import tempfile
+from collections import OrderedDict
+
+from ansible_collections.ciscops.mdd.plugins.module_utils.datavalidation import (
+    VALIDATOR_CACHE_SIZE, MDD202012Validator, ValidationError, dialect, digest, get_validator, is_ip_address
+)
+
+# Bump when the generated code changes so that stale files in the cache are not used
+GENERATOR_VERSION = 2
+
+# Keywords that are turned into Python.  Any other keyword known to the
+# validator causes its subschema to be checked by jsonschema instead.
+COMPILED_KEYWORDS = frozenset((
+    'type', 'required', 'properties', 'additionalProperties', 'items', 'enum', 'const',
+    'minimum', 'maximum', 'exclusiveMinimum', 'exclusiveMaximum', 'minLength', 'maxLength',
+    'pattern', 'minItems', 'maxItems', 'in_subnet', 'format'
+))
+
+# Keywords that need the whole schema, so any schema using one is not compiled at all
+UNCOMPILABLE_KEYWORDS = frozenset(('$ref', '$dynamicRef', '$recursiveRef'))
+
+TYPE_CHECKS = {
+    'object': 'isinstance(instance, dict)',
+    'array': 'isinstance(instance, list)',
+    'string': 'isinstance(instance, str)',
+    'null': 'instance is None',
+    'boolean': 'isinstance(instance, bool)',
+    'ipaddress': '_is_ip_address(None, instance)',
+}
+
+# Comparison keywords mapped to the condition that fails them
+NUMBER_CHECKS = {
+    'minimum': '<',
+    'maximum': '>',
+    'exclusiveMinimum': '<=',
+    'exclusiveMaximum': '>=',
+}
+
+LENGTH_CHECKS = {
+    'minLength': ('str', '<'),
+    'maxLength': ('str', '>'),
+    'minItems': ('list', '<'),
+    'maxItems': ('list', '>'),
+}
+
+_compiled = OrderedDict()
+
+
+def json_path(path, extra=()):
+    elements = []
+    while path is not None:
+        path, element = path
+        elements.append(element)
+    elements.reverse()
+    elements.extend(extra)
+    # Let jsonschema format the path so that keys are quoted the same way
+    return ValidationError('', path=elements).json_path
+
+
+def uses_keyword(schema, keywords):
+    if isinstance(schema, dict):
+        for key, value in schema.items():
+            if key in keywords or uses_keyword(value, keywords):
+                return True
+    elif isinstance(schema, list):
+        return any(uses_keyword(item, keywords) for item in schema)
+    return False
+
+
+class SchemaCodeGenerator(object):
+    """
+    Generate Python source for a function validate(instance) that yields the
+    same errors (as dicts) as validating against schema with jsonschema.
+    Failing checks get their error messages from the validator's own keyword
+    functions, so only the checks themselves are specialized.
+    """
+
+    def __init__(self, schema, cls):
+        self.schema = schema
+        self.cls = cls
+        self.lines = []
+        self.constants = []
+        self.count = 0
+
+    def constant(self, value):
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return repr(value)
+        self.constants.append(value)
+        return "C{0}".format(len(self.constants) - 1)
+
+    def literal(self, value):
+        # repr() of a compiled pattern is cut short, so rebuild patterns from their source
+        if isinstance(value, re.Pattern):
+            return "re.compile({0!r})".format(value.pattern)
+        if isinstance(value, frozenset):
+            return "frozenset({0!r})".format(sorted(value))
+        return repr(value)
+
+    def generate(self):
+        root = self.function(self.schema)
+        source = ["# Generated from schema {0}".format(digest(self.schema))]
+        for index, value in enumerate(self.constants):
+            source.append("C{0} = {1}".format(index, self.literal(value)))
+        source.extend(self.lines)
+        source.append("")
+        source.append("def validate(instance):")
+        source.append("    return {0}(instance, None)".format(root))
+        source.append("")
+        return "\n".join(source)
+
+    def function(self, schema):
+        name = "v{0}".format(self.count)
+        self.count += 1
+        body = []
+        if schema is True or schema == {}:
+            pass
+        elif schema is False:
+            body.append("yield from _false_schema(instance, path)")
+        elif not self.compilable(schema):
+            body.append("yield from _fallback({0}, instance, path)".format(self.constant(schema)))
+        else:
+            for keyword, value in schema.items():
+                if keyword in COMPILED_KEYWORDS:
+                    body.extend(self.keyword(keyword, value, schema))
+        self.lines.append("")
+        self.lines.append("def {0}(instance, path):".format(name))
+        for line in body:
+            self.lines.append("    " + line)
+        self.lines.append("    yield from ()")
+        return name
+
+    def compilable(self, schema):
+        if not isinstance(schema, dict) or isinstance(schema.get('items'), list):
+            return False
+        return not any(k in self.cls.VALIDATORS and k not in COMPILED_KEYWORDS for k in schema)
+
+    def errors(self, keyword, value, schema):
+        # The keyword functions only look at the parts of the schema they need,
+        # so pass just those rather than the whole (possibly large) subschema
+        context = {keyword: value}
+        if keyword == 'additionalProperties':
+            context['properties'] = dict.fromkeys(schema.get('properties', {}), True)
+        return "    yield from _keyword_errors({0!r}, {1}, instance, {2}, path)".format(
+            keyword, self.constant(value), self.constant(context))
+
+    def keyword(self, keyword, value, schema):
+        if keyword == 'type':
+            types = value if isinstance(value, list) else [value]
+            checks = [TYPE_CHECKS.get(t, "_is_type(instance, {0!r})".format(t)) for t in types]
+            return ["if not ({0}):".format(" or ".join(checks)), self.errors(keyword, value, schema)]
+        if keyword == 'required':
+            if not value:
+                return []
+            missing = " or ".join("{0!r} not in instance".format(name) for name in value)
+            return ["if isinstance(instance, dict) and ({0}):".format(missing), self.errors(keyword, value, schema)]
+        if keyword == 'properties':
+            lines = ["if isinstance(instance, dict):"]
+            for name, subschema in value.items():
+                function = self.function(subschema)
+                lines.append("    if {0!r} in instance:".format(name))
+                lines.append("        yield from {0}(instance[{1!r}], (path, {1!r}))".format(function, name))
+            return lines
+        if keyword == 'additionalProperties':
+            if value is True:
+                return []
+            known = self.constant(frozenset(schema.get('properties', {})))
+            if value is False:
+                return ["if isinstance(instance, dict) and any(key not in {0} for key in instance):".format(known),
+                        self.errors(keyword, value, schema)]
+            function = self.function(value)
+            # jsonschema visits the additional properties in the order of a set built from the keys
+            return ["if isinstance(instance, dict):",
+                    "    for key in set(key for key in instance if key not in {0}):".format(known),
+                    "        yield from {0}(instance[key], (path, key))".format(function)]
+        if keyword == 'items':
+            if value is True:
+                return []
+            if value is False:
+                return ["if isinstance(instance, list) and instance:", self.errors(keyword, value, schema)]
+            function = self.function(value)
+            return ["if isinstance(instance, list):",
+                    "    for index, item in enumerate(instance):",
+                    "        yield from {0}(item, (path, index))".format(function)]
+        if keyword == 'enum':
+            if value and all(isinstance(item, str) for item in value):
+                members = self.constant(frozenset(value))
+                return ["if not (isinstance(instance, str) and instance in {0}):".format(members),
+                        self.errors(keyword, value, schema)]
+            return ["if True:", self.errors(keyword, value, schema)]
+        if keyword == 'const':
+            if isinstance(value, str):
+                return ["if not (isinstance(instance, str) and instance == {0!r}):".format(value),
+                        self.errors(keyword, value, schema)]
+            return ["if True:", self.errors(keyword, value, schema)]
+        if keyword in NUMBER_CHECKS:
+            return ["if _is_type(instance, 'number') and instance {0} {1!r}:".format(NUMBER_CHECKS[keyword], value),
+                    self.errors(keyword, value, schema)]
+        if keyword in LENGTH_CHECKS:
+            instance_type, operator = LENGTH_CHECKS[keyword]
+            return ["if isinstance(instance, {0}) and len(instance) {1} {2!r}:".format(instance_type, operator, value),
+                    self.errors(keyword, value, schema)]
+        if keyword == 'pattern':
+            pattern = self.constant(re.compile(value))
+            return ["if isinstance(instance, str) and not {0}.search(instance):".format(pattern),
+                    self.errors(keyword, value, schema)]
+        if keyword == 'in_subnet':
+            return ["if _is_ip_address(None, instance):", self.errors(keyword, value, schema)]
+        # format is only an annotation without a format checker
+        return []
+
+
+def generate_source(schema, cls=None):
+    return SchemaCodeGenerator(schema, cls or MDD202012Validator).generate()
+
+
+def load_source(source, cls, store=None):
+    validator = cls({})
+
+    def _keyword_errors(keyword, value, instance, schema, path):
+        for error in validator.VALIDATORS[keyword](validator, value, instance, schema) or ():
+            yield {
+                'json_path': json_path(path, error.relative_path),
+                # Errors from a subschema the keyword descended into already name their validator
+                'validator': (error.validator if isinstance(error.validator, str) or error.validator is None
+                              else keyword),
+                'message': error.message
+            }
+
+    def _false_schema(instance, path):
+        # jsonschema reports a false subschema at the path of whatever holds it
+        for error in validator.descend(instance, False):
+            yield {
+                'json_path': json_path(path[0] if path is not None else None),
+                'validator': error.validator,
+                'message': error.message
+            }
+
+    def _fallback(schema, instance, path):
+        for error in get_validator(schema, cls, store).iter_errors(instance):
+            yield {
+                'json_path': json_path(path, error.absolute_path),
+                'validator': error.validator,
+                'message': error.message
+            }
+
+    namespace = {
+        're': re,
+        '_is_type': validator.is_type,
+        '_is_ip_address': is_ip_address,
+        '_keyword_errors': _keyword_errors,
+        '_fallback': _fallback,
+        '_false_schema': _false_schema,
+    }
+    exec(compile(source, '<mdd-schema>', 'exec'), namespace)
+    return namespace['validate']
+
+
+def trusted(path):
+    """
+    Whether path is owned by this user and nobody else can write to it, as
+    cached code is run as is
+    """
+    try:
+        path_stat = os.stat(path)
+    except OSError:
+        return False
+    return path_stat.st_uid == os.getuid() and not path_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def read_source(cache_file):
+    if not (trusted(os.path.dirname(cache_file)) and trusted(cache_file)):
+        return None
+    with open(cache_file) as f:
+        return f.read()
+
+
+def write_source(cache_file, source):
+    cache_dir = os.path.dirname(cache_file)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir, mode=0o700)
+    if not trusted(cache_dir):
+        # Nothing written here would be read back
+        return
+    fd, temp_file = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write(source)
+    os.replace(temp_file, cache_file)
+
+
+def compile_schema(schema, cls=None, cache_dir=None, store=None):
+    """
+    Return a function that yields the errors for an instance as dicts of
+    json_path, validator and message.  Schemas that use $ref are validated
+    by jsonschema directly, resolving references from store when given.
+    When cache_dir is given, the generated source is kept there by schema
+    digest and reused by later runs, as long as the directory and file
+    belong to this user and are writable by nobody else.
+    """
+    if cls is None:
+        cls = MDD202012Validator
+    schema_digest = digest(schema)
+    key = (cls, schema_digest, store.digest if store is not None else None)
+    if key in _compiled:
+        _compiled.move_to_end(key)
+        return _compiled[key]
+
+    if uses_keyword(schema, UNCOMPILABLE_KEYWORDS):
+        validate = fallback_validator(schema, cls, store)
+    else:
+        source = None
+        cache_file = None
+        if cache_dir:
+            cache_file = os.path.join(os.path.expanduser(cache_dir), "{0}-{1}-v{2}.py".format(
+                dialect(cls), schema_digest, GENERATOR_VERSION))
+            if os.path.exists(cache_file):
+                source = read_source(cache_file)
+        if source is None:
+            source = generate_source(schema, cls)
+            if cache_file:
+                write_source(cache_file, source)
+        validate = load_source(source, cls, store)
+
+    _compiled[key] = validate
+    if len(_compiled) > VALIDATOR_CACHE_SIZE:
+        _compiled.popitem(last=False)
+    return validate
+
+
+def fallback_validator(schema, cls, store=None):
+    mdd_validator = get_validator(schema, cls, store)
+
+    def validate(instance):
+        for error in mdd_validator.iter_errors(instance):
+            yield {
+                'json_path': error.json_path,
+                'validator': error.validator,
+                'message': error.message
+            }
+    return validate
@@ -0,0 +1,106 @@
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+import os
+import tempfile
+import traceback
+
+try:
+    import yaml
+    from yaml.events import (DocumentEndEvent, DocumentStartEvent, MappingEndEvent, MappingStartEvent,
+                             SequenceEndEvent, SequenceStartEvent)
+except ImportError:
+    HAS_YAML = False
+    YAML_IMPORT_ERROR = traceback.format_exc()
+    Dumper = object
+else:
+    HAS_YAML = True
+    YAML_IMPORT_ERROR = None
+    Dumper = yaml.Dumper
+    SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+class NicerDumper(Dumper):
+    """
+    Dump YAML as the ciscops.mdd.to_even_nicer_yaml filter does, with list
+    items indented under their key, and without aliases since the data is
+    written as if it had been through JSON
+    """
+
+    def increase_indent(self, flow=False, indentless=False):
+        return super(NicerDumper, self).increase_indent(flow, False)
+
+    def ignore_aliases(self, data):
+        return True
+
+
+def emit_data(dumper, data, depth):
+    """
+    Emit data, representing it a piece at a time down to depth levels of
+    dicts and lists so that the whole document is never held as YAML nodes
+    """
+    if depth > 0 and isinstance(data, dict):
+        dumper.emit(MappingStartEvent(anchor=None, tag=None, implicit=True, flow_style=False))
+        for key, value in data.items():
+            emit_data(dumper, key, 0)
+            emit_data(dumper, value, depth - 1)
+        dumper.emit(MappingEndEvent())
+    elif depth > 0 and isinstance(data, list):
+        dumper.emit(SequenceStartEvent(anchor=None, tag=None, implicit=True, flow_style=False))
+        for item in data:
+            emit_data(dumper, item, depth - 1)
+        dumper.emit(SequenceEndEvent())
+    else:
+        # What Representer.represent() and Serializer.serialize() do for a
+        # whole document, for just this piece of it
+        node = dumper.represent_data(data)
+        dumper.anchor_node(node)
+        dumper.serialize_node(node, None, None)
+        dumper.represented_objects = {}
+        dumper.object_keeper = []
+        dumper.alias_key = None
+        dumper.serialized_nodes = {}
+        dumper.anchors = {}
+
+
+def dump_yaml(data, stream, depth=2):
+    """
+    Write data to stream as the ciscops.mdd.to_even_nicer_yaml filter does
+    """
+    dumper = NicerDumper(stream, default_flow_style=False, explicit_start=True, sort_keys=False)
+    try:
+        dumper.open()
+        dumper.emit(DocumentStartEvent(explicit=True))
+        emit_data(dumper, data, depth)
+        dumper.emit(DocumentEndEvent(explicit=False))
+        dumper.close()
+    finally:
+        dumper.dispose()
+
+
+def write_yaml_temp(path, data, depth=2):
+    """
+    Write data as YAML to a new temporary file beside path, to be moved over
+    it, and return the temporary file's name
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, temp_file = tempfile.mkstemp(dir=directory, prefix=".{0}.".format(os.path.basename(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            dump_yaml(data, f, depth)
+    except Exception:
+        os.unlink(temp_file)
+        raise
+    return temp_file
+
+
+def load_yaml_file(path):
+    """
+    Return the data in the YAML file at path, or None if there is no such file
+    """
+    if not os.path.exists(path):
+        return None
+    # libyaml reads bytes faster than it decodes text from Python
+    with open(path, 'rb') as f:
+        return yaml.load(f, Loader=SafeLoader)
@@ -38,7 +38,12 @@ requirements:
 version_added: '1.2.0'
 options:
     devices:
-        description: The devices used to build the topology
+        description:
+          - The devices used to build the topology, each a dict of C(hostname), C(tags) and C(cdp).
+          - C(cdp) is either the text of C(show cdp neighbors), or the neighbors already parsed, e.g. by
+            Genie from C(show cdp neighbors detail) or as JSON from NSO. Parsed neighbors each have a
+            C(device_id), C(local_interface) and C(port_id), and optionally C(platform) and C(capabilities)
+            (NSO's hyphenated names, e.g. C(device-id), are accepted too).
         required: true
         type: list
         elements: dict
@@ -65,6 +70,88 @@ options:
         required: no
         type: bool
         default: false
+    layout:
+        description:
+          - The layout used to place the nodes (see the ciscops.mdd.graph filter).
+          - C(auto) picks C(kamada_kawai) for small labs, C(spring) for larger ones and C(grouped) for the largest.
+          - C(grouped) stacks the routers, l3switches and switches in bands, with neighbours near each other, and
+            does not need networkx.
+          - C(spring) and C(planar) need networkx and numpy, and C(spectral) and C(kamada_kawai) need scipy too.
+          - C(none) leaves the nodes in a row.
+        required: false
+        type: str
+        default: none
+        choices: ['none', 'auto', 'grouped', 'spring', 'planar', 'spectral', 'kamada_kawai']
+    scale:
+        description: The scale of the I(layout)
+        required: false
+        type: int
+        default: 500
+    layout_cache_dir:
+        description: A directory where layouts are kept, so that the same topology is not laid out again
+        required: false
+        type: path
+    topology_file:
+        description:
+          - Write the topology to this file as YAML, rather than returning it.
+          - The file is written to a temporary file and moved into place, and is only replaced when it changes.
+        required: false
+        type: path
+    mappings_file:
+        description:
+          - Write the interface mappings to this file as an inventory (C(all.hosts)) in YAML, rather than returning
+            them.
+          - The file is written to a temporary file and moved into place, and is only replaced when it changes.
+        required: false
+        type: path
+    existing_topology:
+        description:
+          - A topology file from an earlier run, usually the same as I(topology_file).
+          - Nodes, interfaces and links that are still in the topology keep their ids, nodes keep their position
+            (with a I(layout), only new nodes are placed), and the lab keeps its title and notes. Anything new gets
+            an id no earlier node, interface or link had, so the difference (returned as I(delta)) can be applied to
+            a running lab.
+          - Nodes are matched by label, interfaces by label within their node, and links by the labels of both ends.
+          - A missing file is taken as an empty topology.
+        required: false
+        type: path
+    partition:
+        description:
+          - Split the devices into several labs that each fit the given limits, cutting as few links as possible.
+          - Each lab gets its own topology, with an external connector at each end of every link cut between labs
+            so the labs can be joined up, and each host's mappings name its lab in C(cml_lab_partition).
+          - The devices of a site are kept in one lab when they fit. Otherwise, and for devices with no site, the
+            devices are split into connected groups, each grown from its busiest device by the neighbour with the
+            most links into it, and the groups are put in the lab they have the most links to that has room.
+          - When I(topology_file) is given, each lab's topology is written beside it with the lab number before the
+            extension, e.g. C(cml_lab-1.yaml), as well as the whole topology to I(topology_file).
+        required: false
+        type: dict
+        suboptions:
+            max_nodes:
+                description: The most device nodes in a lab (external connectors are not counted). C(0) is no limit.
+                type: int
+                default: 0
+            max_ram:
+                description:
+                  - The most RAM, in MB, that the nodes of a lab can use (from I(device_template)). C(0) is no limit.
+                type: int
+                default: 0
+            max_cpus:
+                description: The most CPUs that the nodes of a lab can use (from I(device_template)). C(0) is no limit.
+                type: int
+                default: 0
+            site_tags:
+                description: The tags that name sites. A device's site is the first of these in its C(tags).
+                type: list
+                elements: str
+                default: []
+            cut_link_configuration:
+                description:
+                  - The configuration (bridge) of the external connectors of a cut link, where C({0}) is the number
+                    of the cut link, so that both ends of a link share a bridge and no other link does.
+                type: str
+                default: bridge{0}
 """
 
 EXAMPLES = r"""
@@ -76,163 +163,120 @@ EXAMPLES = r"""
       ciscops.mdd.generate_topology:
         devices: "{{ devices }}"
       register: topology
-"""
-
-import copy
-from ansible.module_utils.basic import AnsibleModule
-
-interface_types_list = ["Fas", "Ten", "Gig"]
-
-
-def create_node(node_input):
-    device = {
-        "boot_disk_size": 0,
-        "configuration": node_input["configuration"],
-        "cpu_limit": 100,
-        "cpus": node_input.get("cpus", 1),
-        "data_volume": 0,
-        "hide_links": False,
-        "id": node_input["id"],
-        "label": node_input["hostname"],
-        "node_definition": node_input["node_definition"],
-        "ram": node_input["ram"],
-        "tags": node_input["tags"],
-        "x": node_input["x_position"],
-        "y": node_input.get("y_position", 0),
-        "interfaces": [
-            {
-                "id": "i0",
-                "label": "Loopback0",
-                "type": "loopback"
-            }
-        ]
-    }
-    if node_input.get("image_definition"):
-        device["image_definition"] = node_input.get("image_definition")
-    return device
 
+    - name: Build the topology and write it and the mappings to files
+      ciscops.mdd.cml_lab:
+        devices: "{{ devices }}"
+        device_template: "{{ cml_device_template }}"
+        default_mappings: "{{ cml_default_mappings }}"
+        layout: auto
+        topology_file: files/cml_lab.yaml
+        mappings_file: inventory/cml_intf_map.yml
 
-def switch_generate_interface(c, m, s):
-    """
-    Increments module and interface numbering for switches using modules of 4 interfaces, e.g.
-        Gig0/0, Gig0/1, Gig0/2, Gig0/3, Gig1/0...
-    :param c: int, interface number
-    :param m: int, module number
-    :param s: int, CML topo slot number
-    :return: tuple, if-counter, module number, slot number
-    """
-    if c == 3:
-        m += 1
-        c = 0
-    else:
-        c += 1
-    s += 1
-    return c, m, s
+    - name: Refresh the topology, keeping the ids of what has not changed
+      ciscops.mdd.cml_lab:
+        devices: "{{ devices }}"
+        device_template: "{{ cml_device_template }}"
+        default_mappings: "{{ cml_default_mappings }}"
+        existing_topology: files/cml_lab.yaml
+        topology_file: files/cml_lab.yaml
+      register: refresh
 
+    - name: Show what changed
+      debug:
+        msg: "{{ refresh.delta }}"
 
-def add_interfaces_to_topology(topo_node, device_info, physical_interfaces, use_cat9kv=False):
-    """
-    Adds interfaces to the devices in the CML topology
-    """
-    number_of_interfaces = len(physical_interfaces) + 3  # initial + 2 spares
-    number_of_interfaces += 4 - (number_of_interfaces % 4)  # interfaces come in sets of 4
-    if device_info["type"] == "l3switch" and use_cat9kv is True:
-        topo_node["interfaces"].append({
-            "id": "i1",
-            "label": "GigabitEthernet0/0",
-            "slot": 0,
-            "type": "physical"
-        })
-        counter = 1
-        # cat9kv *requires* that 24 ports be configured for the 24-port version
-        for i in range(24):
-            topo_node["interfaces"].append({
-                "id": "i{0}".format(counter + 1),
-                "label": "GigabitEthernet1/0/{0}".format(counter),
-                "slot": counter,
-                "type": "physical"
-            })
-            counter += 1
-    elif device_info["type"] == "switch" or (device_info["type"] == "l3switch" and use_cat9kv is not True):
-        slot = 0
-        mod = 0
-        counter = 0
-        if_id = 1
-        for i in range(number_of_interfaces):
-            topo_node["interfaces"].append({
-                "id": "i{0}".format(if_id),
-                "label": "GigabitEthernet{0}/{1}".format(mod, counter),
-                "slot": slot,
-                "type": "physical"
-            })
-            counter, mod, slot = switch_generate_interface(counter, mod, slot)
-            if_id += 1
-    elif device_info["type"] == "router":
-        slot = 0
-        counter = 1
-        for i in range(number_of_interfaces):
-            topo_node["interfaces"].append({
-                "id": "i{0}".format(counter),
-                "label": "GigabitEthernet{0}".format(counter),
-                "slot": slot,
-                "type": "physical"
-            })
-            slot += 1
-            counter += 1
-
+    - name: Split the topology into labs of up to 40 devices and 64GB, keeping sites together
+      ciscops.mdd.cml_lab:
+        devices: "{{ devices }}"
+        device_template: "{{ cml_device_template }}"
+        default_mappings: "{{ cml_default_mappings }}"
+        partition:
+          max_nodes: 40
+          max_ram: 65536
+          site_tags: "{{ groups | select('match', 'site') | list }}"
+        topology_file: files/cml_lab.yaml
+        mappings_file: inventory/cml_intf_map.yml
+"""
 
-def map_physical_interfaces_to_logical_interfaces(topo_node, physical_interfaces, start_from):
-    """
-    Creates a dict of devices with dicts of interfaces with dicts of physical interface names containing dicts of
-    virtual interfaces and ids. Device dict also contains node-id, e.g.
-    {'Router-01': {'interfaces': {'Gig0': {'if-name': 'GigabitEthernet2', 'id': 'i2'},
-    'Gig0/0/0': {'if-name': 'GigabitEthernet3', 'id': 'i3'},
-    'Gig0/0/1': {'if-name': 'GigabitEthernet4', 'id': 'i4'}},
-    'node_id': 'n0'}
-    :param topo_node:
-    :param physical_interfaces:
-    :return: dict
-    """
-    mapping = {}
+RETURN = r"""
+topology:
+    description: The CML topology, when I(topology_file) is not given
+    returned: when I(topology_file) is not given
+    type: dict
+mappings:
+    description: The physical to virtual interface mappings for each host, when I(mappings_file) is not given
+    returned: when I(mappings_file) is not given
+    type: dict
+delta:
+    description:
+      - The difference between I(existing_topology) and the new topology.
+      - The nodes and links added and removed, and the nodes whose definition other than position has changed.
+    returned: when I(existing_topology) is given
+    type: dict
+    sample:
+      links:
+        added:
+          - {id: l7, i1: i4, i2: i3, label: router1<->router3, n1: n0, n2: n5}
+        removed: []
+      nodes:
+        added: []
+        changed:
+          - {id: n5, label: router3, interfaces: [], node_definition: csr1000v}
+        removed: []
+partitions:
+    description:
+      - The labs the devices were split into, with their devices, the resources they use and the number of links
+        cut to other labs.
+      - Each has its C(topology), or the C(file) it was written to when I(topology_file) is given.
+    returned: when I(partition) is given
+    type: list
+    sample:
+      - name: generated_lab-1
+        devices: [router1, router2]
+        nodes: 2
+        ram: 6144
+        cpus: 2
+        cut_links: 1
+        file: files/cml_lab-1.yaml
+cut_links:
+    description: The links cut between labs, with the configuration of their external connectors and their two ends
+    returned: when I(partition) is given
+    type: list
+    sample:
+      - id: l7
+        label: router2<->switch1
+        configuration: bridge1
+        ends:
+          - {device: router2, interface: GigabitEthernet4, partition: generated_lab-1}
+          - {device: switch1, interface: GigabitEthernet0/2, partition: generated_lab-2}
+summary:
+    description: The number of devices, nodes and links in the topology, and of labs and cut links when partitioned
+    returned: always
+    type: dict
+    sample:
+      devices: 2
+      links: 3
+      nodes: 4
+"""
 
-    # If start_from > 1, find mgmt interface and make sure we map that as well, otherwise it will be truncated
-    if start_from > 1:
-        for interface in topo_node["interfaces"]:
-            if interface["id"] == "i1":
-                mapping[interface["label"]] = {"if-name": interface["label"], "id": interface["id"]}
-        start_from = start_from - 1
-    for i in range(len(physical_interfaces)):
-        mapping[physical_interfaces[i]] = {"if-name": topo_node["interfaces"][start_from + i + 1]["label"],
-                                           "id": topo_node["interfaces"][start_from + i + 1]["id"]}
-    return mapping
+import copy
+import filecmp
+import heapq
+import os
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible_collections.ciscops.mdd.plugins.module_utils.graph import (
+    LayoutCache, layout_topology, missing_layout_library, previous_positions
+)
+from ansible_collections.ciscops.mdd.plugins.module_utils.yamlstream import (
+    HAS_YAML, YAML_IMPORT_ERROR, load_yaml_file, write_yaml_temp
+)
 
+interface_types_list = ["Fas", "Ten", "Gig"]
 
-def cml_topology_create_initial(devices_with_interface_dict, remote_device_info_full, start_from, device_template,
-                                use_cat9kv=False, devices=None):
-    """
-    Creates CML topology file and adds nodes
-    :param devices_with_interface_dict:
-    :param remote_device_info_full:
-    :return:
-    """
-    mappings = {}
-    topology = {
-        "lab": {
-            "description": "",
-            "notes": "",
-            "title": "generated_lab",
-            "version": "0.1.0"
-        },
-        "links": [],
-        "nodes": []
-    }
-    node_counter = 0
-    x_position = 0
-    for device in devices_with_interface_dict:
-        # # Only add devices that were included in devices list
-        if device in devices:
-            configs = {
-                "router": '''
+# Bootstrap configurations for each device type, with {0} for the hostname
+BOOTSTRAP_CONFIGS = {
+    "router": '''
     hostname {0}
     !
     vrf definition Mgmt-intf
@@ -262,8 +306,8 @@ def cml_topology_create_initial(devices_with_interface_dict, remote_device_info_
      exit
     netconf ssh
     end
-    '''.format(device),
-                "switch": '''
+    ''',
+    "switch": '''
     "hostname {0}
     !
     vrf definition Mgmt-intf
@@ -317,8 +361,8 @@ def cml_topology_create_initial(devices_with_interface_dict, remote_device_info_
      exit
      netconf ssh
      end"
-    '''.format(device),
-                "l3switch": '''
+    ''',
+    "l3switch": '''
     hostname {0}
     !
     vrf definition Mgmt-intf
@@ -434,14 +478,232 @@ def cml_topology_create_initial(devices_with_interface_dict, remote_device_info_
     license boot level network-advantage addon dna-advantage
     license boot level network-advantage
     end
-    '''.format(device)
+    ''',
+}
+
+# The configurations split around the hostname, so that each node's is joined
+# from the pieces rather than formatted from the whole text
+BOOTSTRAP_TEMPLATES = dict((device_type, config.split("{0}")) for device_type, config in BOOTSTRAP_CONFIGS.items())
+
+
+def bootstrap_config(device_type, hostname):
+    return hostname.join(BOOTSTRAP_TEMPLATES[device_type])
+
+
+class Link(object):
+    """
+    A link between two (device, interface) endpoints, in the order they were
+    found.  Links with the same endpoints are equal whichever way round they
+    were found.  A device can only have one endpoint, so a link from a
+    device to itself has just the last endpoint given for it.
+    """
+    __slots__ = ("endpoints", "key")
+
+    def __init__(self, device_a, interface_a, device_b, interface_b):
+        if device_a == device_b:
+            self.endpoints = ((device_b, interface_b), )
+        else:
+            self.endpoints = ((device_a, interface_a), (device_b, interface_b))
+        self.key = frozenset(self.endpoints)
+
+    def __eq__(self, other):
+        return isinstance(other, Link) and self.key == other.key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def __repr__(self):
+        return "Link({0})".format(", ".join("{0}:{1}".format(*endpoint) for endpoint in self.endpoints))
+
+
+class LinkGraph(object):
+    """
+    The links found between devices, without duplicates, in the order they
+    were first found
+    """
+
+    def __init__(self, links=None):
+        self.links = {}
+        for link in links or ():
+            self.add(link)
+
+    def add(self, link):
+        if link.key not in self.links:
+            self.links[link.key] = link
+
+    def remove(self, link):
+        self.links.pop(link.key, None)
+
+    def __iter__(self):
+        return iter(list(self.links.values()))
+
+    def __len__(self):
+        return len(self.links)
+
+    def __contains__(self, link):
+        return link.key in self.links
+
+
+def create_node(node_input):
+    device = {
+        "boot_disk_size": 0,
+        "configuration": node_input["configuration"],
+        "cpu_limit": 100,
+        "cpus": node_input.get("cpus", 1),
+        "data_volume": 0,
+        "hide_links": False,
+        "id": node_input["id"],
+        "label": node_input["hostname"],
+        "node_definition": node_input["node_definition"],
+        "ram": node_input["ram"],
+        "tags": node_input["tags"],
+        "x": node_input["x_position"],
+        "y": node_input.get("y_position", 0),
+        "interfaces": [
+            {
+                "id": "i0",
+                "label": "Loopback0",
+                "type": "loopback"
             }
+        ]
+    }
+    if node_input.get("image_definition"):
+        device["image_definition"] = node_input.get("image_definition")
+    return device
+
+
+def switch_generate_interface(c, m, s):
+    """
+    Increments module and interface numbering for switches using modules of 4 interfaces, e.g.
+        Gig0/0, Gig0/1, Gig0/2, Gig0/3, Gig1/0...
+    :param c: int, interface number
+    :param m: int, module number
+    :param s: int, CML topo slot number
+    :return: tuple, if-counter, module number, slot number
+    """
+    if c == 3:
+        m += 1
+        c = 0
+    else:
+        c += 1
+    s += 1
+    return c, m, s
+
+
+def add_interfaces_to_topology(topo_node, device_info, physical_interfaces, use_cat9kv=False):
+    """
+    Adds interfaces to the devices in the CML topology
+    """
+    number_of_interfaces = len(physical_interfaces) + 3  # initial + 2 spares
+    number_of_interfaces += 4 - (number_of_interfaces % 4)  # interfaces come in sets of 4
+    if device_info["type"] == "l3switch" and use_cat9kv is True:
+        topo_node["interfaces"].append({
+            "id": "i1",
+            "label": "GigabitEthernet0/0",
+            "slot": 0,
+            "type": "physical"
+        })
+        counter = 1
+        # cat9kv *requires* that 24 ports be configured for the 24-port version
+        for i in range(24):
+            topo_node["interfaces"].append({
+                "id": "i{0}".format(counter + 1),
+                "label": "GigabitEthernet1/0/{0}".format(counter),
+                "slot": counter,
+                "type": "physical"
+            })
+            counter += 1
+    elif device_info["type"] == "switch" or (device_info["type"] == "l3switch" and use_cat9kv is not True):
+        slot = 0
+        mod = 0
+        counter = 0
+        if_id = 1
+        for i in range(number_of_interfaces):
+            topo_node["interfaces"].append({
+                "id": "i{0}".format(if_id),
+                "label": "GigabitEthernet{0}/{1}".format(mod, counter),
+                "slot": slot,
+                "type": "physical"
+            })
+            counter, mod, slot = switch_generate_interface(counter, mod, slot)
+            if_id += 1
+    elif device_info["type"] == "router":
+        slot = 0
+        counter = 1
+        for i in range(number_of_interfaces):
+            topo_node["interfaces"].append({
+                "id": "i{0}".format(counter),
+                "label": "GigabitEthernet{0}".format(counter),
+                "slot": slot,
+                "type": "physical"
+            })
+            slot += 1
+            counter += 1
+
+
+def map_physical_interfaces_to_logical_interfaces(topo_node, physical_interfaces, start_from):
+    """
+    Creates a dict of devices with dicts of interfaces with dicts of physical interface names containing dicts of
+    virtual interfaces and ids. Device dict also contains node-id, e.g.
+    {'Router-01': {'interfaces': {'Gig0': {'if-name': 'GigabitEthernet2', 'id': 'i2'},
+    'Gig0/0/0': {'if-name': 'GigabitEthernet3', 'id': 'i3'},
+    'Gig0/0/1': {'if-name': 'GigabitEthernet4', 'id': 'i4'}},
+    'node_id': 'n0'}
+    :param topo_node:
+    :param physical_interfaces:
+    :return: dict
+    """
+    mapping = {}
+
+    # If start_from > 1, find mgmt interface and make sure we map that as well, otherwise it will be truncated
+    if start_from > 1:
+        for interface in topo_node["interfaces"]:
+            if interface["id"] == "i1":
+                mapping[interface["label"]] = {"if-name": interface["label"], "id": interface["id"]}
+        start_from = start_from - 1
+    for i in range(len(physical_interfaces)):
+        mapping[physical_interfaces[i]] = {"if-name": topo_node["interfaces"][start_from + i + 1]["label"],
+                                           "id": topo_node["interfaces"][start_from + i + 1]["id"]}
+    return mapping
+
+
+def cml_topology_create_initial(devices_with_interface_dict, remote_device_info_full, start_from, device_template,
+                                use_cat9kv=False, devices=None):
+    """
+    Creates CML topology file and adds nodes
+    :param devices_with_interface_dict:
+    :param remote_device_info_full:
+    :return:
+    """
+    mappings = {}
+    topology = {
+        "lab": {
+            "description": "",
+            "notes": "",
+            "title": "generated_lab",
+            "version": "0.1.0"
+        },
+        "links": [],
+        "nodes": []
+    }
+    node_counter = 0
+    x_position = 0
+    devices = set(devices)
+    for device in devices_with_interface_dict:
+        # # Only add devices that were included in devices list
+        if device in devices:
             device_type = remote_device_info_full.get(device, {}).get("type", "router")
             device_info = copy.deepcopy(device_template.get(device_type))
             device_info["hostname"] = device
             device_info["x_position"] = x_position
             device_info["id"] = "n{0}".format(node_counter)
-            device_info["configuration"] = configs[device_type]
+            device_info["configuration"] = bootstrap_config(device_type, device)
             node_counter += 1
             x_position += 150
             topo_node = create_node(device_info)
@@ -460,83 +722,163 @@ def find_capabilities(device, cdp_line):
     """
     Find capabilites advertised from the remote device. Used to find the best CML image
     :param device:
-    :param cdp_line:
+    :param cdp_line: the tokens of a line of show cdp neighbors
     :return: dict of {remote_name, {"platform": hw_platform, "type": ("switch", "router", or "l3switch")}
     """
-    rev = copy.deepcopy(cdp_line)
-    rev.reverse()
     capabilities = []
-    for r in rev[3:]:
+    # The capabilities are the tokens between the hold time and the platform and port id
+    for r in cdp_line[-4::-1]:
         if r.isdigit():
             break
-        else:
-            if r == "R" or r == "S":
-                capabilities.append(r)
+        if r == "R" or r == "S":
+            capabilities.append(r)
+    platform = cdp_line[-3]
+    return {device: {"platform": platform, "type": capabilities_to_type(capabilities)}}
+
+
+def capabilities_to_type(capabilities):
     if "R" in capabilities and "S" in capabilities:
-        device_type = "l3switch"
+        return "l3switch"
     elif "R" in capabilities:
-        device_type = "router"
+        return "router"
     elif "S" in capabilities:
-        device_type = "switch"
-    else:
-        device_type = None
-    platform = cdp_line[-3]
-    return {device: {"platform": platform, "type": device_type}}
+        return "switch"
+    return None
+
+
+def cdp_table_start(lines):
+    """
+    Return the index of the first line of the neighbor table, after the
+    "Device ID ..." heading.  Without the heading, the table is taken to
+    start two lines after the first blank line following the first line.
+    """
+    for index, line in enumerate(lines):
+        if line.split()[:2] == ["Device", "ID"]:
+            return index + 1
+    for index, line in enumerate(lines[1:], 1):
+        if not line.split():
+            return index + 2
+    return len(lines)
 
 
 def parse_cdp_output(cdp_data, dev):
     """
     Find local interface, remote name, remote interface, remote platform, remote capabilities
 
+    cdp_data is either the text of show cdp neighbors or structured neighbors
+    (see parse_cdp_entries)
+
     return tuple
         [0] links, e.g.
-            [{
-            "router1": "Ten1/2,
-            "router2": "Ten1/1",
-            }]
+            [Link("router1", "Ten1/2", "router2", "Ten1/1")]
         [1]ldict of devices, platform, and capabilities to be used
         [{"router10": {"platform": "c6509", "type": "l3switch"}}
     """
+    if isinstance(cdp_data, (dict, list)):
+        return parse_cdp_entries(cdp_data, dev)
+
     device_links_list = []
     device_info = {}
-    cdp_split = cdp_data.split('\r\n')  # split all csv data on carriage returns
-    cdp_split.pop(0)  # RESTCONF results has an extra blank line
-    # Find the first break list index
-    for c, i in enumerate(cdp_split):
-        if len(i.split()) == 0:
-            index = cdp_split.index(i)
+    lines = cdp_data.splitlines()
+    remote = None
+    # Each line is split once.  A neighbor is either on one line, or its name
+    # is on a line of its own followed by a line with the rest.
+    for line in lines[cdp_table_start(lines):]:
+        tokens = line.split()
+        if not tokens or tokens[:3] == ["Total", "cdp", "entries"]:  # end of cdp neighbors
             break
+        if len(tokens) == 1:  # a line with only a name
+            remote = line.split('.', 1)[0] if "." in tokens[0] else tokens[0]
+            continue
+        if tokens[-1] == "eth0":  # not adding hosts
+            continue
+        if tokens[1] in interface_types_list:  # in case hostname is in line with data
+            remote = line.split('.', 1)[0] if "." in tokens[0] else tokens[0]
+            local_interface = tokens[1] + tokens[2]
+        else:  # line with data below the device name line
+            local_interface = tokens[0] + tokens[1]
+        remote_interface = tokens[-2] + tokens[-1]
+        device_links_list.append(Link(dev['hostname'], local_interface, remote, remote_interface))
+        device_info.update(find_capabilities(remote, tokens))
+    return device_links_list, device_info
 
-    index = index + 2  # skip to first device name
 
-    # new_list = [a for a in cdp_split[index:]]  # break single csv line into elements
-    new_list = list(cdp_split[index:])  # break single csv line into elements
+# Keys used for the fields of a CDP neighbor by Genie parsers and by NSO
+CDP_ENTRY_KEYS = {
+    "device_id": ("device_id", "device-id", "neighbor", "neighbor_id"),
+    "local_interface": ("local_interface", "local-interface", "local_intf", "interface"),
+    "port_id": ("port_id", "port-id", "remote_interface", "port"),
+    "platform": ("platform", ),
+    "capabilities": ("capabilities", "capability"),
+}
 
-    for i in new_list:
-        if len(i.split()) == 1 and "." in i.split()[0]:  # a line with only a name
-            remote = i.split('.')[0]
-        elif len(i.split()) == 1:
-            remote = i.split()[0]
-        elif len(i.split()) == 0:  # blank line is end of cdp neighbors
-            break
-        if i.split()[-1] == "eth0":  # not adding hosts
-            pass
-        elif len(i.split()) > 1 and i.split()[1] in interface_types_list:  # in case hostname is in line with data
-            if "." in i.split()[0]:
-                remote = i.split('.')[0]
+# Full interface type names shortened to the names show cdp neighbors uses, longest first
+SHORT_INTERFACE_TYPES = (("TenGigabitEthernet", "Ten"), ("GigabitEthernet", "Gig"), ("FastEthernet", "Fas"))
+
+
+def cdp_entry_field(entry, field):
+    for key in CDP_ENTRY_KEYS[field]:
+        if entry.get(key) is not None:
+            return entry[key]
+    return None
+
+
+def cdp_entries(data):
+    """
+    Return the neighbor entries in structured CDP data, in order, however
+    deeply they are nested in lists or dicts (e.g. Genie's {"index": {1: ...}})
+    """
+    entries = []
+    stack = [data]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, list):
+            stack.extend(reversed(item))
+        elif isinstance(item, dict):
+            device_id = cdp_entry_field(item, "device_id")
+            if device_id is not None and not isinstance(device_id, (dict, list)):
+                entries.append(item)
             else:
-                remote = i.split()[0]
-            line_list = i.split()
-            local_interface = line_list[1] + line_list[2]
-            remote_interface = line_list[-2] + line_list[-1]
-            device_links_list.append({dev['hostname']: local_interface, remote: remote_interface})
-            device_info.update(find_capabilities(remote, line_list))
-        elif len(i.split()) > 1:  # line with data below the device name line
-            line_list = i.split()
-            local_interface = line_list[0] + line_list[1]
-            remote_interface = line_list[-2] + line_list[-1]
-            device_links_list.append({dev['hostname']: local_interface, remote: remote_interface})
-            device_info.update(find_capabilities(remote, line_list))
+                stack.extend(reversed([value for value in item.values() if isinstance(value, (dict, list))]))
+    return entries
+
+
+def short_interface_name(name):
+    """
+    Shorten e.g. GigabitEthernet0/1 to Gig0/1 as in show cdp neighbors
+    """
+    name = "".join(str(name).split())
+    for full_type, short_type in SHORT_INTERFACE_TYPES:
+        if name.startswith(full_type):
+            return short_type + name[len(full_type):]
+    return name
+
+
+def parse_cdp_entries(cdp_data, dev):
+    """
+    Find the links and remote device info, as parse_cdp_output does, from
+    structured neighbors, e.g. the Genie parsed output of show cdp neighbors
+    [detail] or a list of neighbors from NSO.  Each neighbor has a device id,
+    local interface, port id and optionally platform and capabilities, with
+    the keys in CDP_ENTRY_KEYS.
+    """
+    device_links_list = []
+    device_info = {}
+    for entry in cdp_entries(cdp_data):
+        local_interface = cdp_entry_field(entry, "local_interface")
+        remote_interface = cdp_entry_field(entry, "port_id")
+        if local_interface is None or remote_interface is None or remote_interface == "eth0":  # not adding hosts
+            continue
+        remote = str(cdp_entry_field(entry, "device_id")).split('.', 1)[0]
+        capabilities = cdp_entry_field(entry, "capabilities") or ""
+        if isinstance(capabilities, str):
+            capabilities = capabilities.replace(",", " ").split()
+        capabilities = ["R" if c in ("R", "Router") else "S" if c in ("S", "Switch") else c for c in capabilities]
+        platform = (cdp_entry_field(entry, "platform") or "").split()
+        device_links_list.append(Link(dev['hostname'], short_interface_name(local_interface), remote,
+                                      short_interface_name(remote_interface)))
+        device_info[remote] = {"platform": platform[-1] if platform else None,
+                               "type": capabilities_to_type(capabilities)}
     return device_links_list, device_info
 
 
@@ -547,22 +889,24 @@ def check_for_and_remove_error_links(dls):
     Router1   Ten 3/4           164              S I   C9300-24P Ten 1/1/3
 
     remove a Ten3/4 since it can't link to two other physical links
-    :param dls: which is the device_links
+    :param dls: which is the device_links, a LinkGraph
     return: dict {"router1": ["Gig1", "Gig2"], "router2": ["Gig1", "Gig2"]]
     """
     devices_with_links = {}  # track each devices' interfaces
+    seen_interfaces = {}  # the same, as sets for quick lookups
     redundant_links_to_remove = []  # redundant links to be removed from device_links
     for link_full in dls:
-        for device_name in link_full:
+        for device_name, interface in link_full.endpoints:
             if device_name not in devices_with_links:
                 devices_with_links[device_name] = []
-            if link_full[device_name] not in devices_with_links[device_name]:
-                devices_with_links[device_name].append(link_full[device_name])
+                seen_interfaces[device_name] = set()
+            if interface not in seen_interfaces[device_name]:
+                devices_with_links[device_name].append(interface)
+                seen_interfaces[device_name].add(interface)
             else:
                 redundant_links_to_remove.append(link_full)
     for link_to_del in redundant_links_to_remove:
-        if link_to_del in dls:
-            dls.remove(link_to_del)
+        dls.remove(link_to_del)
     return devices_with_links
 
 
@@ -575,16 +919,17 @@ def cml_topology_add_links(topo, maps, d_links, devices):
     """
     Add links to CML topology
     """
+    devices = set(devices)
     counter = 0
     for d_link in d_links:
         if len(d_link) != 2:
             # print(
             #     f"Warning - Link {d_link} contains {len(d_link)} endpoints. Links must have 2 endpoints. This will not be added to the CML topology")
             continue
-        elif all(host in devices for host in list(d_link.keys())):
+        elif all(host in devices for host, interface in d_link.endpoints):
             link_temp = {"id": "l{0}".format(counter)}
             d_count = 0
-            for k, v in d_link.items():
+            for k, v in d_link.endpoints:
                 if d_count == 0:
                     link_temp.update({
                         "n1": maps[k]["node_id"],
@@ -646,24 +991,29 @@ def node_id_start(virtual_topology):
     return nodes[-1] + 1
 
 
+def ext_conn_node(device_template, node_id, label, configuration, x, y, hide_links=True):
+    device_info = copy.deepcopy(device_template.get("ext_conn"))
+    device_info["label"] = label
+    device_info["cpus"] = 0
+    device_info["x"] = x
+    device_info["y"] = y
+    device_info["id"] = node_id
+    device_info["configuration"] = configuration
+    device_info["hide_links"] = hide_links
+    device_info["interfaces"] = [{
+        "id": "i0",
+        "label": "port",
+        "slot": 0,
+        "type": "physical"
+    }]
+    return device_info
+
+
 def ext_conn_nodes_create(virtual_topology, draft_topo, node_start, device_template):
     y = -1000
     for n in draft_topo["nodes"]:
-        device_info = copy.deepcopy(device_template.get("ext_conn"))
-        device_info["label"] = "ext-conn-{0}".format(n['label'])
-        device_info["cpus"] = 0
-        device_info["x"] = 5500
-        device_info["y"] = y
-        device_info["id"] = "n{0}".format(node_start)
-        device_info["configuration"] = "bridge0"
-        device_info["hide_links"] = True
-        device_info["interfaces"] = [{
-            "id": "i0",
-            "label": "port",
-            "slot": 0,
-            "type": "physical"
-        }]
-        virtual_topology["nodes"].append(device_info)
+        virtual_topology["nodes"].append(ext_conn_node(device_template, "n{0}".format(node_start),
+                                                       "ext-conn-{0}".format(n['label']), "bridge0", 5500, y))
         y += 50
         node_start += 1
 
@@ -690,16 +1040,331 @@ def cml_topology_add_external_connectors_and_links(topo, device_template):
     link_start = link_id_start(topo)
     node_start = node_id_start(topo)
     link_node_start = node_start
-    new_topo = copy.deepcopy(topo)
+    # Only the nodes already in the topology get connectors, so a snapshot of the node list is enough
+    new_topo = {"nodes": list(topo["nodes"])}
 
     ext_conn_nodes_create(topo, new_topo, node_start, device_template)
     ext_conn_links_create(topo, new_topo, link_node_start, link_start)
 
 
+def stable_ids(items, keys, old_ids, prefix):
+    """
+    Choose an id for each of items, whose keys are in the same order: the id of the old item with the same key in
+    old_ids (key to id), or else the item's own id if no old item has it, or else the next unused number after
+    prefix.  Old ids are never reused for new items.
+    :return: dict of each item's id to its new id, and the list of items that are new
+    """
+    taken = set(old_ids.values())
+    numbers = [int(i[len(prefix):]) for i in taken if i.startswith(prefix) and i[len(prefix):].isdigit()]
+    next_number = max(numbers) + 1 if numbers else 0
+    new_ids = {}
+    added = []
+    for item, key in zip(items, keys):
+        if key in old_ids:
+            new_ids[item["id"]] = old_ids[key]
+        else:
+            added.append(item)
+    for item in added:
+        new_id = item["id"]
+        while new_id in taken:
+            new_id = "{0}{1}".format(prefix, next_number)
+            next_number += 1
+        taken.add(new_id)
+        new_ids[item["id"]] = new_id
+    return new_ids, added
+
+
+def topology_link_keys(topology):
+    """
+    The key of each link of a topology, made from the labels of the nodes and interfaces at each end so that it
+    does not depend on ids
+    """
+    node_labels = {}
+    interface_labels = {}
+    for node in topology.get("nodes") or []:
+        node_labels[node["id"]] = node.get("label")
+        for interface in node.get("interfaces") or []:
+            interface_labels[(node["id"], interface["id"])] = interface.get("label")
+    return [frozenset([(node_labels.get(link.get("n1")), interface_labels.get((link.get("n1"), link.get("i1")))),
+                       (node_labels.get(link.get("n2")), interface_labels.get((link.get("n2"), link.get("i2"))))])
+            for link in topology["links"]]
+
+
+def without_position(node):
+    return dict((k, v) for k, v in node.items() if k not in ("x", "y"))
+
+
+def merge_existing_topology(topology, existing, keep_positions=True, mappings=None):
+    """
+    Give the nodes, interfaces and links of topology the ids they have in existing, an earlier topology, and put
+    what is in both first and in the same order, so that only what has changed differs between them. The node and
+    interface ids in mappings, when given, are changed to match.
+    :return: dict of the nodes and links added and removed, and the nodes changed
+    """
+    existing = existing or {}
+    existing.setdefault("links", [])
+    old_nodes = dict((node["label"], node) for node in existing.get("nodes") or [])
+    old_link_ids = dict(zip(topology_link_keys(existing), (link["id"] for link in existing["links"])))
+    link_keys = topology_link_keys(topology)
+
+    node_ids, added_nodes = stable_ids(topology["nodes"], [node["label"] for node in topology["nodes"]],
+                                       dict((label, node["id"]) for label, node in old_nodes.items()), "n")
+    link_ids, added_links = stable_ids(topology["links"], link_keys, old_link_ids, "l")
+    interface_ids = {}
+    for node in topology["nodes"]:
+        old_interfaces = old_nodes.get(node["label"], {}).get("interfaces") or []
+        interface_ids[node["id"]], added_interfaces = stable_ids(
+            node["interfaces"], [interface["label"] for interface in node["interfaces"]],
+            dict((interface["label"], interface["id"]) for interface in old_interfaces), "i")
+        for interface in node["interfaces"]:
+            interface["id"] = interface_ids[node["id"]][interface["id"]]
+    for link in topology["links"]:
+        for n, i in (("n1", "i1"), ("n2", "i2")):
+            link[i] = interface_ids[link[n]][link[i]]
+            link[n] = node_ids[link[n]]
+        link["id"] = link_ids[link["id"]]
+    for node in topology["nodes"]:
+        node["id"] = node_ids[node["id"]]
+    for device in (mappings or {}).values():
+        if device["node_id"] in node_ids:
+            for interface in device["interfaces"].values():
+                interface["id"] = interface_ids[device["node_id"]].get(interface["id"], interface["id"])
+            device["node_id"] = node_ids[device["node_id"]]
+
+    if keep_positions:
+        # A new node placed on top of an old one goes to the end of its row; the others keep their place
+        taken = set()
+        for node in topology["nodes"]:
+            if node["label"] in old_nodes:
+                node["x"] = old_nodes[node["label"]].get("x", node["x"])
+                node["y"] = old_nodes[node["label"]].get("y", node["y"])
+                taken.add((node["x"], node["y"]))
+        row_ends = {}
+        for node in topology["nodes"]:
+            row_ends[node["y"]] = max(row_ends.get(node["y"], node["x"]), node["x"])
+        for node in added_nodes:
+            if (node["x"], node["y"]) in taken:
+                node["x"] = row_ends[node["y"]] + 150
+                taken.add((node["x"], node["y"]))
+                row_ends[node["y"]] = node["x"]
+
+    node_order = dict((node["label"], position) for position, node in enumerate(existing.get("nodes") or []))
+    topology["nodes"].sort(key=lambda node: node_order.get(node["label"], len(node_order)))
+    link_order = dict((link["id"], position) for position, link in enumerate(existing["links"]))
+    topology["links"].sort(key=lambda link: link_order.get(link["id"], len(link_order)))
+    if existing.get("lab"):
+        topology["lab"] = existing["lab"]
+
+    labels = set(node["label"] for node in topology["nodes"])
+    keys = set(link_keys)
+    return {
+        "nodes": {
+            "added": added_nodes,
+            "removed": [node for label, node in old_nodes.items() if label not in labels],
+            "changed": [node for node in topology["nodes"] if node["label"] in old_nodes
+                        and without_position(node) != without_position(old_nodes[node["label"]])]
+        },
+        "links": {
+            "added": added_links,
+            "removed": [link for link, key in zip(existing["links"], topology_link_keys(existing)) if key not in keys]
+        }
+    }
+
+
+def add_cost(a, b):
+    return tuple(x + y for x, y in zip(a, b))
+
+
+def fits(used, cost, limits):
+    return all(not limit or u + c <= limit for u, c, limit in zip(used, cost, limits))
+
+
+def device_graph(topology, mappings):
+    """
+    The devices of the topology, each with the number of links to each of its neighbouring devices, and what the
+    node of each device costs a lab in nodes, RAM and CPUs
+    """
+    devices = dict((mappings[device]["node_id"], device) for device in mappings)
+    neighbours = dict((device, {}) for device in mappings)
+    for link in topology["links"]:
+        a, b = devices.get(link["n1"]), devices.get(link["n2"])
+        if a and b and a != b:
+            neighbours[a][b] = neighbours[a].get(b, 0) + 1
+            neighbours[b][a] = neighbours[b].get(a, 0) + 1
+    costs = dict((devices[node["id"]], (1, node.get("ram") or 0, node.get("cpus") or 0))
+                 for node in topology["nodes"] if node["id"] in devices)
+    return neighbours, costs
+
+
+def grow_regions(group, neighbours, costs, limits):
+    """
+    Split a group of devices into connected regions that each fit the limits. Each region starts from the device
+    with the most links among those left and grows by the neighbour with the most links into it that still fits.
+    """
+    remaining = set(group)
+    regions = []
+    while remaining:
+        seed = min(remaining, key=lambda d: (-sum(c for n, c in neighbours[d].items() if n in remaining), d))
+        region = []
+        used = (0, 0, 0)
+        links_in = {seed: 0}
+        heap = [(0, seed)]
+        too_big = set()
+        while heap:
+            count, device = heapq.heappop(heap)
+            if device not in remaining or device in too_big or -count != links_in[device]:
+                continue
+            if region and not fits(used, costs[device], limits):
+                # Too big for what is left of this region, though a smaller neighbour may still fit
+                too_big.add(device)
+                continue
+            remaining.discard(device)
+            region.append(device)
+            used = add_cost(used, costs[device])
+            for neighbour, links in neighbours[device].items():
+                if neighbour in remaining and neighbour not in too_big:
+                    links_in[neighbour] = links_in.get(neighbour, 0) + links
+                    heapq.heappush(heap, (-links_in[neighbour], neighbour))
+        regions.append(region)
+    return regions
+
+
+def partition_devices(neighbours, costs, sites, limits):
+    """
+    Split the devices into partitions that each fit the limits, keeping each site together when it fits and
+    otherwise putting together the devices with the most links between them.
+    :return: list of lists of devices
+    """
+    by_site = {}
+    for device in sorted(neighbours):
+        by_site.setdefault(sites.get(device), []).append(device)
+    units = []
+    for site, group in sorted(by_site.items(), key=lambda item: (item[0] is None, item[0] or "")):
+        cost = (0, 0, 0)
+        for device in group:
+            cost = add_cost(cost, costs[device])
+        if site is not None and fits((0, 0, 0), cost, limits):
+            units.append((cost, group))
+        else:
+            for region in grow_regions(group, neighbours, costs, limits):
+                region_cost = (0, 0, 0)
+                for device in region:
+                    region_cost = add_cost(region_cost, costs[device])
+                units.append((region_cost, region))
+
+    partitions = []
+    owner = {}
+    for cost, unit in sorted(units, key=lambda unit: (-unit[0][0], -unit[0][1], -unit[0][2], unit[1][0])):
+        links = {}
+        for device in unit:
+            for neighbour, count in neighbours[device].items():
+                if neighbour in owner:
+                    links[owner[neighbour]] = links.get(owner[neighbour], 0) + count
+        best = None
+        for index, (used, members) in enumerate(partitions):
+            if fits(used, cost, limits) and (best is None or links.get(index, 0) > links.get(best, 0)):
+                best = index
+        if best is None:
+            best = len(partitions)
+            partitions.append(((0, 0, 0), []))
+        used, members = partitions[best]
+        members.extend(unit)
+        partitions[best] = (add_cost(used, cost), members)
+        for device in unit:
+            owner[device] = best
+    return [members for used, members in partitions]
+
+
+def partition_topologies(topology, mappings, partitions, device_template, cut_link_configuration):
+    """
+    Make a topology for each partition of the devices from the whole topology, keeping the ids of its nodes and
+    links. Nodes that are not devices, e.g. external connectors, go with the device they are linked to. Each link
+    between partitions is replaced by an external connector at both ends.
+    :return: list of topologies, and list of the links cut
+    """
+    title = topology.get("lab", {}).get("title", "generated_lab")
+    names = ["{0}-{1}".format(title, index + 1) for index in range(len(partitions))]
+    part = {}
+    for index, devices in enumerate(partitions):
+        for device in devices:
+            part[mappings[device]["node_id"]] = index
+    device_nodes = set(part)
+    for link in topology["links"]:
+        for this, other in (("n1", "n2"), ("n2", "n1")):
+            if link[other] in device_nodes and link[this] not in device_nodes and link[this] not in part:
+                part[link[this]] = part[link[other]]
+    nodes = dict((node["id"], node) for node in topology["nodes"])
+
+    topologies = []
+    for name in names:
+        lab = dict(topology.get("lab", {}), title=name)
+        topologies.append({"lab": lab, "links": [], "nodes": []})
+    for node in topology["nodes"]:
+        if node["id"] in part:
+            topologies[part[node["id"]]]["nodes"].append(node)
+
+    cut_links = []
+    stubs = {}
+    node_start = node_id_start(topology)
+    link_start = link_id_start(topology) if topology["links"] else 0
+    for link in topology["links"]:
+        if link["n1"] not in part or link["n2"] not in part:
+            continue
+        if part[link["n1"]] == part[link["n2"]]:
+            topologies[part[link["n1"]]]["links"].append(link)
+            continue
+        cut_links.append({
+            "id": link["id"],
+            "label": link["label"],
+            "configuration": cut_link_configuration.format(len(cut_links) + 1),
+            "ends": []
+        })
+        label = "ext-conn-cut-{0}".format(len(cut_links))
+        for n, i in (("n1", "i1"), ("n2", "i2")):
+            node = nodes[link[n]]
+            interface = next((intf["label"] for intf in node["interfaces"] if intf["id"] == link[i]), link[i])
+            cut_links[-1]["ends"].append({"device": node["label"], "interface": interface,
+                                          "partition": names[part[link[n]]]})
+            stub_id = "n{0}".format(node_start)
+            node_start += 1
+            stubs[node["id"]] = stubs.get(node["id"], 0) + 1
+            stub = ext_conn_node(device_template, stub_id, label, cut_links[-1]["configuration"],
+                                 node.get("x", 0), node.get("y", 0) + 50 + 50 * stubs[node["id"]], False)
+            topologies[part[link[n]]]["nodes"].append(stub)
+            topologies[part[link[n]]]["links"].append({
+                "id": "l{0}".format(link_start),
+                "n1": link[n],
+                "i1": link[i],
+                "n2": stub_id,
+                "i2": "i0",
+                "label": "{0}<->{1}".format(node["label"], label)
+            })
+            link_start += 1
+    return topologies, cut_links
+
+
+def partition_file(path, index):
+    root, ext = os.path.splitext(path)
+    return "{0}-{1}{2}".format(root, index + 1, ext)
+
+
 def get_device_names(devices):
     return [d['hostname'] for d in devices]
 
 
+def write_yaml_file(module, path, data, depth):
+    """
+    Write data to path as YAML through a temporary file, leaving path alone
+    when it already holds the same.  Returns whether path changed.
+    """
+    temp_file = write_yaml_temp(path, data, depth)
+    if os.path.exists(path) and filecmp.cmp(temp_file, path, shallow=False):
+        os.unlink(temp_file)
+        return False
+    module.atomic_move(temp_file, os.path.abspath(path))
+    return True
+
+
 def main():
     arguments = dict(
         devices=dict(required=True, type='list', elements='dict'),
@@ -707,12 +1372,33 @@ def main():
         default_mappings=dict(required=True, type='dict'),
         ext_conn=dict(required=False, type='bool', default=True),
         start_from=dict(required=False, type='int', default=2),
-        use_cat9kv=dict(required=False, type='bool', default=False)
+        use_cat9kv=dict(required=False, type='bool', default=False),
+        layout=dict(required=False, type='str', default='none',
+                    choices=['none', 'auto', 'grouped', 'spring', 'planar', 'spectral', 'kamada_kawai']),
+        scale=dict(required=False, type='int', default=500),
+        layout_cache_dir=dict(required=False, type='path'),
+        topology_file=dict(required=False, type='path'),
+        mappings_file=dict(required=False, type='path'),
+        existing_topology=dict(required=False, type='path'),
+        partition=dict(required=False, type='dict', options=dict(
+            max_nodes=dict(required=False, type='int', default=0),
+            max_ram=dict(required=False, type='int', default=0),
+            max_cpus=dict(required=False, type='int', default=0),
+            site_tags=dict(required=False, type='list', elements='str', default=[]),
+            cut_link_configuration=dict(required=False, type='str', default='bridge{0}')
+        ))
     )
 
     module = AnsibleModule(argument_spec=arguments, supports_check_mode=False)
 
-    device_links = []
+    library, import_error = missing_layout_library(module.params['layout'])
+    if library:
+        module.fail_json(msg=missing_required_lib(library), exception=import_error)
+    if (module.params['topology_file'] or module.params['mappings_file'] or module.params['existing_topology']) \
+            and not HAS_YAML:
+        module.fail_json(msg=missing_required_lib('yaml'), exception=YAML_IMPORT_ERROR)
+
+    device_links = LinkGraph()
     remote_device_info_full = {}
 
     devices = module.params['devices']
@@ -727,8 +1413,7 @@ def main():
         temp_device_links, remote_device_info = parse_cdp_output(device['cdp'], device)
         remote_device_info_full.update(remote_device_info)
         for link in temp_device_links:  # add any newly found links to device links
-            if link not in device_links:
-                device_links.append(link)  # now saved newly discovered links
+            device_links.add(link)
     devices_with_interface_dict = check_for_and_remove_error_links(device_links)
     sort_device_interfaces(devices_with_interface_dict)
     topology_cml, mappings_cml = cml_topology_create_initial(devices_with_interface_dict, remote_device_info_full,
@@ -736,9 +1421,80 @@ def main():
     cml_topology_add_links(topology_cml, mappings_cml, device_links, device_names)
     if module.params['ext_conn']:
         cml_topology_add_external_connectors_and_links(topology_cml, device_template)
+    delta = None
+    existing_topology = None
+    if module.params['existing_topology']:
+        try:
+            existing_topology = load_yaml_file(module.params['existing_topology'])
+        except Exception as e:
+            module.fail_json(msg="Could not read {0}: {1}".format(module.params['existing_topology'], e))
+        delta = merge_existing_topology(topology_cml, existing_topology, mappings=mappings_cml)
+    if module.params['layout'] != 'none':
+        cache = LayoutCache(module.params['layout_cache_dir']) if module.params['layout_cache_dir'] else None
+        layout_topology(topology_cml, module.params['layout'], module.params['scale'],
+                        positions=previous_positions(topology_cml, existing_topology), cache=cache)
+        if cache is not None and cache.error:
+            module.warn(cache.error)
     mappings = create_interface_mapping_dict(mappings_cml, default_mappings)
 
-    module.exit_json(changed=True, topology=topology_cml, mappings=mappings)
+    partition = module.params['partition']
+    topologies = []
+    if partition:
+        neighbours, costs = device_graph(topology_cml, mappings_cml)
+        site_tags = partition['site_tags']
+        sites = dict((device['hostname'], next((tag for tag in site_tags if tag in (device.get('tags') or [])), None))
+                     for device in devices)
+        limits = (partition['max_nodes'], partition['max_ram'], partition['max_cpus'])
+        partitions = partition_devices(neighbours, costs, sites, limits)
+        topologies, cut_links = partition_topologies(topology_cml, mappings_cml, partitions, device_template,
+                                                     partition['cut_link_configuration'])
+
+    result = {
+        "summary": {
+            "devices": len(mappings),
+            "nodes": len(topology_cml["nodes"]),
+            "links": len(topology_cml["links"])
+        }
+    }
+    if partition:
+        result["summary"].update(partitions=len(partitions), cut_links=len(cut_links))
+        result["cut_links"] = cut_links
+        result["partitions"] = []
+        for index, devices_in_partition in enumerate(partitions):
+            cost = (0, 0, 0)
+            title = topologies[index]["lab"]["title"]
+            for device in devices_in_partition:
+                cost = add_cost(cost, costs[device])
+                mappings[device]["cml_lab_partition"] = title
+            cut = sum(1 for link in cut_links if any(end["partition"] == title for end in link["ends"]))
+            result["partitions"].append({"name": title,
+                                         "devices": sorted(devices_in_partition), "nodes": cost[0], "ram": cost[1],
+                                         "cpus": cost[2], "cut_links": cut})
+    if delta is not None:
+        result["delta"] = delta
+    if not module.params['topology_file'] and not module.params['mappings_file']:
+        for index, topology in enumerate(topologies):
+            result["partitions"][index]["topology"] = topology
+        changed = True if delta is None else any(any(d.values()) for d in delta.values())
+        module.exit_json(changed=changed, topology=topology_cml, mappings=mappings, **result)
+
+    changed = False
+    # Each node and link, and each host's mappings, is written as it is turned into YAML
+    if module.params['topology_file']:
+        changed |= write_yaml_file(module, module.params['topology_file'], topology_cml, 2)
+        for index, topology in enumerate(topologies):
+            path = partition_file(module.params['topology_file'], index)
+            changed |= write_yaml_file(module, path, topology, 2)
+            result["partitions"][index]["file"] = path
+    else:
+        result["topology"] = topology_cml
+        for index, topology in enumerate(topologies):
+            result["partitions"][index]["topology"] = topology
+    if module.params['mappings_file']:
+        changed |= write_yaml_file(module, module.params['mappings_file'], {"all": {"hosts": mappings}}, 3)
+    else:
+        result["mappings"] = mappings
+    module.exit_json(changed=changed, **result)
 
 
 if __name__ == '__main__':
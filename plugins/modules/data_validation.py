@@ -37,6 +37,7 @@ requirements:
   - jsonschema
   - ipaddress
   - yaml
+  - referencing (for I(schema_root) and I(schema_file))
 version_added: '0.1.0'
 options:
     data:
@@ -48,9 +49,86 @@ options:
         required: false
         type: dict
     schema_file:
-        description: The file containint the schema used to check the data
+        description:
+          - The file containint the schema used to check the data
+          - Relative C($ref)s are resolved against the directory of the file, or I(schema_root) when given.
         required: false
         type: str
+    schema_root:
+        description:
+          - A directory of schemas that C($ref)s in the schemas can refer to, by path relative to I(schema_root)
+            or by C(file://) URI.
+          - Only the files that the schemas refer to, directly or through other files, are read. As each host
+            runs the module on its own, they are read again for every host; the M(ciscops.mdd.validate_hosts)
+            action reads I(schema_root) once for all hosts and also resolves C($ref)s by C($id).
+          - When not set and I(schema_file) is used, the files that I(schema_file) refers to are read, by path
+            relative to I(schema_file) or by C(file://) URI.
+        required: false
+        type: path
+    schemas:
+        description:
+          - A list of schemas to check against the data in a single invocation.
+          - Each entry is validated against the subtree of I(data) named by its C(key).
+        required: false
+        type: list
+        elements: dict
+        suboptions:
+            name:
+                description: The name of the schema used in the results
+                required: true
+                type: str
+            key:
+                description: The key of the subtree of I(data) to validate
+                required: false
+                type: str
+                default: 'mdd:openconfig'
+            schema:
+                description: The schema used to check the data
+                required: true
+                type: dict
+    max_errors:
+        description:
+          - The maximum number of errors to report for each schema.
+          - Validation of a schema stops once this many errors are found. C(0) means no limit.
+        required: false
+        type: int
+        default: 0
+    fail_fast:
+        description:
+          - Stop at the first error found.
+          - When I(schemas) is used, the remaining schemas are skipped once a schema fails.
+        required: false
+        type: bool
+        default: false
+    compile:
+        description:
+          - Turn each schema into specialized Python code before validating.
+          - Parts of a schema using keywords the compiler does not handle are checked by jsonschema.
+          - Schemas using C($ref) are always checked by jsonschema.
+        required: false
+        type: bool
+        default: false
+    compile_cache_dir:
+        description:
+          - The directory where code generated by I(compile) is kept, by schema digest, for reuse by later runs.
+          - As the code is run as is, cached files are only used while the directory and the files belong to the
+            user running the module and no other user can write to them.
+          - When not set, generated code is only kept for this invocation.
+        required: false
+        type: path
+    result_cache_dir:
+        description:
+          - The directory where validation results are kept, by digest of the data and schema.
+          - Data and schemas that have not changed since an earlier run reuse that run's result without validating.
+          - When not set, results are not cached.
+        required: false
+        type: path
+    result_cache_size:
+        description:
+          - The maximum number of results kept in I(result_cache_dir). The least recently used are removed first.
+        required: false
+        type: int
+        default: 10000
 """
 
 EXAMPLES = r"""
@@ -67,41 +145,101 @@ EXAMPLES = r"""
         data: "{{ parsed_output }}"
         schema: "{{ lookup('file', schema_file) | from_yaml }}"
       register: validation_output
+
+    - name: Validate all schemas against the data in one pass
+      ciscops.mdd.data_validation:
+        data: "{{ mdd_data }}"
+        schemas:
+          - name: interfaces
+            key: "mdd:openconfig"
+            schema: "{{ lookup('file', 'interfaces.schema.yml') | from_yaml }}"
+          - name: system
+            schema: "{{ lookup('file', 'system.schema.yml') | from_yaml }}"
+      register: validation_output
+"""
+
+RETURN = r"""
+failed_schema:
+    description: The title of the schema that failed when a single schema is checked
+    returned: failed
+    type: str
+summary:
+    description:
+      - The number of errors found and the first of them, for each schema that failed.
+      - C(msg) lists every error found.
+    returned: failed
+    type: str
+    sample: "3 error(s), first: $.openconfig-interfaces:interfaces: 'openconfig-interfaces:interface' is required"
+x_error_list:
+    description: The list of errors found when a single schema is checked
+    returned: failed
+    type: list
+    elements: str
+errors:
+    description: The structured list of errors found when a single schema is checked
+    returned: failed
+    type: list
+    elements: dict
+    sample:
+      - json_path: "$.openconfig-interfaces:interfaces"
+        validator: required
+        message: "'openconfig-interfaces:interface' is a required property"
+truncated:
+    description: Whether errors were left unreported because of I(max_errors) or I(fail_fast)
+    returned: failed
+    type: bool
+cached:
+    description: Whether the result came from I(result_cache_dir) when a single schema is checked
+    returned: when I(schema) or I(schema_file) is used
+    type: bool
+results:
+    description: The per-schema results when I(schemas) is used
+    returned: when I(schemas) is used
+    type: list
+    elements: dict
+    sample:
+      - name: interfaces
+        failed: true
+        skipped: false
+        failed_schema: interfaces
+        truncated: false
+        cached: false
+        errors:
+          - json_path: "$.openconfig-interfaces:interfaces"
+            validator: required
+            message: "'openconfig-interfaces:interface' is a required property"
+failed_schemas:
+    description: The titles of the schemas that failed when I(schemas) is used
+    returned: when I(schemas) is used
+    type: list
+    elements: str
 """
 
-import json
-import traceback
 import os
 from ansible.module_utils.basic import AnsibleModule, missing_required_lib
 
-JSONSCHEMA_IMPORT_ERROR = 0
-YAML_IMPORT_ERROR = 0
+from ansible_collections.ciscops.mdd.plugins.module_utils.datavalidation import (
+    HAS_JSONSCHEMA, HAS_REFERENCING, HAS_YAML, JSONSCHEMA_IMPORT_ERROR, REFERENCING_IMPORT_ERROR, YAML_IMPORT_ERROR,
+    MDD202012Validator, ResultCache, collect_cached_errors, get_referenced_schema_store, get_schema_title,
+    read_schema_file, validate_schema_list, with_file_id
+)
+
+
+def validate_schema(data, schema, max_errors=0, compiled=False, cache_dir=None, result_cache=None, store=None):
+    return collect_cached_errors(data, schema, MDD202012Validator, max_errors, compiled, cache_dir, result_cache,
+                                 store=store)
 
-try:
-    from jsonschema import Draft202012Validator
-except ImportError:
-    HAS_JSONSCHEMA = False
-    JSONSCHEMA_IMPORT_ERROR = traceback.format_exc()
-else:
-    HAS_JSONSCHEMA = True
 
-try:
-    import yaml
-except ImportError:
-    HAS_YAML = False
-    YAML_IMPORT_ERROR = traceback.format_exc()
-else:
-    HAS_YAML = True
+def format_error(error):
+    return "{0}: {1}".format(error['json_path'], error['message'])
 
 
-def validate_schema(data, schema):
-    mdd_validator = Draft202012Validator(schema=schema)
-    errors = mdd_validator.iter_errors(data)
-    error_list = []
-    for error in errors:
-        error_list.append("{0}: {1}".format(error.json_path, error.message))
+def join_errors(errors):
+    return ','.join(format_error(error) for error in errors)
 
-    return error_list
+
+def summarize_errors(errors, truncated):
+    return "{0}{1} error(s), first: {2}".format(len(errors), '+' if truncated else '', format_error(errors[0]))
 
 
 def main():
@@ -109,9 +247,22 @@ def main():
     arguments = dict(
         data=dict(required=True, type='dict'),
         schema=dict(required=False, type='dict'),
-        schema_file=dict(required=False, type='str')
+        schema_file=dict(required=False, type='str'),
+        schema_root=dict(required=False, type='path'),
+        schemas=dict(required=False, type='list', elements='dict', options=dict(
+            name=dict(required=True, type='str'),
+            key=dict(required=False, type='str', default='mdd:openconfig', no_log=False),
+            schema=dict(required=True, type='dict')
+        )),
+        max_errors=dict(required=False, type='int', default=0),
+        fail_fast=dict(required=False, type='bool', default=False),
+        compile=dict(required=False, type='bool', default=False),
+        compile_cache_dir=dict(required=False, type='path'),
+        result_cache_dir=dict(required=False, type='path'),
+        result_cache_size=dict(required=False, type='int', default=10000)
     )
-    module = AnsibleModule(argument_spec=arguments, supports_check_mode=False)
+    module = AnsibleModule(argument_spec=arguments, mutually_exclusive=[('schema', 'schema_file', 'schemas')],
+                           supports_check_mode=False)
 
     if not HAS_JSONSCHEMA:
         # Needs: from ansible.module_utils.basic import missing_required_lib
@@ -122,37 +273,68 @@ def main():
         module.fail_json(msg=missing_required_lib('yaml'), exception=YAML_IMPORT_ERROR)
 
     data = module.params['data']
+    max_errors = module.params['max_errors']
+    fail_fast = module.params['fail_fast']
+    compiled = module.params['compile']
+    cache_dir = module.params['compile_cache_dir']
+    result_cache = None
+    if module.params['result_cache_dir']:
+        result_cache = ResultCache(module.params['result_cache_dir'], module.params['result_cache_size'])
+    if fail_fast:
+        max_errors = 1
+
+    schema_root = module.params['schema_root']
+    store = None
+    if (schema_root or module.params['schema_file']) and not HAS_REFERENCING:
+        module.fail_json(msg=missing_required_lib('referencing'), exception=REFERENCING_IMPORT_ERROR)
+
+    if module.params['schemas'] is not None:
+        if schema_root:
+            store = get_referenced_schema_store([item['schema'] for item in module.params['schemas']], schema_root,
+                                                schema_root)
+        results = validate_schema_list(data, module.params['schemas'], max_errors, fail_fast, MDD202012Validator,
+                                       compiled, cache_dir, result_cache, store)
+        failed_schemas = [result['failed_schema'] for result in results if result['failed']]
+        if failed_schemas:
+            failed = [result for result in results if result['failed']]
+            msg = ', '.join("{0} ({1})".format(result['failed_schema'], join_errors(result['errors']))
+                            for result in failed)
+            summary = ', '.join("{0} ({1})".format(result['failed_schema'],
+                                                   summarize_errors(result['errors'], result['truncated']))
+                                for result in failed)
+            module.fail_json(msg="Schema Failed: {0}".format(msg), summary=summary, failed_schemas=failed_schemas,
+                             results=results)
+        else:
+            module.exit_json(changed=False, failed=False, failed_schemas=failed_schemas, results=results)
+
     schema = {}
     if module.params['schema_file']:
         schema_file = module.params['schema_file']
         # Read in the datafile
         if not os.path.exists(schema_file):
             raise Exception("Cannot find file {0}".format(schema_file))
-        with open(schema_file) as f:
-            if schema_file.endswith('.yaml') or schema_file.endswith('.yml'):
-                schema = yaml.safe_load(f)
-            else:
-                schema = json.load(f)
-        base_dir = os.path.dirname(schema_file)
-        os.chdir(base_dir)
+        schema = with_file_id(read_schema_file(schema_file), schema_file)
+        store = get_referenced_schema_store(schema, schema_file, schema_root)
     elif module.params['schema']:
         schema = module.params['schema']
+        if schema_root:
+            store = get_referenced_schema_store(schema, schema_root, schema_root)
     else:
         raise Exception("Need either schema_file or schema")
 
     if module.params['schema_file']:
         schema_title = os.path.basename(schema_file)
-    elif 'title' in schema:
-        schema_title = schema['title']
     else:
-        schema_title = '<input>'
+        schema_title = get_schema_title(schema)
 
-    error_list = validate_schema(data, schema)
-    if error_list:
-        error_string = ','.join(error_list)
-        module.fail_json(msg="Schema Failed: {0}".format(error_string), failed_schema=schema_title, x_error_list=error_list)
+    errors, truncated, cached = validate_schema(data, schema, max_errors, compiled, cache_dir, result_cache, store)
+    if errors:
+        module.fail_json(msg="Schema Failed: {0}".format(join_errors(errors)),
+                         summary=summarize_errors(errors, truncated), failed_schema=schema_title,
+                         x_error_list=[format_error(error) for error in errors], errors=errors, truncated=truncated,
+                         cached=cached)
     else:
-        module.exit_json(changed=False, failed=False)
+        module.exit_json(changed=False, failed=False, cached=cached)
 
 
 if __name__ == '__main__':
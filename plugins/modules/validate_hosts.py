@@ -0,0 +1,143 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017 Cisco and/or its affiliates.
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1', 'status': ['preview'], 'supported_by': 'community'}
+
+
+DOCUMENTATION = r"""
+---
+module: validate_hosts
+short_description: Validate the data of many hosts against schemas on the controller
+description:
+  - Validate the data of many hosts against schemas in a pool of processes on the controller.
+  - Intended to be run with C(run_once) so that validation scales with controller cores rather than forks.
+  - This module is implemented as an action plugin and always runs on the controller.
+author:
+  - Steven Carter (@stevenca)
+requirements:
+  - jsonschema
+  - ipaddress
+version_added: '1.2.15'
+options:
+    hosts:
+        description: The hosts to validate. Defaults to C(ansible_play_hosts).
+        required: false
+        type: list
+        elements: str
+    data_var:
+        description: The host variable holding the data to validate
+        required: false
+        type: str
+        default: mdd_data
+    schemas:
+        description:
+          - A list of C({name, key, schema}) entries to check against every host.
+          - When not given, each host's own list is read from I(schemas_var).
+        required: false
+        type: list
+        elements: dict
+    schemas_var:
+        description: The host variable holding the host's list of C({name, key, schema}) entries
+        required: false
+        type: str
+        default: mdd_validate_schema_list
+    max_errors:
+        description: The maximum number of errors to report for each schema. C(0) means no limit.
+        required: false
+        type: int
+        default: 0
+    fail_fast:
+        description: Stop validating a host at its first error
+        required: false
+        type: bool
+        default: false
+    workers:
+        description: The number of worker processes. Defaults to the number of CPUs on the controller.
+        required: false
+        type: int
+    compile:
+        description:
+          - Turn each schema into specialized Python code before validating (see M(ciscops.mdd.data_validation)).
+        required: false
+        type: bool
+        default: false
+    compile_cache_dir:
+        description: The directory where code generated by I(compile) is kept for reuse by later runs
+        required: false
+        type: path
+    schema_root:
+        description:
+          - A directory of schemas that C($ref)s in the schemas can refer to by C($id), by path relative to
+            I(schema_root) or by C(file://) URI.
+          - The schemas are read once on the controller and shared by all hosts.
+        required: false
+        type: path
+    result_cache_dir:
+        description: The directory where validation results are kept for reuse when the data and schema have not changed
+        required: false
+        type: path
+    result_cache_size:
+        description: The maximum number of results kept in I(result_cache_dir)
+        required: false
+        type: int
+        default: 10000
+"""
+
+EXAMPLES = r"""
+- name: Validate all hosts on the controller
+  ciscops.mdd.validate_hosts:
+    max_errors: 100
+  register: validate_hosts_output
+  run_once: yes
+
+- name: Collect the failures for each host
+  set_fact:
+    validation_failures: "{{ validate_hosts_output.failures[inventory_hostname] }}"
+  when: validate_hosts_output.failures[inventory_hostname] | length
+"""
+
+RETURN = r"""
+results:
+    description: A dict of host to the per-schema results for that host
+    returned: always
+    type: dict
+failures:
+    description: A dict of host to the titles of the schemas that failed for that host
+    returned: always
+    type: dict
+report:
+    description:
+      - The consolidated validation report, grouping hosts with the same failures.
+      - C(truncated) gives, for each host, the schemas whose errors were cut short by I(max_errors) or I(fail_fast).
+    returned: always
+    type: dict
+    sample:
+      consolidated_report:
+        failures:
+          - hosts: [router1, router2]
+            schemas: [interfaces]
+        passed: [router3]
+        truncated:
+          router1: [interfaces]
+"""
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+# GNU General Public License v3.0+
+# (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+DOCUMENTATION = """
+    name: netbox_oc
+    version_added: "1.2.15"
+    short_description: Sets the OC data from NetBox as a variable of each host
+    requirements:
+        - pynetbox
+        - requests
+        - Enabled in configuration
+    description:
+        - Sets I(mdd_netbox_oc) for each host to the OC data of the device of the same name in NetBox, in the form
+          returned by the M(ciscops.mdd.netbox_oc) lookup.
+        - The first time a host's variables are needed, the devices for all the hosts in the inventory are fetched
+          from NetBox in bulk and turned into OC data.  Later hosts use that result, so NetBox is read once per run
+          rather than once per host.
+        - Hosts without a device in NetBox get an empty dict.
+        - Nothing is set when no NetBox API is configured.
+        - Enable it with C(vars_plugins_enabled = host_group_vars,ciscops.mdd.netbox_oc) in the C([defaults])
+          section of C(ansible.cfg), or with C(ANSIBLE_VARS_ENABLED).
+    options:
+        api_endpoint:
+            description: The URL of the NetBox instance
+            env:
+                - name: NETBOX_API
+                - name: NETBOX_URL
+            ini:
+                - section: ciscops.mdd.netbox_oc
+                  key: api_endpoint
+        token:
+            description: The API token for NetBox
+            env:
+                - name: NETBOX_TOKEN
+                - name: NETBOX_API_TOKEN
+        validate_certs:
+            description: Whether to check the TLS certificate of NetBox
+            type: bool
+            default: True
+            env:
+                - name: MDD_NETBOX_VALIDATE_CERTS
+            ini:
+                - section: ciscops.mdd.netbox_oc
+                  key: validate_certs
+        bulk_filter:
+            description:
+                - 'Filters that devices must also match, as a JSON object, e.g. C({"site": "hq"})'
+            type: str
+            default: '{}'
+            env:
+                - name: MDD_NETBOX_BULK_FILTER
+            ini:
+                - section: ciscops.mdd.netbox_oc
+                  key: bulk_filter
+        mode:
+            description: Fetch with the REST API (C(rest)) or with GraphQL queries (C(graphql))
+            type: str
+            default: rest
+            choices: [rest, graphql]
+            env:
+                - name: MDD_NETBOX_MODE
+            ini:
+                - section: ciscops.mdd.netbox_oc
+                  key: mode
+        raw_json:
+            description: Use the JSON from the REST API as is rather than building pynetbox objects
+            type: bool
+            default: False
+            env:
+                - name: MDD_NETBOX_RAW_JSON
+            ini:
+                - section: ciscops.mdd.netbox_oc
+                  key: raw_json
+        page_size:
+            description: The number of records to fetch per page
+            type: int
+            default: 1000
+        chunk_size:
+            description: The number of devices to fetch in each call
+            type: int
+            default: 200
+        max_workers:
+            description: The number of calls and pages to fetch concurrently
+            type: int
+            default: 4
+            env:
+                - name: MDD_NETBOX_MAX_WORKERS
+        cache_dir:
+            description:
+                - A directory where the records fetched from NetBox are kept between runs
+                  (see the M(ciscops.mdd.netbox_oc) lookup)
+            type: path
+            env:
+                - name: MDD_NETBOX_CACHE_DIR
+            ini:
+                - section: ciscops.mdd.netbox_oc
+                  key: cache_dir
+        cache_ttl:
+            description: The number of seconds for which cached records are used without checking NetBox
+            type: int
+            default: 3600
+            env:
+                - name: MDD_NETBOX_CACHE_TTL
+            ini:
+                - section: ciscops.mdd.netbox_oc
+                  key: cache_ttl
+        cache_incremental:
+            description: Refresh expired cached records by fetching only what has changed
+            type: bool
+            default: True
+        retries:
+            description: The number of times a request is retried when NetBox is overloaded or unavailable
+            type: int
+            default: 5
+            env:
+                - name: MDD_NETBOX_RETRIES
+        retry_backoff:
+            description: The number of seconds to wait before the first retry, doubled for each later retry
+            type: float
+            default: 0.5
+            env:
+                - name: MDD_NETBOX_RETRY_BACKOFF
+            ini:
+                - section: ciscops.mdd.netbox_oc
+                  key: retry_backoff
+        max_concurrency:
+            description: The most requests to NetBox in flight at once from the controller (C(0) for no limit)
+            type: int
+            default: 0
+            env:
+                - name: MDD_NETBOX_MAX_CONCURRENCY
+            ini:
+                - section: ciscops.mdd.netbox_oc
+                  key: max_concurrency
+        lock_dir:
+            description:
+                - The directory holding the lock files for I(max_concurrency)
+                - Defaults to a directory for the user and I(api_endpoint) in the system temporary directory
+            type: path
+            env:
+                - name: MDD_NETBOX_LOCK_DIR
+            ini:
+                - section: ciscops.mdd.netbox_oc
+                  key: lock_dir
+        var_name:
+            description: The name of the host variable to set
+            type: str
+            default: mdd_netbox_oc
+            ini:
+                - section: ciscops.mdd.netbox_oc
+                  key: var_name
+    extends_documentation_fragment:
+        - vars_plugin_staging
+"""
+
+EXAMPLES = """
+# ansible.cfg
+# [defaults]
+# vars_plugins_enabled = host_group_vars,ciscops.mdd.netbox_oc
+
+- name: Show the NetBox OC data for each host
+  debug:
+    msg: "{{ mdd_netbox_oc }}"
+"""
+
+import json
+
+from ansible.errors import AnsibleError
+from ansible.inventory.host import Host
+from ansible.module_utils.six import raise_from
+from ansible.plugins.vars import BaseVarsPlugin
+from ansible.utils.display import Display
+
+from ansible_collections.ciscops.mdd.plugins.module_utils.netbox_oc import (
+    PYNETBOX_LIBRARY_IMPORT_ERROR, REQUESTS_LIBRARY_IMPORT_ERROR, NetboxCache, NetboxFetcher, bulk_to_oc, get_netbox
+)
+
+display = Display()
+
+# The OC data by device name for each set of options, so that NetBox is only
+# read once however many hosts (and inventory sources) ask for it
+_oc_data = {}
+
+
+class VarsModule(BaseVarsPlugin):
+
+    def get_vars(self, loader, path, entities, cache=True):
+        if not isinstance(entities, list):
+            entities = [entities]
+        super(VarsModule, self).get_vars(loader, path, entities)
+
+        hosts = [entity for entity in entities if isinstance(entity, Host)]
+        api_endpoint = self.get_option("api_endpoint")
+        if not hosts or not api_endpoint:
+            return {}
+
+        oc_data = self.oc_data(api_endpoint, hosts[0])
+        data = {}
+        for host in hosts:
+            data[self.get_option("var_name")] = oc_data.get(host.name, {})
+        return data
+
+    def oc_data(self, api_endpoint, host):
+        """
+        Return the OC data by device name for all the hosts in the inventory
+        of host, fetching it from NetBox the first time
+        """
+        try:
+            bulk_filter = json.loads(self.get_option("bulk_filter") or "{}")
+        except ValueError as e:
+            raise_from(AnsibleError("bulk_filter must be a JSON object: {0}".format(e)), e)
+        if not isinstance(bulk_filter, dict):
+            raise AnsibleError("bulk_filter must be a JSON object, not {0}".format(self.get_option("bulk_filter")))
+        names = sorted(set(member.name for group in host.get_groups() if group.name == "all"
+                           for member in group.get_hosts())) or [host.name]
+        key = (api_endpoint, self.get_option("token"), json.dumps(bulk_filter, sort_keys=True), tuple(names),
+               self.get_option("mode"))
+        if key in _oc_data:
+            return _oc_data[key]
+
+        if PYNETBOX_LIBRARY_IMPORT_ERROR:
+            raise_from(AnsibleError("pynetbox must be installed to use this plugin"), PYNETBOX_LIBRARY_IMPORT_ERROR)
+        if REQUESTS_LIBRARY_IMPORT_ERROR:
+            raise_from(AnsibleError("requests must be installed to use this plugin"), REQUESTS_LIBRARY_IMPORT_ERROR)
+
+        token = self.get_option("token")
+        max_workers = self.get_option("max_workers")
+        netbox_cache = None
+        if self.get_option("cache_dir"):
+            netbox_cache = NetboxCache(self.get_option("cache_dir"), api_endpoint, token, self.get_option("cache_ttl"),
+                                       self.get_option("cache_incremental"))
+        netbox = get_netbox(api_endpoint, token, self.get_option("validate_certs"), max_workers * 2,
+                            self.get_option("retries"), self.get_option("retry_backoff"),
+                            self.get_option("max_concurrency"), self.get_option("lock_dir"))
+        display.vvv("netbox_oc: fetching OC data for %d hosts from %s" % (len(names), api_endpoint))
+        with NetboxFetcher(netbox, self.get_option("page_size"), self.get_option("chunk_size"), max_workers,
+                           netbox_cache, self.get_option("raw_json")) as fetcher:
+            _oc_data[key] = bulk_to_oc(fetcher, names, bulk_filter, self.get_option("mode"))
+        return _oc_data[key]
@@ -0,0 +1,140 @@
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+import os
+
+import pytest
+from jsonschema import Draft7Validator, Draft202012Validator
+from jsonschema.exceptions import SchemaError
+
+from ansible_collections.ciscops.mdd.plugins.module_utils import datavalidation
+from ansible_collections.ciscops.mdd.plugins.module_utils.datavalidation import (
+    MDD202012Validator, MDDValidator, ResultCache, collect_cached_errors, collect_errors, consolidate_report,
+    get_referenced_schema_store, validate_hosts, with_file_id
+)
+
+
+def test_result_cache_is_kept_apart_by_compile(tmp_path):
+    result_cache = ResultCache(str(tmp_path))
+    schema = {"type": "object", "properties": {"a:b": {"type": "string"}}}
+    data = {"a:b": 1}
+    interpreted = collect_cached_errors(data, schema, MDD202012Validator, result_cache=result_cache)
+    compiled = collect_cached_errors(data, schema, MDD202012Validator, compiled=True, result_cache=result_cache)
+    assert not interpreted[2] and not compiled[2]
+    assert collect_cached_errors(data, schema, MDD202012Validator, result_cache=result_cache) == \
+        interpreted[:2] + (True,)
+    assert collect_cached_errors(data, schema, MDD202012Validator, compiled=True, result_cache=result_cache) == \
+        compiled[:2] + (True,)
+    assert len(result_cache.list()) == 2
+
+
+def test_referenced_schema_store_reads_only_referenced_files(tmp_path):
+    (tmp_path / "defs").mkdir()
+    (tmp_path / "defs" / "common.json").write_text(json.dumps({
+        "$defs": {"name": {"type": "string"}, "mtu": {"$ref": "mtu.yml"}}
+    }))
+    (tmp_path / "defs" / "mtu.yml").write_text("type: integer\nmaximum: 9216\n")
+    (tmp_path / "unrelated.json").write_text('{"type": "null"}')
+    (tmp_path / "template.json").write_text("{{ not json }}")
+    schema_file = str(tmp_path / "main.json")
+    schema = with_file_id({
+        "type": "object",
+        "properties": {
+            "name": {"$ref": "defs/common.json#/$defs/name"},
+            "mtu": {"$ref": "defs/common.json#/$defs/mtu"},
+            "self": {"$ref": "#/properties/name"}
+        }
+    }, schema_file)
+
+    store = get_referenced_schema_store(schema, schema_file)
+    assert sorted(os.path.relpath(path, str(tmp_path)) for path in store.schemas) == \
+        [os.path.join("defs", "common.json"), os.path.join("defs", "mtu.yml")]
+    errors, truncated = collect_errors({"name": 1, "mtu": 10000}, schema, MDD202012Validator, store=store)
+    assert [(error["json_path"], error["validator"]) for error in errors] == [("$.name", "type"), ("$.mtu", "maximum")]
+
+
+@pytest.mark.parametrize("cls,base", [(MDD202012Validator, Draft202012Validator), (MDDValidator, Draft7Validator)],
+                         ids=["2020-12", "draft7"])
+def test_meta_schema_allows_ipaddress_type(cls, base):
+    schema = {"type": "object", "properties": {"address": {"type": "ipaddress"}, "mtu": {"type": ["integer", "null"]}}}
+    cls.check_schema(schema)
+    with pytest.raises(SchemaError):
+        cls.check_schema({"properties": {"address": {"type": "ip"}}})
+    with pytest.raises(SchemaError):
+        base.check_schema(schema)
+
+
+HOST_SCHEMAS = [{"name": "mtu", "schema": {"properties": {"mtu": {"type": "integer", "maximum": 9216}}}}]
+
+
+def validate_many(workers):
+    host_data = dict(("host{0}".format(index), {"mdd:openconfig": {"mtu": 1500 if index % 2 else 10000}})
+                     for index in range(8))
+    return validate_hosts(host_data, dict((host, HOST_SCHEMAS) for host in host_data), workers=workers)
+
+
+def test_validate_hosts_with_workers():
+    results = validate_many(workers=1)
+    assert [host for host, host_results in sorted(results.items()) if host_results[0]["failed"]] == \
+        ["host0", "host2", "host4", "host6"]
+    assert validate_many(workers=4) == results
+
+
+def test_validate_hosts_falls_back_to_one_process(monkeypatch):
+    expected = validate_many(workers=1)
+
+    def broken_pool(*args, **kwargs):
+        raise OSError("no semaphores")
+
+    monkeypatch.setattr(datavalidation, "ProcessPoolExecutor", broken_pool)
+    assert validate_many(workers=4) == expected
+    monkeypatch.setattr(datavalidation.multiprocessing, "get_all_start_methods", lambda: ["spawn"])
+    assert validate_many(workers=4) == expected
+
+
+def test_referenced_schema_store_from_schema_root(tmp_path):
+    (tmp_path / "defs").mkdir()
+    (tmp_path / "defs" / "common.json").write_text(json.dumps({"$defs": {"mtu": {"$ref": "mtu.yml"}}}))
+    (tmp_path / "defs" / "mtu.yml").write_text("type: integer\nmaximum: 9216\n")
+    (tmp_path / "unrelated.json").write_text('{"type": "null"}')
+    schema_root = str(tmp_path)
+    schemas = [{"properties": {"mtu": {"$ref": "defs/common.json#/$defs/mtu"}}}, {"type": "object"}]
+
+    store = get_referenced_schema_store(schemas, schema_root, schema_root)
+    assert sorted(os.path.relpath(path, schema_root) for path in store.schemas) == \
+        [os.path.join("defs", "common.json"), os.path.join("defs", "mtu.yml")]
+    errors, truncated = collect_errors({"mtu": 10000}, schemas[0], MDD202012Validator, store=store)
+    assert [(error["json_path"], error["validator"]) for error in errors] == [("$.mtu", "maximum")]
+
+
+def test_result_cache_only_lists_directory_to_evict(monkeypatch, tmp_path):
+    listed = []
+    list_cache = ResultCache.list
+
+    def counted_list(self):
+        listed.append(self.cache_dir)
+        return list_cache(self)
+
+    monkeypatch.setattr(ResultCache, "list", counted_list)
+    result_cache = ResultCache(str(tmp_path), 10)
+    for index in range(30):
+        result_cache.put("key{0}".format(index), [], False)
+    # With room for ten, the size is checked on every put and the oldest are removed
+    assert len(listed) == 30
+    assert len(list_cache(result_cache)) <= 10
+
+    del listed[:]
+    result_cache = ResultCache(str(tmp_path / "large"))
+    monkeypatch.setattr(datavalidation.random, "randrange", lambda interval: interval - 1)
+    for index in range(30):
+        result_cache.put("key{0}".format(index), [], False)
+    assert listed == []
+    assert len(list_cache(result_cache)) == 30
+
+
+def test_consolidate_report_lists_truncated_schemas():
+    report = consolidate_report({"r1": ["interfaces"], "r2": ["interfaces"], "r3": []},
+                                {"r1": ["interfaces"], "r2": [], "r3": []})
+    assert report == {"consolidated_report": {"failures": [{"hosts": ["r1", "r2"], "schemas": ["interfaces"]}],
+                                              "passed": ["r3"], "truncated": {"r1": ["interfaces"]}}}
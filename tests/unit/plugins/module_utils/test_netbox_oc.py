@@ -0,0 +1,102 @@
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import io
+import time
+
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+
+from ansible_collections.ciscops.mdd.plugins.module_utils.netbox_oc import (
+    NetboxAdapter, NetboxFetcher, device_to_oc, get_netbox
+)
+
+INTERFACE = {
+    "id": 1, "name": "GigabitEthernet2", "description": "", "enabled": True, "mtu": None,
+    "type": {"value": "1000base-t"}, "mode": None, "untagged_vlan": None, "tagged_vlans": [],
+    "device": {"id": 10, "name": "edge-rtr"}, "count_ipaddresses": 0
+}
+
+IPADDRESS = {
+    "id": 100, "address": "10.0.0.1/24", "family": {"value": 4}, "status": {"value": "active"},
+    "vrf": None, "assigned_object_type": "dcim.interface", "assigned_object_id": 1
+}
+
+
+def addresses(oc_data):
+    return [address["openconfig-if-ip:ip"]
+            for interface in oc_data["openconfig-interfaces:interfaces"]["openconfig-interfaces:interface"]
+            for subinterface in interface.get("openconfig-interfaces:subinterfaces", {}).get(
+                "openconfig-interfaces:subinterface", [])
+            for address in subinterface["openconfig-if-ip:ipv4"]["openconfig-if-ip:addresses"][
+                "openconfig-if-ip:address"]]
+
+
+def test_stale_address_count_is_recounted():
+    # A cached interface keeps the count from before the address was assigned
+    assert addresses(device_to_oc([INTERFACE], [IPADDRESS], [], {})) == ["10.0.0.1"]
+    assert INTERFACE["count_ipaddresses"] == 0
+
+
+class FakeFetcher(NetboxFetcher):
+
+    def __init__(self, changed):
+        super(FakeFetcher, self).__init__(None)
+        self.changed = changed
+        self.checked = []
+
+    def changed_since(self, resource, since):
+        self.checked.append(resource)
+        return resource in self.changed
+
+    def fetch(self, resource, filters=None):
+        if filters.get("brief"):
+            return [{"id": 1}]
+        return []
+
+
+def test_refresh_falls_back_when_nested_resources_change():
+    entry = {"fetched": time.time() - 7200, "records": [dict(IPADDRESS, vrf={"id": 5, "name": "old"})]}
+    fetcher = FakeFetcher(changed=["vrfs"])
+    assert fetcher.refresh("ip-addresses", {}, entry) is None
+    assert fetcher.checked == ["vrfs"]
+
+    fetcher = FakeFetcher(changed=[])
+    assert fetcher.refresh("interfaces", {}, {"fetched": entry["fetched"], "records": [INTERFACE]}) == [INTERFACE]
+    assert fetcher.checked == ["vlans"]
+
+
+@pytest.mark.parametrize("method,status,attempts", [("GET", 502, 3), ("GET", 429, 3), ("POST", 502, 1),
+                                                    ("POST", 429, 3)])
+def test_only_idempotent_requests_are_retried_on_5xx(monkeypatch, method, status, attempts):
+    sent = []
+
+    def send(self, request, **kwargs):
+        sent.append(request)
+        response = requests.Response()
+        response.status_code = status
+        response.raw = io.BytesIO(b"")
+        return response
+
+    monkeypatch.setattr(HTTPAdapter, "send", send)
+    request = requests.Request(method, "https://netbox.example.com/graphql/").prepare()
+    response = NetboxAdapter(retries=2, backoff=0).send(request)
+    assert response.status_code == status
+    assert len(sent) == attempts
+
+
+def test_replaced_adapter_is_closed(monkeypatch):
+    closed = []
+    monkeypatch.setattr(HTTPAdapter, "close", lambda self: closed.append(self))
+    netbox = get_netbox("https://netbox-close.example.com", retries=5)
+    adapter = netbox.http_session.get_adapter(netbox.base_url)
+    # The session's default adapters are replaced
+    assert len(closed) == 2 and adapter not in closed
+    del closed[:]
+    assert get_netbox("https://netbox-close.example.com", retries=5) is netbox
+    assert closed == []
+
+    get_netbox("https://netbox-close.example.com", retries=2)
+    assert adapter in closed
+    assert netbox.http_session.get_adapter(netbox.base_url).retries == 2
@@ -0,0 +1,145 @@
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+
+import pytest
+
+from ansible_collections.ciscops.mdd.plugins.module_utils.datavalidation import (
+    MDD202012Validator, MDDValidator, collect_errors
+)
+from ansible_collections.ciscops.mdd.plugins.module_utils import schemacompiler
+
+LONG_PATTERN = "^(" + "|".join("Ethernet{0}/[0-9]+".format(slot) for slot in range(40)) + ")$"
+
+INTERFACES_SCHEMA = {
+    "type": "object",
+    "required": ["openconfig-interfaces:interfaces"],
+    "properties": {
+        "openconfig-interfaces:interfaces": {
+            "type": "object",
+            "properties": {
+                "openconfig-interfaces:interface": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "required": ["openconfig-interfaces:name"],
+                        "additionalProperties": False,
+                        "properties": {
+                            "openconfig-interfaces:name": {"type": "string", "pattern": LONG_PATTERN},
+                            "openconfig-interfaces:config": {
+                                "type": "object",
+                                "properties": {
+                                    "openconfig-interfaces:mtu": {"type": "integer", "minimum": 64, "maximum": 9216},
+                                    "openconfig-interfaces:enabled": {"type": "boolean"},
+                                    "address": {"type": "ipaddress", "in_subnet": "10.0.0.0/8"},
+                                    "it's": {"type": "string"}
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+}
+
+INTERFACES_DATA = {
+    "openconfig-interfaces:interfaces": {
+        "openconfig-interfaces:interface": [
+            {
+                "openconfig-interfaces:name": "Ethernet1/1",
+                "openconfig-interfaces:config": {"openconfig-interfaces:mtu": 1500, "address": "10.1.1.1"}
+            },
+            {
+                "openconfig-interfaces:name": "Ethernet99/1",
+                "openconfig-interfaces:config": {
+                    "openconfig-interfaces:mtu": 10,
+                    "openconfig-interfaces:enabled": "yes",
+                    "address": "192.168.1.1",
+                    "it's": 1
+                },
+                "unexpected": True,
+                "also-unexpected": 1
+            },
+            {"openconfig-interfaces:config": {"address": "not an address"}}
+        ]
+    }
+}
+
+CASES = [
+    ("openconfig keys", INTERFACES_SCHEMA, INTERFACES_DATA),
+    ("items false", {"type": "array", "items": False}, [1, 2]),
+    ("items false single", {"type": "array", "items": False}, [1]),
+    ("items false empty", {"type": "array", "items": False}, []),
+    ("false subschemas", {
+        "type": "object",
+        "properties": {"a": False, "b": {"properties": {"c": False}}, "d": {"type": "array", "items": False}}
+    }, {"a": 1, "b": {"c": 2}, "d": [3]}),
+    ("items true", {"type": "array", "items": True}, [1, "a"]),
+    ("long pattern", {"type": "string", "pattern": LONG_PATTERN}, "Ethernet99/1"),
+    ("additional properties schema", {
+        "type": "object",
+        "properties": {"a": {"type": "string"}},
+        "additionalProperties": {"type": "string", "maxLength": 2}
+    }, {"a": "x", "b": "long", "c": 1, "d": "ok", "e": "longer", "f:g": 2}),
+    ("additional properties false", {
+        "properties": {"a": {}},
+        "additionalProperties": False
+    }, {"a": 1, "z": 1, "y": 2, "x": 3}),
+    ("enum and const", {
+        "type": "object",
+        "properties": {"e": {"enum": ["up", "down"]}, "n": {"enum": [1, None]}, "c": {"const": "x"}}
+    }, {"e": "sideways", "n": 2, "c": "y"}),
+    ("fallback", {
+        "type": "object",
+        "properties": {"any": {"anyOf": [{"type": "string"}, {"type": "integer"}]}, "list": {"minItems": 2}}
+    }, {"any": [], "list": [1]}),
+]
+
+
+def interpreted(data, schema, cls):
+    return collect_errors(data, schema, cls)
+
+
+@pytest.mark.parametrize("cls", [MDD202012Validator, MDDValidator], ids=["2020-12", "draft7"])
+@pytest.mark.parametrize("name,schema,data", CASES, ids=[case[0] for case in CASES])
+def test_compiled_errors_match_jsonschema(name, schema, data, cls):
+    assert collect_errors(data, schema, cls, compiled=True) == interpreted(data, schema, cls)
+
+
+def test_openconfig_keys_are_quoted():
+    errors, truncated = collect_errors(INTERFACES_DATA, INTERFACES_SCHEMA, MDD202012Validator, compiled=True)
+    paths = [error["json_path"] for error in errors]
+    assert "$['openconfig-interfaces:interfaces']['openconfig-interfaces:interface'][1]" in paths
+    assert not truncated
+
+
+def test_items_false_is_one_error():
+    errors, truncated = collect_errors([1, 2], {"items": False}, MDD202012Validator, compiled=True)
+    assert [(error["json_path"], error["validator"]) for error in errors] == [("$", "items")]
+    assert errors[0]["message"].startswith("Expected at most 0 items")
+
+
+def test_cached_source_with_long_pattern(tmp_path):
+    pattern = LONG_PATTERN.replace("^(", "^(Loopback0|")
+    schema = {"type": "object", "properties": {"name": {"type": "string", "pattern": pattern}}}
+    data = {"name": "Ethernet99/1"}
+    expected = interpreted(data, schema, MDD202012Validator)
+    assert expected[0]
+    for _ in range(2):
+        # The second run reads the source written by the first
+        schemacompiler._compiled.clear()
+        assert collect_errors(data, schema, MDD202012Validator, compiled=True, cache_dir=str(tmp_path)) == expected
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_untrusted_cache_is_not_used(tmp_path):
+    schema = {"type": "string", "maxLength": 1}
+    collect_errors("ab", schema, MDD202012Validator, compiled=True, cache_dir=str(tmp_path))
+    cache_file = next(tmp_path.iterdir())
+    cache_file.write_text("def validate(instance):\n    raise RuntimeError('cached code was run')\n")
+    os.chmod(str(cache_file), 0o666)
+    schemacompiler._compiled.clear()
+    assert collect_errors("ab", schema, MDD202012Validator, compiled=True, cache_dir=str(tmp_path)) == \
+        interpreted("ab", schema, MDD202012Validator)
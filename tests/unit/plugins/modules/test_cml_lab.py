@@ -0,0 +1,145 @@
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+
+import pytest
+import yaml
+
+from ansible.module_utils import basic
+from ansible.module_utils.common.text.converters import to_bytes
+
+from ansible_collections.ciscops.mdd.plugins.module_utils import graph
+from ansible_collections.ciscops.mdd.plugins.modules import cml_lab
+
+try:
+    from ansible.module_utils.testing import patch_module_args
+except ImportError:
+    patch_module_args = None
+
+HEADER = ("\r\nCapability Codes: R - Router, T - Trans Bridge, B - Source Route Bridge\r\n"
+          "                  S - Switch, H - Host, I - IGMP, r - Repeater, P - Phone,\r\n"
+          "                  D - Remote, C - CVTA, M - Two-port Mac Relay\r\n\r\n"
+          "Device ID        Local Intrfce     Holdtme    Capability  Platform  Port ID\r\n")
+
+DEVICE_TEMPLATE = {
+    "switch": {"node_definition": "iosvl2", "ram": 768, "tags": ["switch"], "type": "switch"},
+    "router": {"node_definition": "csr1000v", "ram": 3072, "tags": ["router"], "type": "router"},
+    "l3switch": {"node_definition": "iosvl2", "ram": 768, "tags": ["l3switch"], "type": "l3switch"},
+    "ext_conn": {"node_definition": "external_connector", "ram": 0, "tags": []},
+}
+
+
+class AnsibleExitJson(Exception):
+    pass
+
+
+class AnsibleFailJson(Exception):
+    pass
+
+
+def exit_json(self, **kwargs):
+    raise AnsibleExitJson(kwargs)
+
+
+def fail_json(self, **kwargs):
+    raise AnsibleFailJson(kwargs)
+
+
+def ring(count):
+    """
+    Devices dev0 to dev<count - 1> linked in a ring, each with the text of show cdp neighbors
+    """
+    devices = []
+    for index in range(count):
+        lines = []
+        for neighbour, local, remote in (((index - 1) % count, 1, 2), ((index + 1) % count, 2, 1)):
+            lines.append("{0:<16} Gig 0/{1:<11} 155              R I         CSR1000V  Gig 0/{2}".format(
+                "dev{0}".format(neighbour), local, remote))
+        devices.append({"hostname": "dev{0}".format(index), "tags": ["network"],
+                        "cdp": HEADER + "\r\n".join(lines) + "\r\n"})
+    return devices
+
+
+def run_module(monkeypatch, expect=AnsibleExitJson, **args):
+    args = dict(device_template=DEVICE_TEMPLATE, default_mappings={}, **args)
+    monkeypatch.setattr(basic.AnsibleModule, "exit_json", exit_json)
+    monkeypatch.setattr(basic.AnsibleModule, "fail_json", fail_json)
+    with pytest.raises(expect) as result:
+        if patch_module_args is not None:
+            with patch_module_args(args):
+                cml_lab.main()
+        else:
+            monkeypatch.setattr(basic, "_ANSIBLE_ARGS", to_bytes(json.dumps({"ANSIBLE_MODULE_ARGS": args})))
+            cml_lab.main()
+    return result.value.args[0]
+
+
+def test_partition_with_existing_topology(monkeypatch, tmp_path):
+    topology_file = str(tmp_path / "cml_lab.yaml")
+    # An earlier run with fewer devices gives the devices of this run different node ids
+    run_module(monkeypatch, devices=ring(12)[4:], topology_file=topology_file)
+    result = run_module(monkeypatch, devices=ring(12), existing_topology=topology_file,
+                        partition={"max_nodes": 4})
+
+    assert result["delta"]["nodes"]["removed"] == []
+    labels = dict((node["id"], node["label"]) for node in result["topology"]["nodes"])
+    assert len(result["partitions"]) == 3
+    for partition in result["partitions"]:
+        devices = [node["label"] for node in partition["topology"]["nodes"] if node["label"].startswith("dev")]
+        assert sorted(devices) == partition["devices"]
+        for node in partition["topology"]["nodes"]:
+            if node["label"].startswith("dev"):
+                assert labels[node["id"]] == node["label"]
+        for device in partition["devices"]:
+            assert result["mappings"][device]["cml_lab_partition"] == partition["name"]
+    cut = sum(partition["cut_links"] for partition in result["partitions"])
+    kept = sum(1 for partition in result["partitions"] for link in partition["topology"]["links"]
+               if not link["label"].split("<->")[1].startswith("ext-conn"))
+    assert kept + cut // 2 == sum(1 for link in result["topology"]["links"]
+                                  if not link["label"].split("<->")[1].startswith("ext-conn"))
+
+
+@pytest.mark.parametrize("layout,library", [("spring", "numpy"), ("planar", "numpy"), ("spectral", "scipy"),
+                                            ("kamada_kawai", "scipy")])
+def test_layout_without_its_libraries_fails(monkeypatch, layout, library):
+    monkeypatch.setattr(graph, "NETWORKX_IMPORT_ERROR", None)
+    monkeypatch.setattr(graph, "NUMPY_IMPORT_ERROR", None)
+    monkeypatch.setattr(graph, "SCIPY_IMPORT_ERROR", None)
+    monkeypatch.setattr(graph, library.upper() + "_IMPORT_ERROR", "ImportError: No module named " + library)
+    result = run_module(monkeypatch, expect=AnsibleFailJson, devices=ring(3), layout=layout)
+    assert "({0})".format(library) in result["msg"]
+
+
+def positions(topology):
+    return dict((node["label"], (node["x"], node["y"])) for node in topology["nodes"])
+
+
+@pytest.mark.parametrize("content", [None, ""])
+def test_missing_existing_topology_keeps_layout(monkeypatch, tmp_path, content):
+    existing_file = tmp_path / "cml_lab.yaml"
+    if content is not None:
+        existing_file.write_text(content)
+    # Enough devices that the row of devices runs past an external connector in the same row
+    fresh = run_module(monkeypatch, devices=ring(50), ext_conn=True)
+    result = run_module(monkeypatch, devices=ring(50), ext_conn=True, existing_topology=str(existing_file))
+
+    assert positions(result["topology"]) == positions(fresh["topology"])
+
+
+def test_new_nodes_only_move_off_old_nodes(monkeypatch, tmp_path):
+    topology_file = str(tmp_path / "cml_lab.yaml")
+    run_module(monkeypatch, devices=ring(6)[2:], topology_file=topology_file)
+    fresh = run_module(monkeypatch, devices=ring(6))
+    result = run_module(monkeypatch, devices=ring(6), existing_topology=topology_file)
+
+    with open(topology_file) as f:
+        old = positions(yaml.safe_load(f))
+    placed = positions(fresh["topology"])
+    new = positions(result["topology"])
+    assert len(set(new.values())) == len(new)
+    for label, position in new.items():
+        if label in old:
+            assert position == old[label]
+        elif placed[label] not in old.values():
+            assert position == placed[label]